@@ -3,24 +3,23 @@
 
 import logging
 from bottle import Bottle, run, TEMPLATE_PATH
-from waitress import serve
+from waitress import create_server
 
 from config import Config
 from models.database import init_database
+from models.user import load_known_users
+from services.backup_service import backup_service
+from services.retention_service import retention_service
 from handlers.lark_handler import setup_lark_routes
 from handlers.webhook_handler import setup_webhook_routes
 from handlers.admin_handler import setup_admin_routes
+from handlers.metrics_handler import setup_metrics_routes
 from utils.helpers import init_static_dir
+from utils.metrics import register_waitress
+from utils.logging_config import setup_logging
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('lark_bot.log'),
-        logging.StreamHandler()
-    ]
-)
+# 配置日志：异步写入，按大小或时间轮转
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # 配置模板路径
@@ -35,12 +34,18 @@ def setup_routes():
     setup_lark_routes(app)
     setup_webhook_routes(app)
     setup_admin_routes(app)
+    setup_metrics_routes(app)
 
 
 def main():
     """主入口函数"""
     # 初始化数据库
     init_database()
+    load_known_users()
+
+    # 定时热备份数据库，定时清理过期数据
+    backup_service.start_scheduler()
+    retention_service.start_scheduler()
 
     # 初始化静态文件目录
     init_static_dir()
@@ -58,7 +63,11 @@ def main():
 
     try:
         logger.info("使用waitress服务器启动应用")
-        serve(app, host='0.0.0.0', port=8080, threads=10)
+        server = create_server(app, host='0.0.0.0', port=8080, threads=10)
+        # /metrics 输出请求队列长度和工作线程占用
+        register_waitress(server)
+        server.print_listen("Serving on http://{}:{}")
+        server.run()
     except ImportError:
         logger.warning("未检测到waitress，使用Bottle默认服务器")
         app.run(host='0.0.0.0', port=8080, debug=False, server='auto')
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+热点辅助函数微基准测试
+
+覆盖每条消息都会调用的函数：is_markdown、remove_mentions_improved、clean_command_args、parse_utf8、
+format_data_for_ai、encode_multipart_formdata 以及 process_dify_stream 的SSE解析循环，
+输入包括超长Markdown回答、大型告警数据和跨越多个数据块的大事件。
+
+耗时以校准负载（固定的纯Python计算）为单位记录，基线可以在不同机器之间比较。
+--check 与基线对比，任何用例慢于基线超过阈值时返回非零退出码。
+
+用法:
+    python benchmarks/bench_helpers.py                    # 只输出结果
+    python benchmarks/bench_helpers.py --check            # 与基线对比（make bench）
+    python benchmarks/bench_helpers.py --update-baseline  # 更新基线（make bench-baseline）
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+BASELINE_PATH = os.path.join(ROOT_DIR, "benchmarks", "baselines", "helpers.json")
+DEFAULT_THRESHOLD = 0.5
+
+PROSE = ("服务器在凌晨出现了连接超时，数据库的慢查询数量明显上升，运维同学已经扩容了只读实例。"
+         "The deploy pipeline finished in twelve minutes and all health checks passed. ")
+
+
+def markdown_answer(sections):
+    """模拟大模型生成的长Markdown回答"""
+    parts = []
+    for i in range(sections):
+        parts.append(f"## 第{i + 1}部分\n\n{PROSE * 3}\n\n- 要点一：**{PROSE[:20]}**\n- 要点二：`config.yaml`\n"
+                     f"1. 步骤一\n2. 步骤二\n\n> 注意：{PROSE[:30]}\n\n```python\nprint('hello {i}')\n```\n\n"
+                     f"参考[文档](https://example.com/docs/{i})\n\n---\n")
+    return "\n".join(parts)
+
+
+def alert_payload(count):
+    """模拟Prometheus Alertmanager的告警数据"""
+    return {
+        "receiver": "lark-bot",
+        "status": "firing",
+        "alerts": [{
+            "status": "firing",
+            "labels": {"alertname": "HighCPU", "instance": f"host-{i}:9100", "severity": "critical", "job": "node"},
+            "annotations": {"summary": f"host-{i} CPU使用率过高", "description": PROSE},
+            "startsAt": "2024-01-01T00:00:00Z",
+            "fingerprint": f"{i:016x}",
+        } for i in range(count)],
+        "groupLabels": {"alertname": "HighCPU"},
+        "externalURL": "http://alertmanager:9093",
+    }
+
+
+def sse_stream(tokens, large_event_size=0):
+    """构造Dify流式响应：可选的大型工作流事件 + 逐token的message事件 + message_end"""
+    events = []
+    if large_event_size:
+        events.append({"event": "node_finished", "task_id": "t1",
+                       "data": {"outputs": {"text": "x" * large_event_size}}})
+    events.extend({"event": "message", "task_id": "t1", "answer": "模拟回答 "} for _ in range(tokens))
+    events.append({"event": "message_end", "task_id": "t1", "conversation_id": "c1"})
+    return b"".join(b"data: " + json.dumps(event, ensure_ascii=False).encode('utf-8') + b"\n\n" for event in events)
+
+
+class FakeRequest:
+    """提供parse_utf8需要的request.body"""
+
+    def __init__(self, body):
+        self._body = body
+
+    @property
+    def body(self):
+        return io.BytesIO(self._body)
+
+
+def build_cases():
+    """返回 [(用例名称, 无参函数)]"""
+    import urllib.parse
+    from utils.helpers import (is_markdown, remove_mentions_improved, clean_command_args, parse_utf8,
+                               format_data_for_ai)
+    from services import dify_service
+
+    # 只测量SSE解析，不写入数据库
+    dify_service.add_message = lambda *args, **kwargs: None
+    dify_service.update_session_conversation = lambda *args, **kwargs: None
+
+    short_plain = PROSE[:50]
+    long_plain = PROSE * 300
+    huge_markdown = markdown_answer(300)
+    markdown_at_end = PROSE * 300 + "\n\n**总结**"
+    mentions = [{"key": f"@_user_{i}", "name": name, "id": {"open_id": f"ou_{i}"}}
+                for i, name in enumerate(["飞书机器人", "张三", "李四"], 1)]
+    group_text = "@_user_1 @_user_2 帮我看一下 @_user_3 昨天的告警为什么没有恢复通知"
+    form_body = urllib.parse.urlencode({f"field{i}": PROSE for i in range(50)}).encode('utf-8')
+    small_alert = alert_payload(3)
+    large_alert = alert_payload(500)
+    image = os.urandom(1024 * 1024)
+    stream_tokens = sse_stream(2000)
+    stream_large_event = sse_stream(10, large_event_size=2 * 1024 * 1024)
+
+    def stream_case(data):
+        def run():
+            for _ in dify_service.process_dify_stream(io.BufferedReader(io.BytesIO(data)), 1, "ou_bench"):
+                pass
+        return run
+
+    return [
+        ("is_markdown[short_plain]", lambda: is_markdown(short_plain)),
+        ("is_markdown[long_plain]", lambda: is_markdown(long_plain)),
+        ("is_markdown[huge_markdown]", lambda: is_markdown(huge_markdown)),
+        ("is_markdown[markdown_at_end]", lambda: is_markdown(markdown_at_end)),
+        ("remove_mentions_improved", lambda: remove_mentions_improved(group_text, mentions)),
+        ("clean_command_args", lambda: clean_command_args("token-abc123 @_user_1 @飞书机器人")),
+        ("parse_utf8", lambda: parse_utf8(FakeRequest(form_body))),
+        ("format_data_for_ai[small_alert]", lambda: format_data_for_ai(small_alert)),
+        ("format_data_for_ai[large_alert]", lambda: format_data_for_ai(large_alert)),
+        ("encode_multipart_formdata[1MB]", lambda: dify_service.encode_multipart_formdata(
+            {"file": {"filename": "image.jpg", "content": image, "content_type": "image/jpeg"}},
+            {"user": "ou_bench"})),
+        ("process_dify_stream[2000_tokens]", stream_case(stream_tokens)),
+        ("process_dify_stream[2MB_event]", stream_case(stream_large_event)),
+    ]
+
+
+def measure(func, repeat=5, target_seconds=0.05):
+    """自动确定循环次数，返回多轮中最快的单次耗时（秒）"""
+    number = 1
+    while True:
+        started_at = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - started_at
+        if elapsed >= target_seconds or number >= 1000000:
+            break
+        number *= 2 if elapsed < target_seconds / 4 else 1 + int(target_seconds / max(elapsed, 1e-9))
+
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        started_at = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - started_at) / number)
+    return best
+
+
+def calibrate():
+    """校准负载：固定的纯Python计算，用作耗时单位以抵消机器性能差异"""
+    def workload():
+        total = 0
+        for i in range(20000):
+            total += i * i % 7
+        return json.loads(json.dumps([str(i) for i in range(2000)]))
+    return measure(workload)
+
+
+def score(func, rounds=3):
+    """每轮紧挨着测量校准负载和用例，取多轮中最小的相对耗时，减少机器负载波动的影响
+
+    返回 (相对耗时, 单次耗时秒数)
+    """
+    best = None
+    for _ in range(rounds):
+        unit = calibrate()
+        seconds = measure(func)
+        if best is None or seconds / unit < best[0]:
+            best = (seconds / unit, seconds)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="热点辅助函数微基准测试")
+    parser.add_argument('--check', action='store_true', help="与基线对比，退化超过阈值时返回非零退出码")
+    parser.add_argument('--update-baseline', action='store_true', help="用本次结果更新基线")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f"允许的退化比例（默认{DEFAULT_THRESHOLD}，即慢{DEFAULT_THRESHOLD * 100:.0f}%%）")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="基线文件路径")
+    parser.add_argument('--retries', type=int, default=2, help="疑似退化时重新测量的次数")
+    parser.add_argument('--only', help="只运行名称包含该字符串的用例")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    regressions = []
+    print(f"{'用例':<40}{'单次(us)':>12}{'相对耗时':>10}{'基线':>10}{'变化':>9}")
+    for name, func in build_cases():
+        if args.only and args.only not in name:
+            continue
+        relative, seconds = score(func)
+        # 疑似退化时重新测量，排除偶发的机器负载波动
+        for _ in range(args.retries):
+            if name not in baseline or relative / baseline[name] - 1 <= args.threshold:
+                break
+            relative, seconds = min((relative, seconds), score(func))
+        results[name] = relative
+
+        line = f"{name:<40}{seconds * 1e6:>12.1f}{relative:>10.4f}"
+        if name in baseline:
+            change = relative / baseline[name] - 1
+            line += f"{baseline[name]:>10.4f}{change * 100:>+8.0f}%"
+            if change > args.threshold:
+                regressions.append(name)
+                line += "  退化"
+        print(line)
+
+    if args.update_baseline:
+        merged = dict(baseline, **results)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"unit": "校准负载耗时的倍数", "results": merged}, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\n基线已更新: {args.baseline}")
+
+    if args.check:
+        missing = [name for name in results if name not in baseline]
+        if missing:
+            print(f"\n没有基线的用例: {', '.join(missing)}（使用 --update-baseline 添加）")
+        if regressions:
+            print(f"\n性能退化超过 {args.threshold * 100:.0f}%: {', '.join(regressions)}")
+            return 1
+        print("\n未发现性能退化")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
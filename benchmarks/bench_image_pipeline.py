@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片处理链路内存基准测试
+
+在本地启动模拟的飞书图片下载接口和Dify文件上传接口，分别在独立子进程中运行：
+- legacy: 整张图片读入内存 -> 写入文件 -> 整个multipart请求体拼接为bytes后上传
+- stream: 分块下载直接写入文件 -> 流式multipart请求体分块上传
+
+比较两种方式的耗时和进程峰值内存（RSS）。
+
+用法:
+    python benchmarks/bench_image_pipeline.py --size-mb 50
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+BLOCK = os.urandom(64 * 1024)
+
+
+class FakeServerHandler(BaseHTTPRequestHandler):
+    """模拟飞书图片下载和Dify文件上传"""
+
+    image_size = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if not self.path.startswith('/open-apis/im/v1/images/'):
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(self.image_size))
+        self.end_headers()
+
+        remaining = self.image_size
+        while remaining > 0:
+            chunk = BLOCK[:min(len(BLOCK), remaining)]
+            self.wfile.write(chunk)
+            remaining -= len(chunk)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        remaining = length
+        while remaining > 0:
+            chunk = self.rfile.read(min(64 * 1024, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+
+        if self.path.endswith('/tenant_access_token/internal'):
+            self._send_json({"code": 0, "tenant_access_token": "bench_token"})
+        elif self.path.endswith('/files/upload'):
+            self._send_json({"id": "bench-file-id", "size": length})
+        else:
+            self.send_error(404)
+
+
+def peak_rss_kb():
+    """当前进程峰值内存（KB）"""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS返回字节，Linux返回KB
+    return usage // 1024 if sys.platform == 'darwin' else usage
+
+
+def run_child(mode, port, size):
+    """在子进程中执行一次图片处理链路"""
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    from config import Config
+    from services.lark_service import download_image, download_image_to_file
+    from services.dify_service import encode_multipart_formdata, upload_file_to_dify
+
+    base = f"http://127.0.0.1:{port}"
+    Config.FEISHU_API_BASE = base
+    Config.IMAGE_CACHE_MAX_SIZE = size + 1
+    model = {'dify_url': f"{base}/v1", 'api_key': 'bench_key'}
+
+    tmp_dir = tempfile.mkdtemp()
+    image_path = os.path.join(tmp_dir, 'bench.jpg')
+
+    baseline = peak_rss_kb()
+    start = time.perf_counter()
+
+    if mode == 'legacy':
+        image_data = download_image('bench_key')
+        with open(image_path, 'wb') as f:
+            f.write(image_data)
+        body, content_type = encode_multipart_formdata({'file': image_path}, {'user': 'bench'})
+        req = urllib.request.Request(f"{base}/v1/files/upload", data=body, method="POST",
+                                     headers={'Content-Type': content_type})
+        with urllib.request.urlopen(req) as response:
+            result = json.loads(response.read())
+    else:
+        download_image_to_file('bench_key', image_path)
+        result = upload_file_to_dify(model, image_path, 'bench')
+
+    elapsed = time.perf_counter() - start
+    os.remove(image_path)
+    os.rmdir(tmp_dir)
+
+    print(json.dumps({
+        "mode": mode,
+        "seconds": round(elapsed, 3),
+        "baseline_rss_kb": baseline,
+        "peak_rss_kb": peak_rss_kb(),
+        "uploaded_bytes": result.get('size') if result else None,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图片下载/上传链路内存基准测试")
+    parser.add_argument('--size-mb', type=float, default=50, help="模拟图片大小（MB）")
+    parser.add_argument('--child', choices=['legacy', 'stream'], help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.port, args.size)
+        return
+
+    size = int(args.size_mb * 1024 * 1024)
+    FakeServerHandler.image_size = size
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeServerHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    print(f"图片大小: {size / 1024 / 1024:.1f} MB")
+    print(f"{'模式':<8}{'耗时(s)':>10}{'基线RSS(MB)':>14}{'峰值RSS(MB)':>14}{'增量(MB)':>12}")
+
+    try:
+        for mode in ('legacy', 'stream'):
+            output = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__), '--child', mode,
+                 '--port', str(port), '--size', str(size)],
+                cwd=ROOT_DIR
+            )
+            result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+            delta = (result['peak_rss_kb'] - result['baseline_rss_kb']) / 1024
+            print(f"{mode:<8}{result['seconds']:>10.3f}{result['baseline_rss_kb'] / 1024:>14.1f}"
+                  f"{result['peak_rss_kb'] / 1024:>14.1f}{delta:>12.1f}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据层规模基准测试
+
+在datagen生成的合成数据库副本上逐个调用models/中的公开函数，统计每次调用的耗时。
+未登记用例的公开函数会在报告中列出，新增函数时需要在CASES中补充用例。
+结果可保存为JSON，并与之前版本的结果对比，用于发现随数据量退化的查询。
+
+用法:
+    python benchmarks/datagen.py --db /tmp/bench.db --preset medium
+    python benchmarks/bench_models.py --db /tmp/bench.db --json before.json
+    python benchmarks/bench_models.py --db /tmp/bench.db --compare before.json
+    python benchmarks/bench_models.py --preset small   # 在临时目录生成数据库
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import inspect
+import logging
+import argparse
+import tempfile
+import importlib
+from datetime import datetime
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from benchmarks.datagen import add_count_arguments, copy_database, counts_from_args, create_database
+
+# 参与覆盖检查的模块；migration为迁移逻辑，不在运行时调用
+MODULES = ["command", "database", "model", "pagination", "search", "session", "user", "webhook"]
+
+# 不单独计时的函数及原因
+SKIPPED = {
+    "database.init_database": "启动时执行一次",
+    "search.create_search_tables": "迁移时执行",
+    "search.backfill_index": "迁移时执行",
+    "search.search_available": "需要调用方的游标，包含在search_*中",
+    "search.index_row": "需要调用方的游标，包含在add_message/log_webhook_call中",
+    "search.remove_from_index": "需要调用方的游标，包含在数据保留清理中",
+}
+
+
+class Context:
+    """从数据库中抽样的参数，所有用例共享"""
+
+    def __init__(self, seed):
+        from models.database import get_db_connection
+
+        self.rng = random.Random(seed)
+        self.counter = 0
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        self.user_ids = [row[0] for row in cursor.execute(
+            "SELECT user_id FROM users ORDER BY random() LIMIT 1000")]
+        self.session_ids = [row[0] for row in cursor.execute(
+            "SELECT id FROM sessions ORDER BY random() LIMIT 1000")]
+        self.model_ids = [row[0] for row in cursor.execute("SELECT id FROM models")]
+        self.model_names = [row[0] for row in cursor.execute("SELECT name FROM models")]
+        self.commands = [tuple(row) for row in cursor.execute("SELECT id, trigger FROM commands")]
+        self.webhooks = [tuple(row) for row in cursor.execute("SELECT id, token, config_token FROM webhooks")]
+        self.log_ids = [row[0] for row in cursor.execute(
+            "SELECT id FROM webhook_logs ORDER BY random() LIMIT 1000")]
+        conn.close()
+
+    def pick(self, values):
+        return self.rng.choice(values)
+
+    def unique(self, prefix):
+        self.counter += 1
+        return f"{prefix}-{os.getpid()}-{self.counter}"
+
+    def new_model(self):
+        from models.model import add_model
+        return add_model(self.unique("bench-model"), "", "http://dify.local/v1", "chatbot", "app-bench")
+
+    def new_command(self):
+        from models.command import add_command
+        return add_command(self.unique("命令"), "", "\\" + self.unique("bench"), self.pick(self.model_ids))[1]
+
+    def new_webhook(self):
+        from models.webhook import create_webhook
+        return create_webhook(self.unique("bench-webhook"), "", self.pick(self.model_ids))[0]
+
+
+def call(*args, **kwargs):
+    return args, kwargs
+
+
+def case(target, prepare, repeat=None, label=None, cleanup=None):
+    """登记一个用例：prepare(ctx)在计时前生成本次调用的参数，cleanup(result)在计时后执行"""
+    return {"target": target, "label": label or target, "prepare": prepare, "repeat": repeat, "cleanup": cleanup}
+
+
+CASES = [
+    # command
+    case("command.get_command", lambda ctx: call(command_id=ctx.pick(ctx.commands)[0]), label="command.get_command[id]"),
+    case("command.get_command", lambda ctx: call(trigger=ctx.pick(ctx.commands)[1]), label="command.get_command[trigger]"),
+    case("command.get_all_commands", lambda ctx: call()),
+    case("command.list_commands", lambda ctx: call(query="命令")),
+    case("command.add_command", lambda ctx: call(ctx.unique("命令"), "", "\\" + ctx.unique("bench"), ctx.pick(ctx.model_ids))),
+    case("command.update_command", lambda ctx: call(ctx.pick(ctx.commands)[0], description=ctx.unique("描述"))),
+    case("command.delete_command", lambda ctx: call(ctx.new_command())),
+    # database
+    case("database.get_db_connection", lambda ctx: call(), cleanup=lambda conn: conn.close()),
+    case("database.commit_unit_of_work", lambda ctx: call()),
+    case("database.get_unit_of_work_stats", lambda ctx: call()),
+    case("database.backup_database", lambda ctx: call(os.path.join(tempfile.gettempdir(), ctx.unique("bench-backup") + ".db")),
+         repeat=3, cleanup=os.remove),
+    # model
+    case("model.get_model", lambda ctx: call(model_id=ctx.pick(ctx.model_ids)), label="model.get_model[id]"),
+    case("model.get_model", lambda ctx: call(model_name=ctx.pick(ctx.model_names)), label="model.get_model[name]"),
+    case("model.get_all_models", lambda ctx: call()),
+    case("model.list_models", lambda ctx: call()),
+    case("model.add_model", lambda ctx: call(ctx.unique("bench-model"), "", "http://dify.local/v1", "chatbot", "app-bench")),
+    case("model.update_model", lambda ctx: call(ctx.pick(ctx.model_ids), description=ctx.unique("描述"))),
+    case("model.delete_model", lambda ctx: call(ctx.new_model())),
+    # pagination
+    case("pagination.encode_cursor", lambda ctx: call(["2024-01-01 00:00:00", 12345])),
+    case("pagination.decode_cursor", lambda ctx: call("WyIyMDI0LTAxLTAxIDAwOjAwOjAwIiwgMTIzNDVd")),
+    case("pagination.fetch_page", lambda ctx: call("SELECT id, user_id, created_at FROM sessions", ["id"], True)),
+    # search
+    case("search.build_match_query", lambda ctx: call("数据库 连接超时")),
+    case("search.make_snippet", lambda ctx: call("服务器 数据库 连接 超时 " * 200 + "告警处理", ["告警处理"])),
+    case("search.search_messages", lambda ctx: call("数据库连接")),
+    case("search.search_messages", lambda ctx: call("数据库连接", user_id=ctx.pick(ctx.user_ids)),
+         label="search.search_messages[user]"),
+    case("search.search_webhook_logs", lambda ctx: call("DiskFull")),
+    # session
+    case("session.get_config", lambda ctx: call("session_timeout")),
+    case("session.set_config", lambda ctx: call("bench_key", ctx.unique("value"))),
+    case("session.get_all_configs", lambda ctx: call()),
+    case("session.get_or_create_session", lambda ctx: call(ctx.pick(ctx.user_ids))),
+    case("session.get_or_create_session", lambda ctx: call(ctx.pick(ctx.user_ids), command_id=ctx.pick(ctx.commands)[0]),
+         label="session.get_or_create_session[command]"),
+    case("session.update_session_conversation", lambda ctx: call(ctx.pick(ctx.session_ids), ctx.unique("conv"))),
+    case("session.add_message", lambda ctx: call(ctx.pick(ctx.session_ids), ctx.pick(ctx.user_ids), "服务器 数据库 连接超时 " * 100)),
+    case("session.get_session_model", lambda ctx: call(ctx.pick(ctx.session_ids))),
+    # user
+    case("user.load_known_users", lambda ctx: call(), repeat=5),
+    case("user.ensure_user", lambda ctx: call(ctx.pick(ctx.user_ids))),
+    case("user.flush_pending_users", lambda ctx: call()),
+    case("user.invalidate_user_cache", lambda ctx: call(ctx.pick(ctx.user_ids))),
+    case("user.get_user", lambda ctx: call(ctx.pick(ctx.user_ids))),
+    case("user.add_user", lambda ctx: call(ctx.unique("ou_bench"))),
+    case("user.check_admin", lambda ctx: call(ctx.pick(ctx.user_ids))),
+    case("user.set_user_admin", lambda ctx: call(ctx.pick(ctx.user_ids), 0)),
+    case("user.list_users", lambda ctx: call()),
+    case("user.list_users", lambda ctx: call(query=ctx.pick(ctx.user_ids)[-3:]), label="user.list_users[query]"),
+    case("user.get_all_users", lambda ctx: call(), repeat=5),
+    # webhook
+    case("webhook.get_all_webhooks", lambda ctx: call()),
+    case("webhook.list_webhooks", lambda ctx: call()),
+    case("webhook.create_webhook", lambda ctx: call(ctx.unique("bench-webhook"), "", ctx.pick(ctx.model_ids))),
+    case("webhook.get_webhook", lambda ctx: call(webhook_id=ctx.pick(ctx.webhooks)[0]), label="webhook.get_webhook[id]"),
+    case("webhook.get_webhook", lambda ctx: call(api_token=ctx.pick(ctx.webhooks)[1]), label="webhook.get_webhook[token]"),
+    case("webhook.update_webhook", lambda ctx: call(ctx.pick(ctx.webhooks)[0], description=ctx.unique("描述"))),
+    case("webhook.regenerate_webhook_tokens", lambda ctx: call(ctx.new_webhook())),
+    case("webhook.add_webhook_subscription", lambda ctx: call(ctx.pick(ctx.webhooks)[0], "user", ctx.unique("ou_bench"))),
+    case("webhook.remove_webhook_subscription", lambda ctx: call(ctx.pick(ctx.webhooks)[0], "user", ctx.pick(ctx.user_ids))),
+    case("webhook.get_webhook_subscriptions", lambda ctx: call(ctx.pick(ctx.webhooks)[0])),
+    case("webhook.get_user_subscriptions", lambda ctx: call(ctx.pick(ctx.user_ids))),
+    case("webhook.log_webhook_call", lambda ctx: call(ctx.pick(ctx.webhooks)[0], json.dumps({"alerts": ["DiskFull"] * 200}),
+                                                       "磁盘空间不足 " * 100, 200)),
+    case("webhook.get_webhook_logs", lambda ctx: call(ctx.pick(ctx.webhooks)[0]), repeat=20),
+    case("webhook.list_webhook_logs", lambda ctx: call(ctx.pick(ctx.webhooks)[0])),
+    case("webhook.list_webhook_logs", lambda ctx: call(ctx.pick(ctx.webhooks)[0], status=500),
+         label="webhook.list_webhook_logs[500]"),
+    case("webhook.get_webhook_log", lambda ctx: call(ctx.pick(ctx.log_ids))),
+    case("webhook.delete_webhook", lambda ctx: call(ctx.new_webhook())),
+]
+
+
+def public_functions():
+    """列出MODULES中定义的公开函数，返回 "模块.函数" 列表"""
+    names = []
+    for module_name in MODULES:
+        module = importlib.import_module(f"models.{module_name}")
+        for name, func in inspect.getmembers(module, inspect.isfunction):
+            if not name.startswith("_") and func.__module__ == module.__name__:
+                names.append(f"{module_name}.{name}")
+    return names
+
+
+def resolve(target):
+    module_name, func_name = target.split(".")
+    return getattr(importlib.import_module(f"models.{module_name}"), func_name)
+
+
+def run_case(spec, ctx, repeat):
+    """执行一个用例，返回每次调用的耗时（毫秒）"""
+    func = resolve(spec["target"])
+    timings = []
+    for _ in range(spec["repeat"] or repeat):
+        args, kwargs = spec["prepare"](ctx)
+        started_at = time.perf_counter()
+        result = func(*args, **kwargs)
+        timings.append((time.perf_counter() - started_at) * 1000)
+        if spec["cleanup"]:
+            spec["cleanup"](result)
+    return timings
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        "calls": len(timings),
+        "mean_ms": sum(timings) / len(timings),
+        "p50_ms": timings[len(timings) // 2],
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "max_ms": timings[-1],
+    }
+
+
+def report(results, baseline=None):
+    header = f"{'用例':<46}{'次数':>6}{'mean(ms)':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'max(ms)':>10}"
+    if baseline:
+        header += f"{'p50变化':>10}"
+    print(header)
+    for label, stats in results.items():
+        line = (f"{label:<46}{stats['calls']:>6}{stats['mean_ms']:>10.3f}{stats['p50_ms']:>10.3f}"
+                f"{stats['p95_ms']:>10.3f}{stats['max_ms']:>10.3f}")
+        old = (baseline or {}).get(label)
+        if old and old["p50_ms"] > 0:
+            line += f"{(stats['p50_ms'] / old['p50_ms'] - 1) * 100:>+9.0f}%"
+        elif baseline:
+            line += f"{'新增':>9}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="数据层规模基准测试")
+    parser.add_argument('--db', help="datagen生成的数据库，不存在时按规模参数生成；测试在其副本上进行")
+    parser.add_argument('--repeat', type=int, default=200, help="每个用例的默认调用次数")
+    parser.add_argument('--only', help="只运行标签包含该字符串的用例")
+    parser.add_argument('--json', help="将结果写入JSON文件")
+    parser.add_argument('--compare', help="与之前保存的JSON结果对比")
+    add_count_arguments(parser)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    from config import Config
+
+    work_dir = tempfile.mkdtemp(prefix="bench_models_")
+    source = args.db or os.path.join(work_dir, "source.db")
+    counts = counts_from_args(args)
+    if not os.path.exists(source):
+        create_database(source, counts, args.seed, args.days)
+
+    # 写入类用例会修改数据，在副本上运行以保证多次运行的数据一致
+    db_path = copy_database(source, os.path.join(work_dir, "bench.db"))
+    Config.DB_PATH = db_path
+
+    from models.migration import init_database_with_migration
+    import models.migration
+    init_database_with_migration()
+    if models.migration._batched_thread is not None:
+        models.migration._batched_thread.join()
+
+    conn = sqlite3.connect(db_path)
+    sizes = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+             for table in ("users", "sessions", "messages", "webhooks", "webhook_subscriptions", "webhook_logs")}
+    conn.close()
+    print(f"数据库: {source} ({os.path.getsize(db_path) / 1024 / 1024:.0f} MB)")
+    print("  ".join(f"{table}={count}" for table, count in sizes.items()))
+
+    ctx = Context(args.seed)
+    results = {}
+    try:
+        for spec in CASES:
+            if args.only and args.only not in spec["label"]:
+                continue
+            results[spec["label"]] = summarize(run_case(spec, ctx, args.repeat))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    report(results, baseline)
+
+    covered = {spec["target"] for spec in CASES} | set(SKIPPED)
+    uncovered = [name for name in public_functions() if name not in covered]
+    if uncovered:
+        print(f"\n未覆盖的函数（请在CASES中补充用例）: {', '.join(uncovered)}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"created_at": datetime.now().isoformat(timespec="seconds"), "sizes": sizes,
+                       "sqlite_version": sqlite3.sqlite_version, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.json}")
+
+
+if __name__ == '__main__':
+    main()
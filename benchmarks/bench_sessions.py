@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+会话查找基准测试
+
+用datagen生成合成数据库（默认large规模：100万会话、1000万消息），对比两种get_or_create_session实现：
+- legacy: 1.9.0之前的实现（SELECT * 查找 + 单独UPDATE，命令维度额外JOIN commands），只有1.5.0的索引
+- current: 当前实现（UPDATE ... RETURNING 一条语句），使用1.9.0的覆盖索引
+
+用法:
+    python benchmarks/bench_sessions.py --preset large --lookups 20000
+    python benchmarks/bench_sessions.py --db /tmp/bench.db --reuse   # 复用已生成的数据库
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from benchmarks.datagen import add_count_arguments, counts_from_args, create_database, user_id_of
+
+NEW_INDEXES = ["idx_sessions_model_lookup", "idx_sessions_command_lookup"]
+
+
+def legacy_get_or_create_session(user_id, model_id=None, command_id=None):
+    """1.9.0之前的get_or_create_session实现"""
+    from models.database import get_db_connection
+    from models.session import get_config
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    timeout_minutes = int(get_config("session_timeout") or "30")
+    timeout_timestamp = datetime.now() - timedelta(minutes=timeout_minutes)
+
+    if model_id and command_id:
+        cursor.execute("""
+            SELECT * FROM sessions
+            WHERE user_id = ? AND model_id = ? AND command_id = ? AND is_active = 1
+                AND last_active_at > ?
+            ORDER BY last_active_at DESC LIMIT 1
+        """, (user_id, model_id, command_id, timeout_timestamp))
+    elif model_id:
+        cursor.execute("""
+            SELECT * FROM sessions
+            WHERE user_id = ? AND model_id = ? AND command_id IS NULL AND is_active = 1
+                AND last_active_at > ?
+            ORDER BY last_active_at DESC LIMIT 1
+        """, (user_id, model_id, timeout_timestamp))
+    elif command_id:
+        cursor.execute("""
+            SELECT s.* FROM sessions s
+            JOIN commands c ON s.command_id = c.id
+            WHERE s.user_id = ? AND s.command_id = ? AND s.is_active = 1
+                AND s.last_active_at > ?
+            ORDER BY s.last_active_at DESC LIMIT 1
+        """, (user_id, command_id, timeout_timestamp))
+    else:
+        cursor.execute("""
+            SELECT * FROM sessions
+            WHERE user_id = ? AND is_active = 1 AND last_active_at > ?
+            ORDER BY last_active_at DESC LIMIT 1
+        """, (user_id, timeout_timestamp))
+
+    session = cursor.fetchone()
+
+    if session:
+        cursor.execute(
+            "UPDATE sessions SET updated_at = CURRENT_TIMESTAMP, last_active_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (session['id'],)
+        )
+        conn.commit()
+        session_id = session['id']
+        conversation_id = session['conversation_id']
+    else:
+        if not model_id and command_id:
+            cursor.execute("SELECT model_id FROM commands WHERE id = ?", (command_id,))
+            result = cursor.fetchone()
+            if result:
+                model_id = result['model_id']
+
+        if not model_id:
+            default_model_id = get_config("default_model")
+            if default_model_id:
+                try:
+                    model_id = int(default_model_id)
+                except (ValueError, TypeError):
+                    model_id = None
+
+        cursor.execute(
+            """INSERT INTO sessions
+               (user_id, model_id, command_id, last_active_at)
+               VALUES (?, ?, ?, CURRENT_TIMESTAMP)""",
+            (user_id, model_id, command_id)
+        )
+        conn.commit()
+        session_id = cursor.lastrowid
+        conversation_id = None
+
+    conn.close()
+    return session_id, conversation_id
+
+
+def make_workload(lookups, users, models, commands, seed):
+    """随机生成查找请求：普通对话、切换模型、自定义命令各占一部分"""
+    rng = random.Random(seed)
+    workload = []
+    for _ in range(lookups):
+        user_id = user_id_of(rng.randint(1, users))
+        kind = rng.random()
+        if kind < 0.6:
+            workload.append((user_id, None, None))
+        elif kind < 0.8:
+            workload.append((user_id, rng.randint(1, models), None))
+        elif kind < 0.9:
+            workload.append((user_id, None, rng.randint(1, commands)))
+        else:
+            workload.append((user_id, rng.randint(1, models), rng.randint(1, commands)))
+    return workload
+
+
+def run(func, workload):
+    """依次执行查找，返回每次调用的耗时（毫秒）"""
+    timings = []
+    for user_id, model_id, command_id in workload:
+        started_at = time.perf_counter()
+        func(user_id, model_id, command_id)
+        timings.append((time.perf_counter() - started_at) * 1000)
+    return timings
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    total = sum(timings)
+    p50 = timings[len(timings) // 2]
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(f"{name:<10}{len(timings) / total * 1000:>12.0f}{p50:>10.3f}{p99:>10.3f}{timings[-1]:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="会话查找基准测试")
+    parser.add_argument('--db', help="数据库路径，默认使用临时文件")
+    parser.add_argument('--reuse', action='store_true', help="复用已存在的数据库，不重新生成")
+    parser.add_argument('--lookups', type=int, default=20000)
+    add_count_arguments(parser, default_preset="large")
+    args = parser.parse_args()
+    counts = counts_from_args(args)
+
+    logging.disable(logging.CRITICAL)
+
+    from config import Config
+    from models.database import get_db_connection
+    from models.migration import DatabaseMigration, init_database_with_migration
+    from models.session import get_or_create_session
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), "bench_sessions.db")
+    Config.DB_PATH = db_path
+
+    if args.reuse and os.path.exists(db_path):
+        init_database_with_migration()
+    else:
+        # 会话查找不涉及全文搜索，不建立全文索引以加快生成
+        create_database(db_path, counts, args.seed, args.days, fts=False)
+    print(f"数据库: {db_path} ({os.path.getsize(db_path) / 1024 / 1024:.0f} MB)")
+
+    print(f"{'实现':<10}{'次/秒':>12}{'p50(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}")
+
+    # legacy在去掉1.9.0索引的数据库上运行，两种实现使用同样的请求序列（各自生成新会话互不复用）
+    conn = get_db_connection()
+    for index_name in NEW_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {index_name}")
+    conn.commit()
+    conn.close()
+    report("legacy", run(legacy_get_or_create_session,
+                         make_workload(args.lookups, counts["users"], counts["models"], counts["commands"], args.seed)))
+
+    conn = get_db_connection()
+    DatabaseMigration().migrate_1_9_0(conn.cursor())
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+    report("current", run(get_or_create_session,
+                          make_workload(args.lookups, counts["users"], counts["models"], counts["commands"], args.seed + 1)))
+
+
+if __name__ == '__main__':
+    main()
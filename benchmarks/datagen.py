@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+合成数据生成器
+
+生成一个处于当前迁移版本的数据库，按接近生产环境的分布填充数据：
+- 用户活跃度呈长尾分布：少数用户贡献大部分会话和消息
+- 会话分布在最近若干天内，约30%已失效，约20%属于自定义命令
+- 用户消息较短，机器人回答较长（对数正态分布），超过阈值的内容按写入路径压缩并建立全文索引
+- Webhook日志为格式化的告警JSON，大小从几百字节到几十KB，约5%为失败调用
+
+用法:
+    python benchmarks/datagen.py --db /tmp/bench.db --preset large --no-fts
+    python benchmarks/datagen.py --db /tmp/small.db --preset small
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+# 预设规模
+PRESETS = {
+    "small": {"users": 1000, "models": 5, "commands": 10, "sessions": 10000, "messages": 100000,
+              "webhooks": 10, "subscriptions": 100, "logs": 20000},
+    "medium": {"users": 20000, "models": 10, "commands": 30, "sessions": 200000, "messages": 2000000,
+               "webhooks": 50, "subscriptions": 1000, "logs": 200000},
+    "large": {"users": 100000, "models": 10, "commands": 50, "sessions": 1000000, "messages": 10000000,
+              "webhooks": 200, "subscriptions": 5000, "logs": 1000000},
+}
+
+BATCH_SIZE = 10000
+CORPUS_WORDS = 200000
+
+WORDS = ("服务器 数据库 连接 超时 告警 用户 请求 失败 成功 部署 版本 配置 网络 延迟 内存 磁盘 "
+         "接口 日志 错误 重试 缓存 队列 线程 负载 监控 报表 订单 支付 退款 审批 "
+         "CPU latency error timeout deploy cluster node pod service request").split()
+
+
+def user_id_of(index):
+    return f"ou_gen_{index}"
+
+
+class DataGenerator:
+    """按给定规模向数据库写入合成数据"""
+
+    def __init__(self, counts, seed=42, days=180, fts=True):
+        self.counts = counts
+        self.fts = fts
+        self.rng = random.Random(seed)
+        self.days = days
+        self.session_users = []
+        # 预先生成一段语料，文本从中按随机位置截取，避免逐词拼接成为生成瓶颈
+        self.corpus = " ".join(self.rng.choice(WORDS) for _ in range(CORPUS_WORDS))
+
+    def pick_user(self):
+        """长尾分布选择用户：编号越小越活跃"""
+        return int(self.counts["users"] * self.rng.random() ** 3) + 1
+
+    def timestamp(self, max_days=None):
+        """最近max_days天内的随机时间（UTC，与CURRENT_TIMESTAMP格式一致）"""
+        seconds = self.rng.random() * (max_days or self.days) * 86400
+        return (datetime.utcnow() - timedelta(seconds=seconds)).strftime('%Y-%m-%d %H:%M:%S')
+
+    def text(self, mean_length):
+        """对数正态分布长度的随机文本"""
+        length = min(max(2, int(self.rng.lognormvariate(0, 0.8) * mean_length)), len(self.corpus) // 2)
+        start = self.rng.randrange(len(self.corpus) - length)
+        return self.corpus[start:start + length].strip()
+
+    def alert_payload(self):
+        """格式化的告警JSON，告警条数决定大小"""
+        alerts = [{
+            "alertname": self.rng.choice(["HighCPU", "DiskFull", "ServiceDown", "SlowQuery"]),
+            "instance": f"host-{self.rng.randint(1, 500)}",
+            "severity": self.rng.choice(["critical", "warning", "info"]),
+            "value": round(self.rng.random() * 100, 2),
+            "description": self.text(80),
+        } for _ in range(max(1, int(self.rng.lognormvariate(0.5, 1.0))))]
+        return json.dumps({"status": "firing", "alerts": alerts}, ensure_ascii=False, indent=2)
+
+    def _insert_batches(self, conn, rows, insert, label):
+        """分批写入，rows为生成器，insert(cursor, batch) 负责写入一批"""
+        cursor = conn.cursor()
+        started_at = time.perf_counter()
+        batch = []
+        total = 0
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= BATCH_SIZE:
+                insert(cursor, batch)
+                conn.commit()
+                total += len(batch)
+                batch = []
+        if batch:
+            insert(cursor, batch)
+            conn.commit()
+            total += len(batch)
+        print(f"{label}: {total} 行，{time.perf_counter() - started_at:.1f}s")
+
+    def generate(self, conn):
+        from utils.compression import compress_text
+        from models.search import index_row
+
+        counts = self.counts
+        rng = self.rng
+
+        self._insert_batches(conn, (
+            (f"bench-model-{i}", f"合成模型{i}", "http://dify.local/v1", rng.choice(["chatbot", "agent", "flow"]),
+             f"app-{i}", "{}")
+            for i in range(1, counts["models"] + 1)
+        ), lambda cursor, batch: cursor.executemany(
+            "INSERT INTO models (name, description, dify_url, dify_type, api_key, parameters) VALUES (?, ?, ?, ?, ?, ?)",
+            batch), "模型")
+
+        self._insert_batches(conn, (
+            (f"命令{i}", self.text(20), f"\\gen-{i}", rng.randint(1, counts["models"]), "{}")
+            for i in range(1, counts["commands"] + 1)
+        ), lambda cursor, batch: cursor.executemany(
+            "INSERT INTO commands (name, description, trigger, model_id, parameters) VALUES (?, ?, ?, ?, ?)",
+            batch), "命令")
+
+        self._insert_batches(conn, (
+            (user_id_of(i), f"用户{i}", 1 if i <= 3 else 0, self.timestamp())
+            for i in range(1, counts["users"] + 1)
+        ), lambda cursor, batch: cursor.executemany(
+            "INSERT INTO users (user_id, name, is_admin, created_at) VALUES (?, ?, ?, ?)", batch), "用户")
+
+        def sessions():
+            for i in range(1, counts["sessions"] + 1):
+                created_at = self.timestamp()
+                command_id = rng.randint(1, counts["commands"]) if counts["commands"] and rng.random() < 0.2 else None
+                user_id = user_id_of(self.pick_user())
+                self.session_users.append(user_id)
+                yield (user_id, rng.randint(1, counts["models"]), command_id,
+                       f"conv-{i}", 1 if rng.random() >= 0.3 else 0, created_at, max(created_at, self.timestamp(7)))
+
+        self._insert_batches(conn, sessions(), lambda cursor, batch: cursor.executemany(
+            """INSERT INTO sessions (user_id, model_id, command_id, conversation_id, is_active, created_at, last_active_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""", batch), "会话")
+
+        # 消息成对出现：用户提问和机器人回答，会话同样按长尾分布
+        def messages():
+            for i in range(counts["messages"]):
+                is_user = i % 2 == 0
+                if is_user:
+                    session_id = int(counts["sessions"] * rng.random() ** 2) + 1
+                content = self.text(40 if is_user else 600)
+                yield session_id, self.session_users[session_id - 1], content, 1 if is_user else 0, self.timestamp()
+
+        def insert_messages(cursor, batch):
+            for session_id, user_id, content, is_user, created_at in batch:
+                cursor.execute(
+                    "INSERT INTO messages (session_id, user_id, content, is_user, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (session_id, user_id, compress_text(content), is_user, created_at))
+                if self.fts:
+                    index_row(cursor, "messages", cursor.lastrowid, [content])
+
+        self._insert_batches(conn, messages(), insert_messages, "消息")
+
+        self._insert_batches(conn, (
+            (f"webhook-{i}", self.text(20), f"gen-token-{i}", f"gen-config-{i}", rng.randint(1, counts["models"]),
+             "请分析以下告警：{data}", 1 if rng.random() < 0.3 else 0)
+            for i in range(1, counts["webhooks"] + 1)
+        ), lambda cursor, batch: cursor.executemany(
+            """INSERT INTO webhooks (name, description, token, config_token, model_id, prompt_template, bypass_ai)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""", batch), "Webhook")
+
+        def subscriptions():
+            seen = set()
+            for _ in range(counts["subscriptions"]):
+                webhook_id = rng.randint(1, counts["webhooks"])
+                if rng.random() < 0.3:
+                    target = ("chat", f"oc_gen_{rng.randint(1, 1000)}")
+                else:
+                    target = ("user", user_id_of(self.pick_user()))
+                if (webhook_id,) + target in seen:
+                    continue
+                seen.add((webhook_id,) + target)
+                yield webhook_id, target[0], target[1], user_id_of(1)
+
+        self._insert_batches(conn, subscriptions(), lambda cursor, batch: cursor.executemany(
+            "INSERT INTO webhook_subscriptions (webhook_id, target_type, target_id, created_by) VALUES (?, ?, ?, ?)",
+            batch), "订阅")
+
+        # 少数Webhook贡献大部分调用
+        def logs():
+            for _ in range(counts["logs"]):
+                failed = rng.random() < 0.05
+                response = "AI服务响应超时" if failed else self.text(300)
+                yield (int(counts["webhooks"] * rng.random() ** 2) + 1, self.alert_payload(), response,
+                       500 if failed else 200, self.timestamp(90))
+
+        def insert_logs(cursor, batch):
+            for webhook_id, request_data, response, status, created_at in batch:
+                cursor.execute(
+                    "INSERT INTO webhook_logs (webhook_id, request_data, response, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (webhook_id, compress_text(request_data), compress_text(response), status, created_at))
+                if self.fts:
+                    index_row(cursor, "webhook_logs", cursor.lastrowid, [request_data, response])
+
+        self._insert_batches(conn, logs(), insert_logs, "Webhook日志")
+
+        conn.execute("ANALYZE")
+        conn.commit()
+
+
+def create_database(db_path, counts, seed=42, days=180, fts=True):
+    """在db_path创建当前迁移版本的数据库并填充合成数据"""
+    from config import Config
+    import models.migration
+    from models.migration import init_database_with_migration
+    from models.database import _connect
+
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    Config.DB_PATH = db_path
+    if not init_database_with_migration():
+        raise RuntimeError("数据库初始化失败")
+    # 空数据库上的分批迁移很快结束，等待其完成后再写入数据
+    if models.migration._batched_thread is not None:
+        models.migration._batched_thread.join()
+
+    conn = _connect()
+    conn.execute("PRAGMA synchronous = OFF")
+    try:
+        DataGenerator(counts, seed, days, fts).generate(conn)
+    finally:
+        conn.close()
+    return db_path
+
+
+def copy_database(source, dest):
+    """用SQLite备份API复制数据库，写入类的测试在副本上进行，源数据库可重复使用"""
+    import sqlite3
+
+    src, dst = sqlite3.connect(source), sqlite3.connect(dest)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+    return dest
+
+
+def add_count_arguments(parser, default_preset="small"):
+    """添加数据规模相关的命令行参数"""
+    parser.add_argument('--preset', choices=sorted(PRESETS), default=default_preset, help="预设规模")
+    for name in PRESETS["small"]:
+        parser.add_argument(f'--{name}', type=int, help=f"{name}数量，覆盖预设")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--days', type=int, default=180, help="数据的时间跨度（天）")
+    parser.add_argument('--no-fts', action='store_true', help="不建立全文索引（大规模数据时索引占大部分生成时间和空间）")
+
+
+def counts_from_args(args):
+    counts = dict(PRESETS[args.preset])
+    for name in counts:
+        if getattr(args, name) is not None:
+            counts[name] = getattr(args, name)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成合成数据库")
+    parser.add_argument('--db', required=True, help="数据库路径（已存在时覆盖）")
+    add_count_arguments(parser)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    counts = counts_from_args(args)
+    started_at = time.perf_counter()
+    create_database(args.db, counts, args.seed, args.days, not args.no_fts)
+    print(f"完成: {args.db} ({os.path.getsize(args.db) / 1024 / 1024:.0f} MB)，"
+          f"耗时 {time.perf_counter() - started_at:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
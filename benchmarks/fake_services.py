@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模拟的飞书和Dify服务
+
+- 飞书: tenant_access_token、发送消息（im/v1/messages，记录每个接收者收到消息的时间）、图片下载
+- Dify: chat-messages（streaming按设定的token速率逐个发送SSE事件，blocking一次返回）、
+  files/upload、停止生成；首个token前的延迟服从对数正态分布，可按比例注入HTTP错误和流中的error事件
+
+load_test.py在进程内启动这两个服务；也可以单独运行，手动把机器人指向它们：
+    python benchmarks/fake_services.py --feishu-port 9001 --dify-port 9002
+    FEISHU_API_BASE=http://127.0.0.1:9001 python app.py   # 模型的dify_url设为 http://127.0.0.1:9002/v1
+"""
+
+import io
+import os
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    """不输出访问日志，提供JSON读写"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length else b""
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeServer:
+    """在后台线程中运行的HTTP服务"""
+
+    def __init__(self, handler_class, host="127.0.0.1", port=0):
+        self.httpd = ThreadingHTTPServer((host, port), handler_class)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+        self.counts = defaultdict(int)
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _FeishuHandler(_QuietHandler):
+
+    def do_POST(self):
+        fake = self.server.fake
+        body = self.read_body()
+
+        if self.path.endswith('/tenant_access_token/internal'):
+            fake.count("token")
+            self.send_json({"code": 0, "msg": "ok", "tenant_access_token": "t-fake", "expire": 7200})
+        elif self.path.startswith('/open-apis/im/v1/messages'):
+            fake.count("messages")
+            if fake.latency_ms:
+                time.sleep(fake.latency_ms / 1000)
+            data = json.loads(body or b"{}")
+            fake.record(data.get("receive_id"), data.get("msg_type"), len(data.get("content") or ""))
+            self.send_json({"code": 0, "msg": "success", "data": {"message_id": f"om_{uuid.uuid4().hex}"}})
+        else:
+            self.send_error(404)
+
+    def do_GET(self):
+        fake = self.server.fake
+        if not self.path.startswith('/open-apis/im/v1/images/'):
+            self.send_error(404)
+            return
+
+        fake.count("images")
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(fake.image)))
+        self.end_headers()
+        self.wfile.write(fake.image)
+
+
+class FakeFeishu(FakeServer):
+    """模拟飞书开放平台，记录每个接收者收到的消息"""
+
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=0, image_size=200 * 1024):
+        super().__init__(_FeishuHandler, host, port)
+        self.latency_ms = latency_ms
+        self.image = make_image(image_size)
+        self._received = defaultdict(list)
+
+    def record(self, receive_id, msg_type, size):
+        with self.lock:
+            self._received[receive_id].append((time.perf_counter(), msg_type, size))
+
+    def take(self, receive_id):
+        """取出并清空接收者收到的消息，返回 [(时间, 消息类型, 内容长度)]"""
+        with self.lock:
+            return self._received.pop(receive_id, [])
+
+
+class _DifyHandler(_QuietHandler):
+
+    def do_POST(self):
+        fake = self.server.fake
+        body = self.read_body()
+
+        if self.path.endswith('/files/upload'):
+            fake.count("upload")
+            self.send_json({"id": str(uuid.uuid4()), "name": "image.jpg", "size": len(body),
+                            "extension": "jpg", "mime_type": "image/jpeg"})
+        elif self.path.endswith('/stop'):
+            fake.count("stop")
+            self.send_json({"result": "success"})
+        elif self.path.endswith('/chat-messages'):
+            fake.count("chat")
+            self.chat(fake, json.loads(body or b"{}"))
+        else:
+            self.send_error(404)
+
+    def chat(self, fake, data):
+        rng = fake.rng()
+        time.sleep(fake.first_token_delay(rng))
+
+        if rng.random() < fake.error_rate:
+            fake.count("error")
+            self.send_json({"code": "internal_error", "message": "模拟的Dify错误", "status": 500}, status=500)
+            return
+
+        tokens = fake.answer_tokens(rng)
+        conversation_id = data.get("conversation_id") or str(uuid.uuid4())
+        task_id = str(uuid.uuid4())
+
+        if data.get("response_mode") != "streaming":
+            time.sleep(len(tokens) / fake.token_rate)
+            self.send_json({"event": "message", "task_id": task_id, "message_id": str(uuid.uuid4()),
+                            "conversation_id": conversation_id, "answer": "".join(tokens)})
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        fail_at = rng.randrange(len(tokens)) if rng.random() < fake.stream_error_rate else None
+        try:
+            for i, token in enumerate(tokens):
+                if i == fail_at:
+                    fake.count("stream_error")
+                    self.send_event({"event": "error", "task_id": task_id, "message": "模拟的流式错误"})
+                    return
+                self.send_event({"event": "message", "task_id": task_id, "conversation_id": conversation_id,
+                                 "answer": token})
+                time.sleep(1 / fake.token_rate)
+            self.send_event({"event": "message_end", "task_id": task_id, "conversation_id": conversation_id})
+        except (BrokenPipeError, ConnectionResetError):
+            # 机器人取消生成时会直接断开连接
+            fake.count("aborted")
+
+    def send_event(self, data):
+        self.wfile.write(b"data: " + json.dumps(data, ensure_ascii=False).encode('utf-8') + b"\n\n")
+        self.wfile.flush()
+
+
+class FakeDify(FakeServer):
+    """模拟Dify应用API
+
+    first_token_ms为首个token前延迟的中位数，latency_sigma为对数正态分布的sigma（0表示固定延迟）；
+    token_rate为每秒发送的token数，answer_tokens为回答的平均token数。
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, first_token_ms=300, latency_sigma=0.5, token_rate=50,
+                 answer_tokens=100, error_rate=0.0, stream_error_rate=0.0, seed=42):
+        super().__init__(_DifyHandler, host, port)
+        self.first_token_ms = first_token_ms
+        self.latency_sigma = latency_sigma
+        self.token_rate = token_rate
+        self.mean_tokens = answer_tokens
+        self.error_rate = error_rate
+        self.stream_error_rate = stream_error_rate
+        self._rng_lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+    def rng(self):
+        """每个请求使用独立的随机数生成器，种子来自共享生成器"""
+        with self._rng_lock:
+            return random.Random(self._rng.getrandbits(64))
+
+    def first_token_delay(self, rng):
+        return self.first_token_ms / 1000 * rng.lognormvariate(0, self.latency_sigma)
+
+    def answer_tokens(self, rng):
+        count = max(1, int(rng.expovariate(1 / self.mean_tokens)))
+        return ["模拟回答" if i % 4 else " token" for i in range(count)]
+
+
+def make_image(size):
+    """生成约size字节的JPEG图片，未安装Pillow时返回随机字节"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return os.urandom(size)
+
+    # 随机噪声几乎不可压缩，边长按目标大小估算
+    side = max(16, int((size / 3) ** 0.5))
+    image = Image.frombytes("RGB", (side, side), os.urandom(side * side * 3))
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+def add_dify_arguments(parser):
+    """添加模拟Dify的命令行参数"""
+    parser.add_argument('--dify-first-token-ms', type=float, default=300, help="首个token前延迟的中位数（毫秒）")
+    parser.add_argument('--dify-latency-sigma', type=float, default=0.5, help="延迟的对数正态分布sigma")
+    parser.add_argument('--dify-token-rate', type=float, default=50, help="每秒发送的token数")
+    parser.add_argument('--dify-answer-tokens', type=int, default=100, help="回答的平均token数")
+    parser.add_argument('--dify-error-rate', type=float, default=0.0, help="返回HTTP 500的比例")
+    parser.add_argument('--dify-stream-error-rate', type=float, default=0.0, help="流中途发送error事件的比例")
+
+
+def dify_from_args(args, port=0):
+    return FakeDify(port=port, first_token_ms=args.dify_first_token_ms, latency_sigma=args.dify_latency_sigma,
+                    token_rate=args.dify_token_rate, answer_tokens=args.dify_answer_tokens,
+                    error_rate=args.dify_error_rate, stream_error_rate=args.dify_stream_error_rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的飞书和Dify服务")
+    parser.add_argument('--feishu-port', type=int, default=9001)
+    parser.add_argument('--dify-port', type=int, default=9002)
+    parser.add_argument('--feishu-latency-ms', type=float, default=0, help="发送消息接口的固定延迟（毫秒）")
+    add_dify_arguments(parser)
+    args = parser.parse_args()
+
+    feishu = FakeFeishu(port=args.feishu_port, latency_ms=args.feishu_latency_ms).start()
+    dify = dify_from_args(args, args.dify_port).start()
+    print(f"飞书: {feishu.url}  Dify: {dify.url}/v1  (Ctrl+C退出)")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"飞书 {dict(feishu.counts)}  Dify {dict(dify.counts)}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        feishu.stop()
+        dify.stop()
+
+
+if __name__ == '__main__':
+    main()
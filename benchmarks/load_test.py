@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+端到端压力测试
+
+在本地启动模拟的飞书和Dify服务（见fake_services.py），机器人在独立子进程中运行并指向它们，
+使用datagen生成的数据库副本。若干虚拟用户并发、闭环地发送请求（收到回复后再发下一条）：
+- text: 向 /webhook/event 发送带校验token的文本消息事件
+- image: 先发送图片消息事件，再发送文本消息事件（图片下载、上传Dify）
+- webhook: 向 /api/webhook/<token> 发送告警数据，AI处理后推送给订阅者
+
+统计吞吐量、首条回复时间（模拟飞书收到第一条消息）、端到端时间（收到最终回复）的p50/p95/p99，
+以及机器人进程的CPU时间、峰值内存和线程数。
+
+用法:
+    python benchmarks/load_test.py --concurrency 20 --duration 60
+    python benchmarks/load_test.py --db /tmp/bench.db --dify-token-rate 20 --dify-error-rate 0.05 --json load.json
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from benchmarks.datagen import add_count_arguments, copy_database, counts_from_args, create_database
+from benchmarks.fake_services import FakeFeishu, add_dify_arguments, dify_from_args
+
+VERIFICATION_TOKEN = "load-test-verification-token"
+SCENARIOS = ("text", "image", "webhook")
+
+
+def serve_bot(args):
+    """子进程入口：按app.py的方式初始化并启动机器人"""
+    from waitress import create_server
+    from config import Config
+    from utils.metrics import register_waitress
+
+    Config.DB_PATH = args.bot_db
+
+    import app as bot
+    from models.database import init_database
+    from models.user import load_known_users
+
+    init_database()
+    load_known_users()
+    bot.setup_routes()
+
+    @bot.app.get('/ping')
+    def ping():
+        return "pong"
+
+    server = create_server(bot.app, host='127.0.0.1', port=args.bot_port, threads=args.bot_threads)
+    register_waitress(server)
+    server.run()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_bot(db_path, feishu_url, work_dir, threads):
+    """在子进程中启动机器人，等待 /ping 可用后返回 (进程, 地址)"""
+    port = free_port()
+    env = dict(os.environ, FEISHU_API_BASE=feishu_url, VERIFICATION_TOKEN=VERIFICATION_TOKEN,
+               IMAGE_CACHE_DIR=os.path.join(work_dir, "image_cache"))
+    # 工作目录设为临时目录，机器人的日志文件lark_bot.log也写在其中
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve-bot", "--bot-db", db_path,
+         "--bot-port", str(port), "--bot-threads", str(threads)],
+        cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"机器人进程退出，返回码 {process.returncode}，日志见 {work_dir}/lark_bot.log")
+        try:
+            with urllib.request.urlopen(f"{url}/ping", timeout=1) as response:
+                if response.read() == b"pong":
+                    return process, url
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("机器人启动超时")
+
+
+class ProcessMonitor:
+    """定期采样子进程的CPU时间、内存和线程数（读取/proc，仅Linux可用）"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.available = os.path.exists(f"/proc/{pid}/stat")
+        self.max_threads = 0
+        self.max_rss_kb = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_cpu = None
+        self._started_at = None
+
+    def cpu_seconds(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime和stime为第14、15个字段，去掉pid和进程名后下标为11、12
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def status(self):
+        values = {}
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                values[key] = value.split()[0] if value.split() else ""
+        return values
+
+    def sample(self):
+        status = self.status()
+        self.max_threads = max(self.max_threads, int(status.get("Threads", 0)))
+        self.max_rss_kb = max(self.max_rss_kb, int(status.get("VmRSS", 0)), int(status.get("VmHWM", 0)))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except OSError:
+                break
+
+    def start(self):
+        if self.available:
+            self._start_cpu = self.cpu_seconds()
+            self._started_at = time.perf_counter()
+            self._thread = threading.Thread(target=self._run, name="process-monitor", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """停止采样，返回资源使用统计"""
+        if not self.available:
+            return None
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+        cpu = self.cpu_seconds() - self._start_cpu
+        elapsed = time.perf_counter() - self._started_at
+        return {"cpu_seconds": cpu, "cpu_percent": cpu / elapsed * 100, "max_rss_mb": self.max_rss_kb / 1024,
+                "max_threads": self.max_threads}
+
+
+def post(url, data, timeout=300):
+    """POST JSON，返回HTTP状态码"""
+    body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"}, method="POST")
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return 0
+
+
+def message_event(open_id, message_type, content):
+    """构造飞书v2.0消息事件，使用机器人配置的校验token"""
+    return {
+        "schema": "2.0",
+        "header": {"event_id": uuid.uuid4().hex, "event_type": "im.message.receive_v1",
+                   "create_time": str(int(time.time() * 1000)), "token": VERIFICATION_TOKEN, "app_id": "cli_load"},
+        "event": {
+            "sender": {"sender_id": {"open_id": open_id}, "sender_type": "user"},
+            "message": {"message_id": f"om_{uuid.uuid4().hex}", "chat_id": f"oc_{open_id}", "chat_type": "p2p",
+                        "message_type": message_type, "content": json.dumps(content, ensure_ascii=False)},
+        },
+    }
+
+
+class VirtualUser:
+    """一个闭环发送请求的虚拟用户，使用自己的飞书用户和Webhook，回复可以按接收者区分"""
+
+    def __init__(self, index, bot_url, feishu, webhook_token, subscribers, weights, rng):
+        self.open_id = f"ou_load_{index}"
+        self.bot_url = bot_url
+        self.feishu = feishu
+        self.webhook_token = webhook_token
+        self.subscribers = subscribers
+        self.weights = weights
+        self.rng = rng
+
+    def text(self):
+        question = self.rng.choice(["帮我总结一下今天的告警", "数据库连接超时怎么排查", "写一段部署脚本"])
+        return [post(f"{self.bot_url}/webhook/event", message_event(self.open_id, "text", {"text": question}))], \
+            [self.open_id]
+
+    def image(self):
+        image_key = f"img_load_{uuid.uuid4().hex}"
+        statuses = [post(f"{self.bot_url}/webhook/event",
+                         message_event(self.open_id, "image", {"image_key": image_key}))]
+        statuses.append(post(f"{self.bot_url}/webhook/event",
+                             message_event(self.open_id, "text", {"text": "描述一下这张图片"})))
+        return statuses, [self.open_id]
+
+    def webhook(self):
+        alert = {"status": "firing", "alerts": [{"alertname": "HighCPU", "instance": f"host-{self.rng.randint(1, 50)}",
+                                                 "value": round(self.rng.random() * 100, 2)}]}
+        return [post(f"{self.bot_url}/api/webhook/{self.webhook_token}", alert)], self.subscribers
+
+    def request(self):
+        """发送一个请求，返回结果记录"""
+        scenario = self.rng.choices(SCENARIOS, self.weights)[0]
+        started_at = time.perf_counter()
+        statuses, receivers = getattr(self, scenario)()
+        finished_at = time.perf_counter()
+
+        received = [message[0] for receiver in receivers for message in self.feishu.take(receiver)]
+        result = {"scenario": scenario, "ok": all(status == 200 for status in statuses) and bool(received),
+                  "request_ms": (finished_at - started_at) * 1000}
+        if received:
+            result["first_reply_ms"] = (min(received) - started_at) * 1000
+            result["end_to_end_ms"] = (max(received) - started_at) * 1000
+        return result
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def summarize(results, elapsed):
+    summary = {}
+    for scenario in SCENARIOS + ("total",):
+        rows = [r for r in results if scenario in ("total", r["scenario"])]
+        if not rows:
+            continue
+        stats = {"requests": len(rows), "errors": sum(1 for r in rows if not r["ok"]),
+                 "throughput": len(rows) / elapsed}
+        for key in ("first_reply_ms", "end_to_end_ms"):
+            values = [r[key] for r in rows if key in r]
+            for name, p in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+                stats[f"{key[:-3]}_{name}_ms"] = percentile(values, p)
+        summary[scenario] = stats
+    return summary
+
+
+def report(summary, resources, feishu, dify, elapsed):
+    def ms(value):
+        return f"{value:>8.0f}" if value is not None else f"{'-':>8}"
+
+    print(f"\n持续 {elapsed:.1f}s")
+    print(f"{'场景':<10}{'请求':>7}{'错误':>6}{'次/秒':>8}"
+          f"{'首条p50':>9}{'p95':>8}{'p99':>8}{'端到端p50':>10}{'p95':>8}{'p99':>8}")
+    for scenario, stats in summary.items():
+        print(f"{scenario:<10}{stats['requests']:>7}{stats['errors']:>6}{stats['throughput']:>8.1f}"
+              f"{ms(stats['first_reply_p50_ms'])}{ms(stats['first_reply_p95_ms'])}{ms(stats['first_reply_p99_ms'])}"
+              f"{ms(stats['end_to_end_p50_ms']):>10}{ms(stats['end_to_end_p95_ms'])}{ms(stats['end_to_end_p99_ms'])}")
+    print("（时间单位为毫秒）")
+
+    print(f"\n模拟飞书: {dict(feishu.counts)}")
+    print(f"模拟Dify: {dict(dify.counts)}")
+    if resources:
+        print(f"机器人进程: CPU {resources['cpu_seconds']:.1f}s（平均 {resources['cpu_percent']:.0f}%），"
+              f"峰值内存 {resources['max_rss_mb']:.0f} MB，最多 {resources['max_threads']} 个线程")
+    else:
+        print("机器人进程: 资源统计仅在Linux上可用")
+
+
+def prepare_database(db_path, dify_url, users):
+    """在数据库中添加指向模拟Dify的默认模型，以及每个虚拟用户的Webhook和订阅者"""
+    from config import Config
+    import models.migration
+    from models.migration import init_database_with_migration
+    from models.model import add_model
+    from models.session import set_config
+    from models.webhook import create_webhook, add_webhook_subscription
+
+    Config.DB_PATH = db_path
+    init_database_with_migration()
+    if models.migration._batched_thread is not None:
+        models.migration._batched_thread.join()
+
+    model_id = add_model(f"load-test-{uuid.uuid4().hex[:8]}", "压力测试", f"{dify_url}/v1", "chatbot", "app-load")
+    set_config("default_model", str(model_id))
+
+    webhooks = []
+    for i in range(users):
+        webhook_id, api_token, _ = create_webhook(f"load-webhook-{i}", "压力测试", model_id, "请分析以下告警：{data}")
+        subscribers = [f"ou_load_sub_{i}_{k}" for k in range(2)]
+        for subscriber in subscribers:
+            add_webhook_subscription(webhook_id, "user", subscriber, "load-test")
+        webhooks.append((api_token, subscribers))
+    return webhooks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端压力测试")
+    parser.add_argument('--db', help="datagen生成的数据库，不存在时按规模参数生成；测试在其副本上进行")
+    parser.add_argument('--concurrency', type=int, default=10, help="并发的虚拟用户数")
+    parser.add_argument('--duration', type=float, default=30, help="持续时间（秒）")
+    parser.add_argument('--requests', type=int, help="总请求数，达到后提前结束")
+    parser.add_argument('--image-ratio', type=float, default=0.1, help="图片请求的比例")
+    parser.add_argument('--webhook-ratio', type=float, default=0.2, help="Webhook请求的比例")
+    parser.add_argument('--bot-threads', type=int, default=10, help="机器人waitress线程数（与app.py一致）")
+    parser.add_argument('--feishu-latency-ms', type=float, default=20, help="模拟飞书发送消息接口的延迟")
+    parser.add_argument('--json', help="将结果写入JSON文件")
+    add_dify_arguments(parser)
+    add_count_arguments(parser)
+    # 内部参数：以子进程方式运行机器人
+    parser.add_argument('--serve-bot', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--bot-db', help=argparse.SUPPRESS)
+    parser.add_argument('--bot-port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_bot:
+        serve_bot(args)
+        return
+
+    logging.disable(logging.CRITICAL)
+
+    work_dir = tempfile.mkdtemp(prefix="load_test_")
+    feishu = FakeFeishu(latency_ms=args.feishu_latency_ms).start()
+    dify = dify_from_args(args).start()
+    process = None
+    try:
+        source = args.db or os.path.join(work_dir, "source.db")
+        if not os.path.exists(source):
+            create_database(source, counts_from_args(args), args.seed, args.days)
+        db_path = copy_database(source, os.path.join(work_dir, "bot.db"))
+        webhooks = prepare_database(db_path, dify.url, args.concurrency)
+
+        process, bot_url = start_bot(db_path, feishu.url, work_dir, args.bot_threads)
+        print(f"机器人: {bot_url}  模拟飞书: {feishu.url}  模拟Dify: {dify.url}/v1")
+        print(f"{args.concurrency} 个虚拟用户，持续 {args.duration:.0f}s ...")
+
+        weights = (max(0.0, 1 - args.image_ratio - args.webhook_ratio), args.image_ratio, args.webhook_ratio)
+        results = []
+        results_lock = threading.Lock()
+        remaining = [args.requests]
+        deadline = time.perf_counter() + args.duration
+
+        def worker(user):
+            while time.perf_counter() < deadline:
+                with results_lock:
+                    if remaining[0] is not None:
+                        if remaining[0] <= 0:
+                            return
+                        remaining[0] -= 1
+                result = user.request()
+                with results_lock:
+                    results.append(result)
+
+        users = [VirtualUser(i, bot_url, feishu, webhooks[i][0], webhooks[i][1], weights, random.Random(args.seed + i))
+                 for i in range(args.concurrency)]
+        monitor = ProcessMonitor(process.pid).start()
+        started_at = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(user,), daemon=True) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started_at
+        resources = monitor.stop()
+
+        summary = summarize(results, elapsed)
+        report(summary, resources, feishu, dify, elapsed)
+
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"created_at": datetime.now().isoformat(timespec="seconds"), "args": vars(args),
+                           "summary": summary, "resources": resources, "feishu": dict(feishu.counts),
+                           "dify": dict(dify.counts)}, f, ensure_ascii=False, indent=2)
+            print(f"\n结果已写入 {args.json}")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        feishu.stop()
+        dify.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,37 @@ class Config:
 
     # 数据库配置
     DB_PATH = "lark_dify_bot.db"
+    # 启动时的完整性检查: quick(PRAGMA quick_check) / full(PRAGMA integrity_check) / off
+    DB_INTEGRITY_CHECK = os.environ.get("DB_INTEGRITY_CHECK", "quick").lower()
+    MIGRATION_BATCH_SIZE = 1000  # 分批迁移每批处理的行数
+    MIGRATION_BATCH_PAUSE = 0.05  # 分批迁移批次之间的间隔（秒）
+
+    # 数据库定时热备份
+    BACKUP_DIR = os.environ.get("BACKUP_DIR", "data/backups")
+    BACKUP_INTERVAL = int(os.environ.get("BACKUP_INTERVAL", 6 * 3600))  # 备份间隔（秒），为0时不定时备份
+    BACKUP_KEEP = int(os.environ.get("BACKUP_KEEP", 7))  # 保留的备份份数
+    BACKUP_COMPRESS = os.environ.get("BACKUP_COMPRESS", "true").lower() == "true"  # 是否gzip压缩
+    BACKUP_PAGES_PER_STEP = 256  # 在线备份每步复制的页数
+    BACKUP_STEP_PAUSE = 0.005  # 每步之间的暂停时间（秒），降低备份对磁盘I/O的占用
+
+    # 数据保留策略：max_age_days 最长保留天数，max_rows 最大行数，archive 删除前是否归档
+    RETENTION_POLICIES = {
+        "messages": {"max_age_days": 365, "max_rows": None, "archive": True},
+        "webhook_logs": {"max_age_days": 90, "max_rows": 100000, "archive": True},
+        "admin_tokens": {"max_age_days": 30, "max_rows": None, "archive": False},
+        "sessions": {"max_age_days": 365, "max_rows": None, "archive": False},
+    }
+    RETENTION_INTERVAL = int(os.environ.get("RETENTION_INTERVAL", 24 * 3600))  # 清理间隔（秒），为0时不清理
+    RETENTION_ARCHIVE_DIR = os.environ.get("RETENTION_ARCHIVE_DIR", "data/archive")  # 归档目录
+    RETENTION_BATCH_SIZE = 500  # 每批删除的行数
+    RETENTION_BATCH_PAUSE = 0.05  # 批次之间的间隔（秒）
+    RETENTION_VACUUM_PAGES = 1000  # 增量vacuum每步回收的页数
+
+    # 大文本字段压缩（messages.content、webhook_logs.request_data/response）
+    COMPRESSION_ENABLED = os.environ.get("COMPRESSION_ENABLED", "true").lower() == "true"
+    COMPRESSION_ALGORITHM = os.environ.get("COMPRESSION_ALGORITHM", "zlib").lower()  # zlib / zstd（需安装zstandard）
+    COMPRESSION_MIN_SIZE = 1024  # 超过该字节数的文本才压缩
+    COMPRESSION_LEVEL = 6  # 压缩级别
 
     # 飞书应用配置
     VERIFICATION_TOKEN = os.environ.get("VERIFICATION_TOKEN", "your_verification_token")
@@ -16,17 +47,67 @@ class Config:
     APP_SECRET = os.environ.get("APP_SECRET", "your_app_secret")
     BOT_NAME = os.environ.get("BOT_NAME", "Dify机器人")
     BOT_OPEN_ID = os.environ.get("BOT_OPEN_ID", "")
+    FEISHU_API_BASE = os.environ.get("FEISHU_API_BASE", "https://open.feishu.cn")
 
     # API配置
     MAX_RETRIES = 3
     INITIAL_RETRY_DELAY = 2
     RETRY_BACKOFF_FACTOR = 1.5
     API_TIMEOUT = 60
+    DIFY_FILE_RETENTION_MINUTES = 60  # 已上传到Dify的文件可复用的时长
+    DIFY_UPLOAD_INDEX_MAX_ENTRIES = 1000  # 上传去重索引的最大条目数
+    KNOWN_USERS_MAX_ENTRIES = 10000  # 内存中已知用户和管理员标记的最大条目数
+    USER_FLUSH_INTERVAL = 1  # 新用户批量写入的合并间隔（秒）
+    FEISHU_SEND_WORKERS = 4  # 异步发送"处理中"提示的线程数
+    # 流式响应看门狗（秒），为0时不限制
+    DIFY_STREAM_FIRST_TOKEN_TIMEOUT = 60  # 等待首个内容事件的最长时间
+    DIFY_STREAM_IDLE_TIMEOUT = 30  # 两个内容事件之间的最长间隔，ping不计入
+    DIFY_STREAM_TOTAL_TIMEOUT = 300  # 整个流式响应的最长时间
+
+    # 监控指标
+    METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"  # 是否开放/metrics接口
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")  # 非空时抓取需携带 Authorization: Bearer <token>
+
+    # 请求追踪（/admin/traces）
+    TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "true").lower() == "true"
+    TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE", 500))  # 内存中保留的最近trace数
+    TRACE_MAX_SPANS = 200  # 单个trace最多记录的span数
+
+    # 日志：经队列由后台线程写入，请求线程不做磁盘I/O
+    LOG_FILE = os.environ.get("LOG_FILE", "lark_bot.log")
+    LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+    LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()  # text / json（每行一个JSON对象）
+    # 轮转方式：为空时按大小（LOG_MAX_BYTES），否则按时间，取值同TimedRotatingFileHandler的when（如 midnight、H）
+    LOG_ROTATE_WHEN = os.environ.get("LOG_ROTATE_WHEN", "")
+    LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", 50 * 1024 * 1024))
+    LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", 10))  # 保留的轮转文件数
+    LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))  # 日志队列上限，写入跟不上时丢弃新日志而不是阻塞请求
+    LOG_MAX_MESSAGE_LENGTH = int(os.environ.get("LOG_MAX_MESSAGE_LENGTH", 2000))  # 单条日志的最大字符数，超出截断
+    # 高频日志的采样比例（按logger名称，包括其子logger），WARNING及以上级别不采样
+    LOG_SAMPLE_RATES = {
+        "handlers.lark_handler.request": 0.1,  # 飞书事件的完整请求体
+        "services.dify_service.stream": 0.1,  # 工作流节点、agent思考等流式事件
+        "services.lark_service.send": 0.1,  # 飞书消息发送成功的响应
+    }
 
     # Web管理界面配置
     ADMIN_TOKEN_EXPIRE_MINUTES = 60
+    ADMIN_TOKEN_CACHE_TTL = 30  # 管理员token验证结果的缓存时间（秒）
+    ADMIN_TOKEN_ACTIVITY_INTERVAL = 60  # 同一token活动时间写入数据库的最小间隔（秒）
     STATIC_DIR = "static"
 
     # 图片缓存配置
     IMAGE_CACHE_EXPIRE_MINUTES = 5
-    IMAGE_CACHE_MAX_SIZE = 10 * 1024 * 1024  # 10MB
\ No newline at end of file
+    IMAGE_CACHE_MAX_SIZE = 10 * 1024 * 1024  # 10MB，单张图片大小上限
+    IMAGE_DOWNLOAD_CHUNK_SIZE = 64 * 1024  # 流式下载/上传的分块大小
+    IMAGE_PREFETCH_WORKERS = 4  # 收到图片后后台预取（下载并上传到Dify）的线程数
+    IMAGE_CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR", "data/image_cache")  # 磁盘缓存目录
+    IMAGE_CACHE_MEMORY_ENTRIES = 1000  # 内存LRU保留的用户缓存条目数
+    IMAGE_CACHE_DISK_MAX_SIZE = 500 * 1024 * 1024  # 磁盘缓存图片总大小上限
+    IMAGE_CACHE_SWEEP_INTERVAL = 60  # 过期缓存清理间隔（秒）
+
+    # 图片预处理配置（需要安装Pillow，可在模型parameters的image_preprocess中按模型覆盖）
+    IMAGE_PREPROCESS_ENABLED = os.environ.get("IMAGE_PREPROCESS_ENABLED", "true").lower() == "true"
+    IMAGE_PREPROCESS_MAX_DIMENSION = 1568  # 长边最大像素
+    IMAGE_PREPROCESS_FORMAT = "webp"  # 输出格式: webp / jpeg / png
+    IMAGE_PREPROCESS_QUALITY = 80
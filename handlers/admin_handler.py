@@ -2,24 +2,43 @@
 # -*- coding: utf-8 -*-
 
 import os
+import time
+import urllib.parse
 import logging
 from bottle import request, response, redirect, static_file, template, TEMPLATE_PATH
 
 from config import Config
-from models.model import get_all_models, get_model, add_model, update_model, delete_model
-from models.command import get_all_commands, get_command, add_command, update_command, delete_command
-from models.webhook import (get_all_webhooks, get_webhook, create_webhook, update_webhook,
-                            regenerate_webhook_tokens, get_webhook_subscriptions, get_webhook_logs, delete_webhook)
-from models.user import get_all_users, set_user_admin
+from models.model import get_all_models, list_models, get_model, add_model, update_model, delete_model
+from models.command import list_commands, get_command, add_command, update_command, delete_command
+from models.webhook import (list_webhooks, get_webhook, create_webhook, update_webhook, regenerate_webhook_tokens,
+                            get_webhook_subscriptions, list_webhook_logs, get_webhook_log, delete_webhook)
+from models.user import list_users, set_user_admin
 from models.session import get_all_configs, set_config, get_config
 from utils.decorators import require_admin
-from utils.helpers import parse_utf8, ensure_utf8
+from utils.helpers import parse_utf8, ensure_utf8, invalidate_user_admin_tokens
 
 logger = logging.getLogger(__name__)
 
 def setup_admin_routes(app):
     """设置管理界面相关路由"""
 
+    def list_params():
+        """读取列表页的分页和过滤参数"""
+        return {
+            "after": request.query.get('after') or None,
+            "limit": request.query.get('limit', default=50, type=int),
+            "query": (request.query.getunicode('q') or '').strip() or None,
+        }
+
+    def page_links(page):
+        """生成第一页和下一页的链接，保留当前的过滤和排序参数"""
+        args = {key: request.query.getunicode(key) for key in request.query.keys() if key not in ('after', 'token')}
+        first_url = request.path + ("?" + urllib.parse.urlencode(args) if args else "")
+        next_url = None
+        if page["next_cursor"]:
+            next_url = request.path + "?" + urllib.parse.urlencode(dict(args, after=page["next_cursor"]))
+        return {"first_url": first_url if request.query.get('after') else None, "next_url": next_url}
+
     @app.get('/admin')
     def admin_redirect():
         """管理界面根路径，重定向到模型管理"""
@@ -102,8 +121,9 @@ def setup_admin_routes(app):
     @require_admin
     def admin_models(user_id):
         """模型管理页面"""
-        models = get_all_models()
-        return template('models', models=models)
+        params = list_params()
+        page = list_models(**params)
+        return template('models', models=page["items"], query=params["query"] or '', **page_links(page))
 
     @app.get('/admin/models/add')
     @require_admin
@@ -188,8 +208,9 @@ def setup_admin_routes(app):
     @require_admin
     def admin_commands(user_id):
         """命令管理页面"""
-        commands = get_all_commands()
-        return template('commands', commands=commands)
+        params = list_params()
+        page = list_commands(**params)
+        return template('commands', commands=page["items"], query=params["query"] or '', **page_links(page))
 
     @app.get('/admin/commands/add')
     @require_admin
@@ -274,8 +295,9 @@ def setup_admin_routes(app):
     @require_admin
     def admin_webhooks(user_id):
         """Webhook管理页面"""
-        webhooks = get_all_webhooks()
-        return template('webhooks', webhooks=webhooks, get_webhook_subscriptions=get_webhook_subscriptions)
+        params = list_params()
+        page = list_webhooks(**params)
+        return template('webhooks', webhooks=page["items"], query=params["query"] or '', **page_links(page))
 
     @app.get('/admin/webhooks/add')
     @require_admin
@@ -431,8 +453,19 @@ def setup_admin_routes(app):
         if not webhook:
             return redirect('/admin/webhooks')
 
-        logs = get_webhook_logs(webhook_id)
-        return template('webhook_logs', webhook=webhook, logs=logs)
+        params = list_params()
+        status = request.query.get('status', type=int)
+        page = list_webhook_logs(webhook_id, after=params["after"], limit=params["limit"], status=status)
+        return template('webhook_logs', webhook=webhook, logs=page["items"], status=status or '', **page_links(page))
+
+    @app.get('/admin/webhook-logs/<webhook_id:int>/<log_id:int>')
+    @require_admin
+    def admin_webhook_log_detail(user_id, webhook_id, log_id):
+        """查看单条Webhook调用日志的请求和响应内容"""
+        log = get_webhook_log(log_id)
+        if not log or log['webhook_id'] != webhook_id:
+            return redirect(f'/admin/webhook-logs/{webhook_id}')
+        return template('webhook_log_detail', webhook=get_webhook(webhook_id=webhook_id), log=log)
 
     @app.get('/admin/webhooks/delete/<webhook_id:int>')
     @require_admin
@@ -481,15 +514,18 @@ def setup_admin_routes(app):
     @require_admin
     def admin_users(user_id):
         """用户管理页面"""
-        users = get_all_users()
-        return template('users', users=users)
+        params = list_params()
+        sort = request.query.get('sort') or 'created_at'
+        admin_only = request.query.get('admin_only') == '1'
+        page = list_users(sort=sort, admin_only=admin_only, **params)
+        return template('users', users=page["items"], query=params["query"] or '', sort=sort,
+                        admin_only=admin_only, **page_links(page))
 
     @app.get('/admin/users/toggle_admin/<user_id_to_toggle>')
     @require_admin
     def admin_toggle_admin(user_id, user_id_to_toggle):
         """切换用户管理员状态"""
         from models.user import get_user
-        from models.database import get_db_connection
 
         if user_id == user_id_to_toggle:
             return redirect('/admin/users')
@@ -500,11 +536,7 @@ def setup_admin_routes(app):
             set_user_admin(user_id_to_toggle, new_status)
 
             if new_status == 0:
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                cursor.execute("UPDATE admin_tokens SET is_valid = 0 WHERE user_id = ?", (user_id_to_toggle,))
-                conn.commit()
-                conn.close()
+                invalidate_user_admin_tokens(user_id_to_toggle)
 
         return redirect('/admin/users')
 
@@ -514,8 +546,28 @@ def setup_admin_routes(app):
     def admin_database_info(user_id):
         """数据库信息页面"""
         from models.migration import get_database_info
+        from services.backup_service import backup_service
+        db_info = get_database_info()
+        return template('database_info', db_info=db_info, backup_stats=backup_service.get_stats())
+
+    @app.post('/admin/database/backup')
+    @require_admin
+    def admin_backup_database(user_id):
+        """立即备份数据库"""
+        from models.migration import get_database_info
+        from services.backup_service import backup_service
+
+        backup_path = backup_service.create_backup()
+        if backup_path:
+            message = f"备份成功: {backup_path}"
+            message_type = "alert-success"
+        else:
+            message = "备份失败，请查看日志"
+            message_type = "alert-error"
+
         db_info = get_database_info()
-        return template('database_info', db_info=db_info)
+        return template('database_info', db_info=db_info, backup_stats=backup_service.get_stats(),
+                        message=message, message_type=message_type)
 
     @app.post('/admin/database/migrate')
     @require_admin
@@ -534,8 +586,10 @@ def setup_admin_routes(app):
             message_type = "alert-error"
 
         from models.migration import get_database_info
+        from services.backup_service import backup_service
         db_info = get_database_info()
-        return template('database_info', db_info=db_info, message=message, message_type=message_type)
+        return template('database_info', db_info=db_info, backup_stats=backup_service.get_stats(),
+                        message=message, message_type=message_type)
 
     # 日志查看路由
     @app.get('/admin/logs')
@@ -544,7 +598,7 @@ def setup_admin_routes(app):
         """日志查看页面"""
         log_content = ""
         try:
-            with open('lark_bot.log', 'r', encoding='utf-8') as f:
+            with open(Config.LOG_FILE, 'r', encoding='utf-8') as f:
                 lines = f.readlines()[-1000:]
                 log_content = ''.join(lines)
         except Exception as e:
@@ -552,6 +606,127 @@ def setup_admin_routes(app):
 
         return template('logs', log_content=log_content)
 
+    # 全文搜索路由
+    def run_search():
+        """按查询参数执行全文搜索，返回 (查询参数, 搜索结果, 错误信息)"""
+        from models.search import search_messages, search_webhook_logs, MAX_SEARCH_LIMIT
+
+        params = {
+            "query": (request.query.getunicode('q') or '').strip(),
+            "scope": request.query.get('scope') or 'messages',
+            "before": request.query.get('before', type=int),
+            "limit": max(1, min(request.query.get('limit', default=20, type=int), MAX_SEARCH_LIMIT)),
+        }
+        if not params["query"]:
+            return params, None, None
+
+        search = search_webhook_logs if params["scope"] == 'webhook_logs' else search_messages
+        started_at = time.perf_counter()
+        try:
+            found = search(params["query"], before_id=params["before"], limit=params["limit"])
+        except ValueError as e:
+            return params, None, str(e)
+        found["elapsed_ms"] = (time.perf_counter() - started_at) * 1000
+        return params, found, None
+
+    @app.get('/admin/search')
+    @require_admin
+    def admin_search(user_id):
+        """全文搜索页面"""
+        params, found, error = run_search()
+        found = found or {"results": [], "next_before": None, "elapsed_ms": 0}
+        return template('search', query=params["query"], query_param=urllib.parse.quote(params["query"]),
+                        scope=params["scope"], error=error, **found)
+
+    @app.get('/admin/api/search')
+    @require_admin
+    def admin_api_search(user_id):
+        """全文搜索接口，使用返回的next_before作为下一页的before参数"""
+        params, found, error = run_search()
+        if error or not found:
+            response.status = 400
+            return {"error": error or "请输入搜索内容"}
+        return found
+
+    # 请求追踪路由
+    @app.get('/admin/traces')
+    @require_admin
+    def admin_traces(user_id):
+        """最近的请求追踪，默认按耗时从长到短排序"""
+        from utils.tracing import get_traces
+
+        sort = 'recent' if request.query.get('sort') == 'recent' else 'slowest'
+        name = request.query.getunicode('name') or None
+        traces = [trace.to_dict() for trace in get_traces(sort=sort, limit=200, name=name)]
+        return template('traces', traces=traces, sort=sort, name=name or '')
+
+    @app.get('/admin/traces/<trace_id:re:[0-9a-f]{32}>')
+    @require_admin
+    def admin_trace_detail(user_id, trace_id):
+        """单个trace的各阶段耗时"""
+        from utils.tracing import get_trace
+
+        trace = get_trace(trace_id)
+        if not trace:
+            return template('error', error_message="trace不存在或已被新的trace覆盖", back_url="/admin/traces")
+        return template('trace_detail', trace=trace.to_dict())
+
+    @app.get('/admin/api/traces')
+    @require_admin
+    def admin_api_traces(user_id):
+        """导出最近的trace，format=otlp时为OTLP/HTTP JSON，trace_id指定时只导出该trace"""
+        from utils.tracing import get_traces, get_trace, to_otlp
+
+        trace_id = request.query.get('trace_id')
+        if trace_id:
+            trace = get_trace(trace_id)
+            traces = [trace] if trace else []
+        else:
+            traces = get_traces(sort=request.query.get('sort') or 'recent',
+                                limit=max(1, min(request.query.get('limit', default=100, type=int), 1000)))
+
+        if request.query.get('format') == 'otlp':
+            return to_otlp(traces)
+        return {"traces": [trace.to_dict() for trace in traces]}
+
+    # 列表接口，使用返回的next_cursor作为下一页的after参数
+    @app.get('/admin/api/users')
+    @require_admin
+    def admin_api_users(user_id):
+        return list_users(sort=request.query.get('sort') or 'created_at',
+                          admin_only=request.query.get('admin_only') == '1', **list_params())
+
+    @app.get('/admin/api/models')
+    @require_admin
+    def admin_api_models(user_id):
+        return list_models(**list_params())
+
+    @app.get('/admin/api/commands')
+    @require_admin
+    def admin_api_commands(user_id):
+        return list_commands(model_id=request.query.get('model_id', type=int), **list_params())
+
+    @app.get('/admin/api/webhooks')
+    @require_admin
+    def admin_api_webhooks(user_id):
+        return list_webhooks(**list_params())
+
+    @app.get('/admin/api/webhook-logs/<webhook_id:int>')
+    @require_admin
+    def admin_api_webhook_logs(user_id, webhook_id):
+        params = list_params()
+        return list_webhook_logs(webhook_id, after=params["after"], limit=params["limit"],
+                                 status=request.query.get('status', type=int))
+
+    @app.get('/admin/api/webhook-logs/<webhook_id:int>/<log_id:int>')
+    @require_admin
+    def admin_api_webhook_log_detail(user_id, webhook_id, log_id):
+        log = get_webhook_log(log_id)
+        if not log or log['webhook_id'] != webhook_id:
+            response.status = 404
+            return {"error": "日志不存在"}
+        return log
+
     # 静态文件服务
     @app.get('/static/<filepath:path>')
     def serve_static(filepath):
@@ -9,8 +9,12 @@ from models.session import get_config, set_config, get_or_create_session, add_me
 from models.webhook import (get_webhook, get_all_webhooks, create_webhook, update_webhook, delete_webhook,
                             add_webhook_subscription, remove_webhook_subscription, get_user_subscriptions)
 from models.user import get_user, add_user, set_user_admin
+from models.database import commit_unit_of_work
 from services.dify_service import process_dify_message
-from utils.helpers import create_admin_token, validate_admin_token, invalidate_admin_token
+from services.lark_service import send_acknowledgement, wait_acknowledgement
+from utils.helpers import (create_admin_token, validate_admin_token, invalidate_admin_token,
+                           invalidate_user_admin_tokens)
+from utils.tracing import traced, set_attribute
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
@@ -56,8 +60,10 @@ def is_admin_command(cmd):
         cmd.startswith(prefix) for prefix in ["admin-", "model-", "command-", "webhook-", "set-"])
 
 
+@traced("command")
 def handle_command(cmd, args, sender_id, sender_type="user", chat_id=None, reply_func=None):
     """处理系统命令"""
+    set_attribute("command", cmd)
     is_admin = check_admin(sender_id)
 
     # 特殊命令：init-admin
@@ -303,6 +309,10 @@ def handle_change_model(args, user_id, reply_func):
         reply_func(f"未找到名为 '{model_name}' 的模型。")
         return
 
+    # 旧模型上未完成的生成不再需要
+    from services.dify_service import cancel_generation
+    cancel_generation(user_id, "切换模型")
+
     session_id, _ = get_or_create_session(user_id, model['id'])
     reply_func(f"已将当前会话模型切换为：{model['name']}。\n\n您可以开始提问了！")
 
@@ -310,6 +320,9 @@ def handle_change_model(args, user_id, reply_func):
 def handle_clear_session(user_id, reply_func):
     """清除当前会话"""
     from models.database import get_db_connection
+    from services.dify_service import cancel_generation
+
+    cancel_generation(user_id, "清除会话")
 
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -495,16 +508,7 @@ def handle_admin_login(user_id, reply_func):
 
 def handle_admin_logout(user_id, reply_func):
     """管理员退出"""
-    from models.database import get_db_connection
-
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE admin_tokens SET is_valid = 0 WHERE user_id = ?", (user_id,))
-    conn.commit()
-    affected = conn.total_changes
-    conn.close()
-
-    if affected > 0:
+    if invalidate_user_admin_tokens(user_id):
         reply_func("管理员已退出，所有管理会话已失效。")
     else:
         reply_func("当前没有有效的管理会话。")
@@ -542,14 +546,7 @@ def handle_admin_remove(args, reply_func):
         return
 
     if set_user_admin(user_id, 0):
-        from models.database import get_db_connection
-
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("UPDATE admin_tokens SET is_valid = 0 WHERE user_id = ?", (user_id,))
-        conn.commit()
-        conn.close()
-
+        invalidate_user_admin_tokens(user_id)
         reply_func(f"已移除用户 '{user_id}' 的管理员权限。")
     else:
         reply_func(f"用户 '{user_id}' 不是管理员。")
@@ -847,8 +844,10 @@ def handle_webhook_status(args, reply_func):
         reply_func("更新webhook状态失败")
 
 
+@traced("custom_command")
 def handle_custom_command(command, args, user_id, reply_func):
     """处理自定义命令"""
+    set_attribute("trigger", command['trigger'])
     model_id = command['model_id']
     if not model_id:
         reply_func(f"该命令未关联任何模型，无法执行。")
@@ -863,13 +862,20 @@ def handle_custom_command(command, args, user_id, reply_func):
 
     session_id, conversation_id = get_or_create_session(user_id, model_id, command['id'])
 
-    add_message(session_id, user_id, query, is_user=1)
+    # 处理中提示在后台发送，与写入消息、调用Dify并行
+    ack = send_acknowledgement(reply_func, f"正在处理命令：{command['name']}...")
 
-    reply_func(f"正在处理命令：{command['name']}...")
+    add_message(session_id, user_id, query, is_user=1)
+    commit_unit_of_work()
 
     try:
         full_response = process_dify_message(model, query, conversation_id, user_id, session_id)
+        if full_response is None:
+            # 生成已被用户的后续操作取消
+            return
+        wait_acknowledgement(ack)
         reply_func(full_response)
     except Exception as e:
         logger.error(f"处理命令出错: {str(e)}")
+        wait_acknowledgement(ack)
         reply_func(f"处理命令时出错: {str(e)}")
\ No newline at end of file
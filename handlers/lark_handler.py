@@ -2,19 +2,25 @@
 # -*- coding: utf-8 -*-
 
 import json
+import time
 import logging
 import threading
 from collections import deque
 from bottle import request, HTTPResponse
 
 from config import Config
-from models.user import get_user, add_user
-from services.lark_service import send_message
+from models.user import ensure_user
+from models.database import UnitOfWork, commit_unit_of_work
+from services.lark_service import send_message, send_acknowledgement, wait_acknowledgement
 from services.cache_service import ImageCacheService
 from .command_handler import handle_command, is_command, parse_command
-from utils.helpers import is_bot_mentioned, remove_mentions_improved, ensure_utf8
+from utils.helpers import is_bot_mentioned, remove_mentions_improved, ensure_utf8, StageTimer
+from utils.metrics import EVENTS, EVENT_DURATION, DUPLICATE_EVENTS
+from utils.tracing import start_trace, set_trace_attribute
 
 logger = logging.getLogger(__name__)
+# 每个事件的完整请求体，按 Config.LOG_SAMPLE_RATES 采样
+request_logger = logging.getLogger(f"{__name__}.request")
 
 # 请求去重
 processed_events = deque(maxlen=100)
@@ -26,18 +32,27 @@ image_cache = ImageCacheService()
 
 def setup_lark_routes(app):
     """设置飞书相关路由"""
+    image_cache.start_sweeper()
 
     @app.post('/webhook/event')
     def event_handler():
         """处理飞书事件"""
+        started_at = time.perf_counter()
+        schema = "unknown"
+
+        def record(result):
+            EVENTS.inc(schema, result)
+            EVENT_DURATION.observe(time.perf_counter() - started_at, schema)
+
         try:
             body = request.body.read().decode('utf-8')
-            logger.info(f"收到请求: {body}")
+            request_logger.info("收到请求: %s", body)
 
             event_data = json.loads(body)
 
             # URL验证处理
             if event_data.get("type") == "url_verification":
+                schema = "url_verification"
                 challenge = event_data.get("challenge")
                 token = event_data.get("token")
 
@@ -45,18 +60,22 @@ def setup_lark_routes(app):
 
                 if token != Config.VERIFICATION_TOKEN:
                     logger.warning(f"Token验证失败: {token}")
+                    record("invalid_token")
                     return HTTPResponse(
                         status=401,
                         body=json.dumps({"error": "invalid token"}),
                         headers={'Content-Type': 'application/json'}
                     )
 
+                record("ok")
                 return HTTPResponse(
                     status=200,
                     body=json.dumps({"challenge": challenge}),
                     headers={'Content-Type': 'application/json'}
                 )
 
+            schema = "2.0" if event_data.get("schema") == "2.0" else "1.0"
+
             # 验证Token
             if "header" in event_data:
                 token = event_data.get("header", {}).get("token")
@@ -65,19 +84,22 @@ def setup_lark_routes(app):
 
             if token != Config.VERIFICATION_TOKEN:
                 logger.warning(f"Token验证失败: {token}")
+                record("invalid_token")
                 return HTTPResponse(
                     status=401,
                     body=json.dumps({"error": "invalid token"}),
                     headers={'Content-Type': 'application/json'}
                 )
 
-            # 加锁处理事件
-            with processing_lock:
+            # 锁只保护事件去重，事件处理本身并发执行，不同用户互不阻塞
+            # 同一事件内的数据库访问共用一个连接，写入合并提交
+            with start_trace("飞书事件", schema=schema), UnitOfWork("飞书事件"):
                 if "schema" in event_data and event_data.get("schema") == "2.0":
                     handle_v2_event(event_data)
                 else:
                     handle_v1_event(event_data)
 
+            record("ok")
             return HTTPResponse(
                 status=200,
                 body=json.dumps({"code": 0, "msg": "success"}),
@@ -88,6 +110,7 @@ def setup_lark_routes(app):
             logger.error(f"处理事件出错: {str(e)}")
             import traceback
             logger.error(traceback.format_exc())
+            record("error")
             return HTTPResponse(
                 status=500,
                 body=json.dumps({"error": str(e)}),
@@ -95,18 +118,28 @@ def setup_lark_routes(app):
             )
 
 
+def is_duplicate_event(event_id):
+    """检查事件是否已处理过，未处理过则记录"""
+    with processing_lock:
+        if event_id in processed_events:
+            DUPLICATE_EVENTS.inc()
+            return True
+        processed_events.append(event_id)
+        return False
+
+
 def handle_v2_event(event_data):
     """处理v2.0版本的事件"""
     header = event_data.get("header", {})
     event_type = header.get("event_type")
     event_id = header.get("event_id")
+    set_trace_attribute("event_id", event_id)
+    set_trace_attribute("event_type", event_type)
 
-    if event_id in processed_events:
+    if is_duplicate_event(event_id):
         logger.info(f"跳过重复事件: {event_id}")
         return True
 
-    processed_events.append(event_id)
-
     if event_type == "im.message.receive_v1":
         event = event_data.get("event", {})
         sender = event.get("sender", {})
@@ -117,6 +150,8 @@ def handle_v2_event(event_data):
         chat_id = message.get("chat_id")
 
         logger.info(f"收到v2.0消息: 类型={msg_type}, 发送者={sender_id}, 聊天类型={chat_type}")
+        set_trace_attribute("user_id", sender_id)
+        set_trace_attribute("msg_type", msg_type)
 
         # 处理不同类型的消息
         if msg_type == "text":
@@ -143,12 +178,12 @@ def handle_v1_event(event_data):
         event_type = event.get("type")
 
         event_id = event_data.get("uuid")
-        if event_id in processed_events:
+        set_trace_attribute("event_id", event_id)
+        set_trace_attribute("event_type", event_type)
+        if is_duplicate_event(event_id):
             logger.info(f"跳过重复事件: {event_id}")
             return True
 
-        processed_events.append(event_id)
-
         if event_type == "im.message.receive_v1" or event_type == "message":
             sender_id = event.get("sender", {}).get("sender_id", {}).get("open_id")
             message = event.get("message", {})
@@ -157,6 +192,8 @@ def handle_v1_event(event_data):
             chat_id = message.get("chat_id")
 
             logger.info(f"收到v1.0消息: 类型={msg_type}, 发送者={sender_id}, 聊天类型={chat_type}")
+            set_trace_attribute("user_id", sender_id)
+            set_trace_attribute("msg_type", msg_type)
 
             if msg_type == "text":
                 content_json = json.loads(message.get("content", "{}"))
@@ -177,9 +214,7 @@ def handle_v1_event(event_data):
 def handle_text_message(sender_id, text_content, chat_type, chat_id, mentions):
     """处理文本消息"""
     # 检查用户是否存在
-    user = get_user(sender_id)
-    if not user:
-        add_user(sender_id)
+    ensure_user(sender_id)
 
     # 群聊逻辑处理
     is_mention = False
@@ -219,9 +254,7 @@ def handle_text_message(sender_id, text_content, chat_type, chat_id, mentions):
 def handle_image_message(sender_id, message, chat_type, chat_id):
     """处理图片消息"""
     # 检查用户是否存在
-    user = get_user(sender_id)
-    if not user:
-        add_user(sender_id)
+    ensure_user(sender_id)
 
     # 创建回复函数
     reply_func = create_reply_function(sender_id, chat_type, chat_id, [])
@@ -233,8 +266,10 @@ def handle_image_message(sender_id, message, chat_type, chat_id):
             image_key = content_json.get("image_key", "")
 
             if image_key:
-                # 缓存图片key
+                # 缓存图片key，并在后台预取图片、预先上传到Dify
                 if image_cache.save_user_image_key(sender_id, image_key):
+                    commit_unit_of_work()
+                    image_cache.start_prefetch(sender_id, image_key)
                     reply_func(
                         "我收到了您的图片！请告诉我您希望我对这张图片做什么？\n\n例如：\n- 描述图片内容\n- 翻译图片中的文字\n- 分析图片数据\n- 提取图片中的信息\n\n（此图片将在5分钟后自动清除）")
                 else:
@@ -250,13 +285,30 @@ def handle_image_message(sender_id, message, chat_type, chat_id):
 
 def handle_text_with_cached_image(sender_id, text, cached_image_key, reply_func):
     """处理带缓存图片的文本消息"""
+    from services.dify_service import register_generation, unregister_generation
+
+    # 收到消息时登记，取代之前未完成的生成
+    generation = register_generation(sender_id)
+
+    timer = StageTimer("图片消息处理")
+    ack = None
+
     try:
-        reply_func("正在分析图片并处理您的请求，请稍候...")
+        ack = send_acknowledgement(reply_func, "正在分析图片并处理您的请求，请稍候...")
+
+        # 预取线程也会写入会话，等待前先提交本事件的写入
+        commit_unit_of_work()
 
-        # 下载并缓存图片
-        image_path = image_cache.download_and_cache_image(sender_id, cached_image_key)
+        # 优先使用收到图片时的预取结果，否则现场下载
+        prefetched = image_cache.get_prefetch_result(sender_id, cached_image_key, timeout=Config.API_TIMEOUT)
+        if prefetched:
+            image_path = prefetched['image_path']
+        else:
+            image_path = image_cache.download_and_cache_image(sender_id, cached_image_key)
+        timer.mark("获取图片")
 
         if not image_path:
+            wait_acknowledgement(ack)
             reply_func("抱歉，无法下载图片，请重新发送图片。")
             image_cache.clear_user_image(sender_id)
             return
@@ -268,6 +320,7 @@ def handle_text_with_cached_image(sender_id, text, cached_image_key, reply_func)
         model = get_session_model(session_id)
 
         if not model:
+            wait_acknowledgement(ack)
             reply_func("当前没有设置默认模型，无法处理图片。请先使用 `\\change-model [模型名称]` 命令选择一个模型。")
             image_cache.clear_user_image(sender_id)
             return
@@ -275,20 +328,37 @@ def handle_text_with_cached_image(sender_id, text, cached_image_key, reply_func)
         # 添加用户消息记录（包含图片信息）
         user_message = f"[图片] {text}"
         add_message(session_id, sender_id, user_message, is_user=1)
+        commit_unit_of_work()
+        timer.mark("会话")
 
         # 调用图片+文本处理
         from services.dify_service import process_image_and_text
 
+        # 预取时已上传到同一模型则直接复用文件ID
+        upload_file_id = None
+        if prefetched and prefetched['model_id'] == model['id']:
+            upload_file_id = prefetched['upload_file_id']
+
         try:
-            response = process_image_and_text(model, image_path, text, conversation_id, sender_id, session_id)
-            reply_func(response)
+            response = process_image_and_text(model, image_path, text, conversation_id, sender_id, session_id,
+                                              upload_file_id=upload_file_id, generation=generation)
+            timer.mark("Dify")
+            if response is not None:
+                wait_acknowledgement(ack)
+                timer.mark("等待提示")
+                reply_func(response)
+                timer.mark("回复")
+                timer.log()
         except Exception as e:
             logger.error(f"AI处理图片+文本失败: {e}")
             # 降级处理：只处理文本，告知用户图片信息
             fallback_text = f"我收到了您发送的图片，您的问题是：{text}\n\n由于图片处理遇到问题，我只能根据您的文字描述来回答。"
             from services.dify_service import process_dify_message
-            fallback_response = process_dify_message(model, fallback_text, conversation_id, sender_id, session_id)
-            reply_func(fallback_response)
+            fallback_response = process_dify_message(model, fallback_text, conversation_id, sender_id, session_id,
+                                                     generation=generation)
+            if fallback_response is not None:
+                wait_acknowledgement(ack)
+                reply_func(fallback_response)
 
         # 处理完后清除缓存
         image_cache.clear_user_image(sender_id)
@@ -297,8 +367,11 @@ def handle_text_with_cached_image(sender_id, text, cached_image_key, reply_func)
         logger.error(f"处理图片+文本出错: {e}")
         import traceback
         logger.error(traceback.format_exc())
+        wait_acknowledgement(ack)
         reply_func("处理图片和文本时出现错误，请稍后重试。")
         image_cache.clear_user_image(sender_id)
+    finally:
+        unregister_generation(generation)
 
 
 def create_reply_function(sender_id, chat_type, chat_id, mentions):
@@ -308,6 +381,8 @@ def create_reply_function(sender_id, chat_type, chat_id, mentions):
     reply_type = "chat_id" if is_mention and chat_type == "group" else "open_id"
 
     def reply(content):
+        # 调用飞书接口前提交本事件的写入，避免网络请求期间持有数据库写锁
+        commit_unit_of_work()
         try:
             if reply_type == "open_id":
                 send_message(open_id=reply_id, content=content)
@@ -322,7 +397,12 @@ def create_reply_function(sender_id, chat_type, chat_id, mentions):
 def process_message(sender_id, content, reply_func):
     """处理用户消息的核心函数"""
     from models.session import get_or_create_session, get_session_model, add_message
-    from services.dify_service import process_dify_message
+    from services.dify_service import process_dify_message, register_generation, unregister_generation
+
+    # 收到消息时登记，取代之前未完成的生成
+    generation = register_generation(sender_id)
+
+    timer = StageTimer("消息处理")
 
     try:
         # 获取用户会话
@@ -334,20 +414,34 @@ def process_message(sender_id, content, reply_func):
                 "当前没有设置默认模型，请先使用 `\\change-model [模型名称]` 命令选择一个模型，或者联系管理员设置默认模型。")
             return True
 
-        # 添加用户消息记录
-        add_message(session_id, sender_id, content, is_user=1)
+        timer.mark("会话")
+
+        # 处理中提示在后台发送，与写入消息、调用Dify并行
+        ack = send_acknowledgement(reply_func, "正在思考中，请稍候...")
 
-        # 发送消息到Dify
-        reply_func("正在思考中，请稍候...")
+        # 添加用户消息记录，与之前的写入一起在调用Dify前提交
+        add_message(session_id, sender_id, content, is_user=1)
+        commit_unit_of_work()
+        timer.mark("写入消息")
 
         try:
-            full_response = process_dify_message(model, content, conversation_id, sender_id, session_id)
+            full_response = process_dify_message(model, content, conversation_id, sender_id, session_id,
+                                                 generation=generation)
+            timer.mark("Dify")
+            if full_response is None:
+                # 生成已被用户的后续操作取消
+                return True
+            wait_acknowledgement(ack)
+            timer.mark("等待提示")
             reply_func(full_response)
+            timer.mark("回复")
+            timer.log()
             return True
         except Exception as e:
             logger.error(f"处理消息出错: {str(e)}")
             import traceback
             logger.error(traceback.format_exc())
+            wait_acknowledgement(ack)
             reply_func(f"处理消息时出错: {str(e)}")
             return False
 
@@ -357,3 +451,5 @@ def process_message(sender_id, content, reply_func):
         logger.error(traceback.format_exc())
         reply_func("消息处理时发生意外错误，请稍后重试。")
         return False
+    finally:
+        unregister_generation(generation)
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import hmac
+import logging
+from bottle import request, HTTPResponse
+
+from config import Config
+from utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def setup_metrics_routes(app):
+    """设置监控指标路由"""
+    if not Config.METRICS_ENABLED:
+        logger.info("监控指标接口已关闭")
+        return
+
+    @app.get('/metrics')
+    def metrics():
+        """Prometheus抓取接口"""
+        if Config.METRICS_TOKEN:
+            authorization = request.get_header('Authorization', '')
+            if not hmac.compare_digest(authorization, f"Bearer {Config.METRICS_TOKEN}"):
+                return HTTPResponse(status=401, body="unauthorized")
+
+        return HTTPResponse(status=200, body=registry.render(), headers={'Content-Type': PROMETHEUS_CONTENT_TYPE})
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import json
+import time
 import logging
 import traceback
 from bottle import request, HTTPResponse
@@ -11,6 +12,8 @@ from models.webhook import get_webhook, get_webhook_subscriptions, log_webhook_c
 from services.lark_service import send_message
 from services.dify_service import ask_dify_blocking
 from utils.helpers import format_data_for_ai, parse_utf8, ensure_utf8
+from utils.metrics import WEBHOOK_CALLS, WEBHOOK_DURATION
+from utils.tracing import trace_request, set_trace_attribute
 
 logger = logging.getLogger(__name__)
 
@@ -19,19 +22,32 @@ def setup_webhook_routes(app):
     """设置Webhook相关路由"""
 
     @app.post('/api/webhook/<token>')
+    @trace_request("Webhook调用")
     def webhook_endpoint(token):
         """外部系统通过webhook调用机器人"""
+        started_at = time.perf_counter()
+        # 无效token不按token区分，避免被随意请求撑大指标
+        webhook_name = "unknown"
+
+        def record(status):
+            WEBHOOK_CALLS.inc(webhook_name, status)
+            WEBHOOK_DURATION.observe(time.perf_counter() - started_at, webhook_name)
+
         try:
             # 验证token
             webhook = get_webhook(api_token=token)
             if not webhook:
                 logger.warning(f"无效的webhook token: {token}")
+                record(401)
                 return HTTPResponse(
                     status=401,
                     body=json.dumps({"error": "无效的webhook token"}),
                     headers={'Content-Type': 'application/json'}
                 )
 
+            webhook_name = webhook['name']
+            set_trace_attribute("webhook", webhook_name)
+
             # 获取请求数据
             try:
                 body = request.body.read().decode('utf-8')
@@ -46,7 +62,7 @@ def setup_webhook_routes(app):
                 data = {"error": "无法解析请求数据"}
 
             # 记录请求
-            logger.info(f"接收到webhook调用: {webhook['name']}, 数据: {data}")
+            logger.info("接收到webhook调用: %s, 数据: %s", webhook['name'], data)
 
             # 获取所有订阅此webhook的目标
             subscriptions = get_webhook_subscriptions(webhook['id'])
@@ -55,6 +71,7 @@ def setup_webhook_routes(app):
                 logger.warning(f"Webhook {webhook['name']} 没有订阅者，无法发送通知")
                 log_webhook_call(webhook['id'], data, "无订阅者", 200)
 
+                record(200)
                 return HTTPResponse(
                     status=200,
                     body=json.dumps({
@@ -82,6 +99,7 @@ def setup_webhook_routes(app):
 
             # 返回成功响应
             mode = "直接推送" if webhook.get('bypass_ai', 0) == 1 else "AI处理"
+            record(200)
             return HTTPResponse(
                 status=200,
                 body=json.dumps({
@@ -94,6 +112,7 @@ def setup_webhook_routes(app):
         except Exception as e:
             logger.error(f"Webhook处理全局错误: {str(e)}")
             logger.error(traceback.format_exc())
+            record(500)
             return HTTPResponse(
                 status=500,
                 body=json.dumps({"error": str(e)}),
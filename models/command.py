@@ -4,6 +4,7 @@
 import json
 import logging
 from .database import get_db_connection
+from utils.metrics import instrument_db_functions
 
 logger = logging.getLogger(__name__)
 
@@ -48,6 +49,25 @@ def get_all_commands():
     conn.close()
     return commands
 
+def list_commands(after=None, limit=None, query=None, model_id=None):
+    """分页获取命令列表，不返回参数字段"""
+    from .pagination import fetch_page
+
+    filters, params = [], []
+    if query:
+        filters.append("(c.name LIKE ? OR c.trigger LIKE ? OR c.description LIKE ?)")
+        params.extend([f"%{query}%"] * 3)
+    if model_id:
+        filters.append("c.model_id = ?")
+        params.append(model_id)
+
+    select_sql = """
+        SELECT c.id, c.name, c.description, c.trigger, c.model_id, m.name as model_name
+        FROM commands c
+        LEFT JOIN models m ON c.model_id = m.id
+    """
+    return fetch_page(select_sql, ["c.name", "c.id"], False, filters, params, after, limit)
+
 def add_command(name, description, trigger, model_id, parameters=None):
     """添加命令"""
     conn = get_db_connection()
@@ -122,4 +142,8 @@ def delete_command(command_id):
     conn.commit()
     affected = conn.total_changes
     conn.close()
-    return affected > 0
\ No newline at end of file
+    return affected > 0
+
+
+# 记录每个数据访问函数的耗时
+instrument_db_functions(globals())
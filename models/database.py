@@ -1,14 +1,24 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import time
 import sqlite3
 import logging
+import threading
 from config import Config
 
 logger = logging.getLogger(__name__)
 
-def get_db_connection():
-    """获取数据库连接"""
+# 当前线程的工作单元
+_local = threading.local()
+
+# 工作单元统计
+_unit_stats = {"units": 0, "statements": 0, "commits": 0}
+_unit_stats_lock = threading.Lock()
+
+
+def _connect():
+    """创建新的数据库连接"""
     conn = sqlite3.connect(Config.DB_PATH)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA encoding = 'UTF-8'")
@@ -16,7 +26,220 @@ def get_db_connection():
     conn.text_factory = str
     return conn
 
+
+def get_db_connection():
+    """获取数据库连接
+
+    当前线程处于工作单元中时返回共享连接，否则创建新连接。
+    """
+    unit = getattr(_local, 'unit', None)
+    if unit is not None:
+        return unit.connection()
+    return _connect()
+
+
+class SharedConnection:
+    """工作单元内共享的连接
+
+    commit() 只标记有待提交的写入，close() 不关闭连接，二者都推迟到工作单元提交时执行。
+    total_changes 只统计从获取该连接起的变更，与独立连接的行为一致。
+    rollback() 只回滚从获取该连接起的写入：获取时已有其他函数待提交的写入，则设置保存点，回滚到保存点为止。
+    """
+
+    def __init__(self, unit):
+        self._unit = unit
+        self._changes_base = unit.conn.total_changes
+        self._savepoint = None
+        # 只在已有写事务时设置保存点，不为只读访问开启事务
+        if unit.conn.in_transaction:
+            self._savepoint = unit.next_savepoint()
+            self._commits = unit.commits
+            unit.conn.execute(f"SAVEPOINT {self._savepoint}")
+
+    def _savepoint_active(self):
+        """保存点在工作单元提交后失效"""
+        return (self._savepoint is not None and self._unit.commits == self._commits
+                and self._unit.conn.in_transaction)
+
+    @property
+    def total_changes(self):
+        return self._unit.conn.total_changes - self._changes_base
+
+    def cursor(self):
+        return self._unit.conn.cursor()
+
+    def execute(self, sql, parameters=()):
+        return self._unit.conn.execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._unit.conn.executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        if self._savepoint_active():
+            self._unit.conn.execute(f"ROLLBACK TO {self._savepoint}")
+        else:
+            self._unit.rollback()
+
+    def close(self):
+        if self._savepoint_active():
+            try:
+                self._unit.conn.execute(f"RELEASE {self._savepoint}")
+            except sqlite3.OperationalError:
+                # 外层连接先关闭时已一并释放
+                pass
+        self._savepoint = None
+
+    def __getattr__(self, name):
+        return getattr(self._unit.conn, name)
+
+
+class UnitOfWork:
+    """请求级数据库工作单元
+
+    在with块内，当前线程所有通过get_db_connection获取的连接共享同一个SQLite连接，
+    读操作不再重复建立连接，写操作合并为一个事务，在commit()或退出时提交。
+    调用耗时的外部接口前应先commit()，避免长时间持有写锁。
+    """
+
+    def __init__(self, name="request"):
+        self.name = name
+        self.conn = None
+        self.statements = 0
+        self.commits = 0
+        self._savepoints = 0
+        self._started_at = None
+        self._previous = None
+
+    def _trace(self, statement):
+        self.statements += 1
+
+    def next_savepoint(self):
+        self._savepoints += 1
+        return f"uow_{self._savepoints}"
+
+    def connection(self):
+        """获取共享连接，首次使用时才建立"""
+        if self.conn is None:
+            self.conn = _connect()
+            self.conn.set_trace_callback(self._trace)
+        return SharedConnection(self)
+
+    def commit(self):
+        """提交工作单元内已执行的写入"""
+        if self.conn is not None and self.conn.in_transaction:
+            self.conn.commit()
+            self.commits += 1
+
+    def rollback(self):
+        if self.conn is not None and self.conn.in_transaction:
+            self.conn.rollback()
+
+    def __enter__(self):
+        self._previous = getattr(_local, 'unit', None)
+        self._started_at = time.perf_counter()
+        _local.unit = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _local.unit = self._previous
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.rollback()
+        finally:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+        with _unit_stats_lock:
+            _unit_stats["units"] += 1
+            _unit_stats["statements"] += self.statements
+            _unit_stats["commits"] += self.commits
+
+        logger.debug(f"工作单元 {self.name}: {self.statements} 次数据库访问, {self.commits} 次提交, "
+                     f"耗时 {(time.perf_counter() - self._started_at) * 1000:.1f}ms")
+        return False
+
+
+def commit_unit_of_work():
+    """提交当前线程工作单元中待提交的写入，不在工作单元中时无操作"""
+    unit = getattr(_local, 'unit', None)
+    if unit is not None:
+        unit.commit()
+
+
+def get_unit_of_work_stats():
+    """获取工作单元统计，包括每个工作单元的平均数据库访问次数"""
+    with _unit_stats_lock:
+        stats = dict(_unit_stats)
+    stats["statements_per_unit"] = stats["statements"] / stats["units"] if stats["units"] else 0
+    return stats
+
+
+def enable_wal():
+    """将数据库切换为WAL模式（持久保存在数据库文件中），返回切换后的日志模式
+
+    WAL模式下读事务不阻塞写入，在线备份可以在读事务中分步进行。
+    """
+    conn = _connect()
+    try:
+        mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0].lower()
+    finally:
+        conn.close()
+    if mode != "wal":
+        logger.warning(f"数据库无法切换为WAL模式，当前日志模式: {mode}")
+    return mode
+
+
+def backup_database(dest_path, pages=-1, progress=None, max_restarts=3):
+    """使用SQLite在线备份API将数据库备份到dest_path
+
+    pages为每步复制的页数（-1表示一次完成），progress为每步完成后的回调 progress(status, remaining, total)，
+    可以在其中暂停以控制备份速度。
+
+    数据库为WAL模式时（启动时由enable_wal切换），整个备份在源连接的一个读事务中进行：各步复制的是同一个快照，
+    其他连接在两步之间的写入不会使备份重新开始，写入也不会被阻塞。
+    未使用WAL时，每步复制期间其他连接的提交需要等待，两步之间的写入会使备份从头开始，
+    重新开始超过max_restarts次时放弃并抛出异常。
+    备份文件使用普通的回滚日志模式，可以单独复制和恢复。
+    """
+    state = {"remaining": None, "restarts": 0}
+
+    def on_progress(status, remaining, total):
+        # 每步成功复制后剩余页数应减少，不减少说明备份已从头开始（数据库繁忙时的重试不计入）
+        if status == sqlite3.SQLITE_OK and state["remaining"] is not None and remaining >= state["remaining"]:
+            state["restarts"] += 1
+            if state["restarts"] > max_restarts:
+                raise sqlite3.OperationalError(f"备份因源数据库写入重新开始超过 {max_restarts} 次")
+        if status == sqlite3.SQLITE_OK:
+            state["remaining"] = remaining
+        if progress:
+            progress(status, remaining, total)
+
+    source = _connect()
+    dest = sqlite3.connect(dest_path)
+    try:
+        if source.execute("PRAGMA journal_mode").fetchone()[0].lower() == "wal":
+            # 开启读事务并读取一次，固定快照直到备份结束
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        else:
+            logger.warning("数据库未使用WAL模式，备份期间的写入会被阻塞或使备份重新开始")
+        source.backup(dest, pages=pages, progress=on_progress)
+        dest.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        if source.in_transaction:
+            source.rollback()
+        dest.close()
+        source.close()
+    return dest_path
+
+
 def init_database():
     """初始化数据库（使用迁移系统）"""
     from .migration import init_database_with_migration
-    return init_database_with_migration()
\ No newline at end of file
+    return init_database_with_migration()
@@ -3,13 +3,21 @@
 
 import os
 import json
+import time
 import logging
+import threading
 import traceback
 from datetime import datetime
 from .database import get_db_connection
 
 logger = logging.getLogger(__name__)
 
+# 后台分批迁移线程
+_batched_thread = None
+_batched_thread_lock = threading.Lock()
+# 分批迁移的实时吞吐: version -> 行/秒
+_batched_throughput = {}
+
 
 class DatabaseMigration:
     """数据库迁移管理类"""
@@ -29,6 +37,9 @@ class DatabaseMigration:
         cursor = conn.cursor()
 
         try:
+            # 新数据库启用增量vacuum，便于数据清理后回收空间；已有数据库需执行一次VACUUM才会生效
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
             cursor.execute('''
             CREATE TABLE IF NOT EXISTS db_migrations (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -38,6 +49,18 @@ class DatabaseMigration:
                 checksum TEXT
             )
             ''')
+
+            # 分批迁移的状态和进度，status为running的迁移在后台继续执行
+            batched_columns = [
+                ("status", "TEXT DEFAULT 'completed'"),
+                ("progress", "INTEGER DEFAULT 0"),
+                ("total", "INTEGER DEFAULT 0"),
+                ("last_key", "TEXT"),
+                ("updated_at", "TIMESTAMP"),
+            ]
+            for column, definition in batched_columns:
+                if not self.column_exists(cursor, "db_migrations", column):
+                    cursor.execute(f"ALTER TABLE db_migrations ADD COLUMN {column} {definition}")
             conn.commit()
             logger.info("迁移记录表初始化完成")
         except Exception as e:
@@ -95,25 +118,36 @@ class DatabaseMigration:
         finally:
             conn.close()
 
-    def apply_migration(self, migration_func, version, name):
-        """应用单个迁移"""
+    def apply_migration(self, migration_func, version, name, total_func=None):
+        """应用单个迁移
+
+        total_func不为空时表示分批迁移：这里只执行结构变更并记录为running，
+        数据回填由后台线程分批完成。
+        """
         conn = get_db_connection()
         cursor = conn.cursor()
 
         try:
             logger.info(f"开始应用迁移: {version} - {name}")
 
-            # 开始事务
-            cursor.execute("BEGIN")
+            # 开始事务，立即获取写锁：后台分批迁移持有写锁时等待，而不是在升级为写事务时直接失败
+            cursor.execute("BEGIN IMMEDIATE")
 
             # 执行迁移
             migration_func(cursor)
 
             # 记录迁移
-            cursor.execute(
-                "INSERT OR REPLACE INTO db_migrations (version, name) VALUES (?, ?)",
-                (version, name)
-            )
+            if total_func:
+                cursor.execute(
+                    """INSERT OR REPLACE INTO db_migrations (version, name, status, progress, total, updated_at)
+                       VALUES (?, ?, 'running', 0, ?, CURRENT_TIMESTAMP)""",
+                    (version, name, total_func(cursor))
+                )
+            else:
+                cursor.execute(
+                    "INSERT OR REPLACE INTO db_migrations (version, name) VALUES (?, ?)",
+                    (version, name)
+                )
 
             # 提交事务
             conn.commit()
@@ -128,37 +162,136 @@ class DatabaseMigration:
         finally:
             conn.close()
 
-    def run_migrations(self):
-        """执行所有未应用的迁移"""
+    def get_pending_migrations(self):
+        """获取未应用的迁移，按版本号排序"""
         applied_migrations = set(self.get_applied_migrations())
 
-        # 获取所有可用的迁移
-        available_migrations = self.get_available_migrations()
+        pending_migrations = [
+            (version, migration_info)
+            for version, migration_info in self.get_available_migrations()
+            if version not in applied_migrations
+        ]
+        pending_migrations.sort(key=lambda x: self.version_to_tuple(x[0]))
+        return pending_migrations
 
-        # 找出未应用的迁移
-        pending_migrations = []
-        for version, migration_info in available_migrations:
-            if version not in applied_migrations:
-                pending_migrations.append((version, migration_info))
+    def run_migrations(self):
+        """执行所有未应用的迁移"""
+        pending_migrations = self.get_pending_migrations()
 
         if not pending_migrations:
             logger.info("没有需要应用的迁移")
             return True
 
-        # 按版本号排序
-        pending_migrations.sort(key=lambda x: self.version_to_tuple(x[0]))
-
         success_count = 0
         for version, migration_info in pending_migrations:
-            if self.apply_migration(migration_info['func'], version, migration_info['name']):
+            if self.apply_migration(migration_info['func'], version, migration_info['name'],
+                                    migration_info.get('total')):
                 success_count += 1
             else:
                 logger.error(f"迁移失败，停止后续迁移: {version}")
                 break
 
         logger.info(f"迁移完成，成功应用 {success_count}/{len(pending_migrations)} 个迁移")
+        start_batched_migrations(self)
         return success_count == len(pending_migrations)
 
+    def get_batched_migrations(self, statuses=None):
+        """获取分批迁移的记录"""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute("""
+                SELECT version, name, status, progress, total, last_key, applied_at, updated_at
+                FROM db_migrations WHERE status != 'completed' OR total > 0
+                ORDER BY version
+            """)
+            rows = [dict(row) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+
+        if statuses:
+            rows = [row for row in rows if row['status'] in statuses]
+        rows.sort(key=lambda row: self.version_to_tuple(row['version']))
+        return rows
+
+    def run_batched_migration(self, version, batch_func):
+        """分批执行迁移的数据回填，每批一个短事务，进度写入db_migrations以便中断后继续
+
+        batch_func(cursor, last_key, batch_size) 处理last_key之后最多batch_size行，
+        返回 (新的last_key, 处理行数)，处理行数为0表示完成。
+        """
+        from config import Config
+
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT progress, last_key FROM db_migrations WHERE version = ?", (version,))
+        row = cursor.fetchone()
+        last_key = json.loads(row['last_key']) if row and row['last_key'] else None
+
+        started_at = time.monotonic()
+        processed_total = 0
+
+        try:
+            while True:
+                cursor.execute("BEGIN IMMEDIATE")
+                last_key, processed = batch_func(cursor, last_key, Config.MIGRATION_BATCH_SIZE)
+
+                if processed:
+                    cursor.execute(
+                        """UPDATE db_migrations
+                           SET progress = progress + ?, last_key = ?, updated_at = CURRENT_TIMESTAMP
+                           WHERE version = ?""",
+                        (processed, json.dumps(last_key), version)
+                    )
+                else:
+                    cursor.execute(
+                        "UPDATE db_migrations SET status = 'completed', updated_at = CURRENT_TIMESTAMP WHERE version = ?",
+                        (version,)
+                    )
+                conn.commit()
+
+                if not processed:
+                    break
+
+                processed_total += processed
+                _batched_throughput[version] = processed_total / max(time.monotonic() - started_at, 1e-6)
+
+                # 批次之间让出写锁，保证机器人正常读写
+                time.sleep(Config.MIGRATION_BATCH_PAUSE)
+
+            logger.info(f"分批迁移完成: {version}，本次处理 {processed_total} 行，"
+                        f"耗时 {time.monotonic() - started_at:.1f}s")
+            return True
+
+        except Exception as e:
+            logger.error(f"分批迁移失败: {version}: {e}")
+            logger.error(traceback.format_exc())
+            conn.rollback()
+            cursor.execute(
+                "UPDATE db_migrations SET status = 'failed', updated_at = CURRENT_TIMESTAMP WHERE version = ?",
+                (version,)
+            )
+            conn.commit()
+            return False
+        finally:
+            _batched_throughput.pop(version, None)
+            conn.close()
+
+    def run_batched_migrations(self):
+        """执行所有未完成（running/failed）的分批迁移"""
+        available = dict(self.get_available_migrations())
+
+        for row in self.get_batched_migrations(statuses=('running', 'failed')):
+            migration_info = available.get(row['version'])
+            if not migration_info or 'batch' not in migration_info:
+                logger.warning(f"找不到分批迁移的实现: {row['version']}")
+                continue
+
+            if not self.run_batched_migration(row['version'], migration_info['batch']):
+                # 保持顺序，前一个分批迁移失败时不继续
+                break
+
     def version_to_tuple(self, version_str):
         """将版本字符串转换为元组，用于比较"""
         try:
@@ -167,7 +300,14 @@ class DatabaseMigration:
             return (0, 0, 0)
 
     def get_available_migrations(self):
-        """获取所有可用的迁移"""
+        """获取所有可用的迁移
+
+        普通迁移在一个事务中执行完。需要回填大表的迁移可以额外提供：
+        - "total": total(cursor) 返回需要处理的行数
+        - "batch": batch(cursor, last_key, batch_size) 分批处理，见run_batched_migration
+        此时 "func" 只做结构变更，回填在后台分批进行，服务启动不受影响；
+        后续迁移不能依赖尚未完成的回填数据。
+        """
         return [
             ("1.0.0", {"name": "初始化数据库", "func": self.migrate_1_0_0}),
             ("1.1.0", {"name": "添加会话扩展字段", "func": self.migrate_1_1_0}),
@@ -175,6 +315,16 @@ class DatabaseMigration:
             ("1.3.0", {"name": "添加图片缓存支持", "func": self.migrate_1_3_0}),
             ("1.4.0", {"name": "添加Webhook回退机制", "func": self.migrate_1_4_0}),
             ("1.5.0", {"name": "优化索引和性能", "func": self.migrate_1_5_0}),
+            ("1.6.0", {"name": "压缩消息内容", "func": self.migrate_1_6_0,
+                       "total": self.count_messages_1_6_0, "batch": self.compress_messages_1_6_0}),
+            ("1.6.1", {"name": "压缩Webhook日志", "func": self.migrate_1_6_1,
+                       "total": self.count_webhook_logs_1_6_1, "batch": self.compress_webhook_logs_1_6_1}),
+            ("1.7.0", {"name": "添加消息全文索引", "func": self.migrate_1_7_0,
+                       "total": self.count_messages_1_6_0, "batch": self.index_messages_1_7_0}),
+            ("1.7.1", {"name": "添加Webhook日志全文索引", "func": self.migrate_1_7_1,
+                       "total": self.count_webhook_logs_1_6_1, "batch": self.index_webhook_logs_1_7_1}),
+            ("1.8.0", {"name": "添加分页索引", "func": self.migrate_1_8_0}),
+            ("1.9.0", {"name": "添加会话查找覆盖索引", "func": self.migrate_1_9_0}),
         ]
 
     def column_exists(self, cursor, table_name, column_name):
@@ -438,32 +588,138 @@ class DatabaseMigration:
                 cursor.execute(index_sql)
                 logger.info(f"创建索引: {index_name}")
 
+    def compress_rows(self, cursor, table, columns, last_key, batch_size):
+        """压缩表中id在last_key之后的一批行的大文本字段，返回 (新的last_key, 扫描行数)"""
+        from utils.compression import compress_text
+
+        cursor.execute(
+            f"SELECT id, {', '.join(columns)} FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+            (last_key or 0, batch_size)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return last_key, 0
+
+        updates = []
+        for row in rows:
+            values = [compress_text(row[column]) for column in columns]
+            if any(value is not row[column] for value, column in zip(values, columns)):
+                updates.append(values + [row['id']])
+
+        if updates:
+            assignments = ", ".join(f"{column} = ?" for column in columns)
+            cursor.executemany(f"UPDATE {table} SET {assignments} WHERE id = ?", updates)
+
+        return rows[-1]['id'], len(rows)
+
+    def migrate_1_6_0(self, cursor):
+        """1.6.0 - 压缩消息内容（结构不变，已有数据由后台分批压缩）"""
+        logger.info("执行迁移 1.6.0: 压缩消息内容")
+
+    def count_messages_1_6_0(self, cursor):
+        cursor.execute("SELECT COUNT(*) FROM messages")
+        return cursor.fetchone()[0]
+
+    def compress_messages_1_6_0(self, cursor, last_key, batch_size):
+        return self.compress_rows(cursor, "messages", ["content"], last_key, batch_size)
+
+    def migrate_1_6_1(self, cursor):
+        """1.6.1 - 压缩Webhook日志（结构不变，已有数据由后台分批压缩）"""
+        logger.info("执行迁移 1.6.1: 压缩Webhook日志")
+
+    def count_webhook_logs_1_6_1(self, cursor):
+        cursor.execute("SELECT COUNT(*) FROM webhook_logs")
+        return cursor.fetchone()[0]
+
+    def compress_webhook_logs_1_6_1(self, cursor, last_key, batch_size):
+        return self.compress_rows(cursor, "webhook_logs", ["request_data", "response"], last_key, batch_size)
+
+    def migrate_1_7_0(self, cursor):
+        """1.7.0 - 添加全文索引表，已有消息由后台分批建立索引"""
+        from .search import create_search_tables
+
+        logger.info("执行迁移 1.7.0: 添加全文索引")
+        create_search_tables(cursor)
+
+    def index_messages_1_7_0(self, cursor, last_key, batch_size):
+        from .search import backfill_index
+        return backfill_index(cursor, "messages", last_key, batch_size)
+
+    def migrate_1_7_1(self, cursor):
+        """1.7.1 - 为已有Webhook日志建立全文索引（索引表在1.7.0中创建）"""
+        logger.info("执行迁移 1.7.1: 添加Webhook日志全文索引")
+
+    def index_webhook_logs_1_7_1(self, cursor, last_key, batch_size):
+        from .search import backfill_index
+        return backfill_index(cursor, "webhook_logs", last_key, batch_size)
+
+    def migrate_1_8_0(self, cursor):
+        """1.8.0 - 添加管理界面分页排序用的索引"""
+        logger.info("执行迁移 1.8.0: 添加分页索引")
+
+        # 用户列表按创建时间倒序分页，索引隐含id，(created_at, id) 游标条件可直接走索引
+        if not self.index_exists(cursor, "idx_users_created_at"):
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at)")
+            logger.info("创建索引: idx_users_created_at")
+
+    def migrate_1_9_0(self, cursor):
+        """1.9.0 - 按get_or_create_session的查询条件添加覆盖索引"""
+        logger.info("执行迁移 1.9.0: 添加会话查找覆盖索引")
+
+        # 等值条件在前，last_active_at用于范围过滤和排序，id隐含在索引中，查找无需回表
+        # 只按用户查找的情况由1.5.0的idx_sessions_active覆盖
+        indexes = [
+            ("idx_sessions_model_lookup",
+             "CREATE INDEX IF NOT EXISTS idx_sessions_model_lookup "
+             "ON sessions (user_id, model_id, command_id, is_active, last_active_at)"),
+            ("idx_sessions_command_lookup",
+             "CREATE INDEX IF NOT EXISTS idx_sessions_command_lookup "
+             "ON sessions (user_id, command_id, is_active, last_active_at)"),
+        ]
+
+        for index_name, index_sql in indexes:
+            if not self.index_exists(cursor, index_name):
+                cursor.execute(index_sql)
+                logger.info(f"创建索引: {index_name}")
+
     def backup_database(self):
-        """备份数据库"""
-        import shutil
+        """使用在线备份API备份数据库"""
         from config import Config
+        from .database import backup_database
 
         try:
             backup_path = f"{Config.DB_PATH}.backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-            shutil.copy2(Config.DB_PATH, backup_path)
+            backup_database(backup_path)
             logger.info(f"数据库备份成功: {backup_path}")
             return backup_path
         except Exception as e:
             logger.error(f"数据库备份失败: {e}")
             return None
 
-    def validate_database_integrity(self):
-        """验证数据库完整性"""
+    def validate_database_integrity(self, mode=None):
+        """验证数据库完整性
+
+        mode: quick 使用 PRAGMA quick_check（不校验索引内容，大库上快得多），
+        full 使用 PRAGMA integrity_check，off 跳过检查。默认取 Config.DB_INTEGRITY_CHECK。
+        """
+        from config import Config
+
+        mode = mode or Config.DB_INTEGRITY_CHECK
+        if mode == "off":
+            logger.info("已跳过数据库完整性检查")
+            return True
+
+        pragma = "integrity_check" if mode == "full" else "quick_check"
+
         conn = get_db_connection()
         cursor = conn.cursor()
 
         try:
-            # 执行PRAGMA integrity_check
-            cursor.execute("PRAGMA integrity_check")
+            cursor.execute(f"PRAGMA {pragma}")
             result = cursor.fetchone()
 
             if result and result[0] == "ok":
-                logger.info("数据库完整性检查通过")
+                logger.info(f"数据库完整性检查通过 ({pragma})")
                 return True
             else:
                 logger.error(f"数据库完整性检查失败: {result}")
@@ -476,44 +732,88 @@ class DatabaseMigration:
             conn.close()
 
 
+def start_batched_migrations(migration=None):
+    """在后台线程中执行未完成的分批迁移，已有线程在运行时不重复启动"""
+    global _batched_thread
+
+    migration = migration or DatabaseMigration()
+    if not migration.get_batched_migrations(statuses=('running', 'failed')):
+        return None
+
+    with _batched_thread_lock:
+        if _batched_thread is not None and _batched_thread.is_alive():
+            return _batched_thread
+
+        _batched_thread = threading.Thread(target=migration.run_batched_migrations,
+                                           name="batched-migration", daemon=True)
+        _batched_thread.start()
+        logger.info("已在后台启动分批迁移")
+        return _batched_thread
+
+
 def init_database_with_migration():
-    """使用迁移系统初始化数据库"""
+    """使用迁移系统初始化数据库
+
+    先检查是否有待应用的迁移：没有时只做一次完整性检查；
+    有时才备份数据库（在线备份API），迁移后再检查一次。
+    """
+    from config import Config
+    from utils.helpers import StageTimer
+
     logger.info("开始数据库初始化...")
+    timer = StageTimer("数据库初始化")
 
-    migration = DatabaseMigration()
+    db_existed = os.path.exists(Config.DB_PATH) and os.path.getsize(Config.DB_PATH) > 0
 
-    # 备份数据库（如果存在）
-    from config import Config
-    if os.path.exists(Config.DB_PATH):
-        backup_path = migration.backup_database()
-        if backup_path:
-            logger.info(f"已备份现有数据库到: {backup_path}")
+    # WAL模式下读事务（包括定时备份）不阻塞写入
+    from .database import enable_wal
+    enable_wal()
+
+    migration = DatabaseMigration()
+    pending_migrations = migration.get_pending_migrations()
+    current_version = migration.get_current_version()
+    logger.info(f"当前数据库版本: {current_version}，待应用迁移: {len(pending_migrations)} 个")
+    timer.mark("检查迁移")
 
     # 验证数据库完整性
-    if os.path.exists(Config.DB_PATH):
+    if db_existed:
         if not migration.validate_database_integrity():
             logger.error("数据库完整性检查失败，请检查数据库文件")
             return False
+        timer.mark("完整性检查")
 
-    # 获取当前版本
-    current_version = migration.get_current_version()
-    logger.info(f"当前数据库版本: {current_version}")
+    if not pending_migrations:
+        # 继续上次未完成的分批迁移
+        start_batched_migrations(migration)
+        timer.log()
+        return True
+
+    # 只有需要迁移时才备份
+    if db_existed:
+        backup_path = migration.backup_database()
+        if backup_path:
+            logger.info(f"已备份现有数据库到: {backup_path}")
+        timer.mark("备份")
 
     # 执行迁移
     success = migration.run_migrations()
+    timer.mark("迁移")
 
-    if success:
-        # 再次验证数据库完整性
-        if migration.validate_database_integrity():
-            new_version = migration.get_current_version()
-            logger.info(f"数据库迁移成功！当前版本: {new_version}")
-            return True
-        else:
-            logger.error("迁移后数据库完整性检查失败")
-            return False
-    else:
+    if not success:
         logger.error("数据库迁移失败")
+        timer.log()
+        return False
+
+    # 迁移后再次验证数据库完整性
+    if not migration.validate_database_integrity():
+        logger.error("迁移后数据库完整性检查失败")
         return False
+    timer.mark("迁移后检查")
+
+    new_version = migration.get_current_version()
+    logger.info(f"数据库迁移成功！当前版本: {new_version}")
+    timer.log()
+    return True
 
 
 def get_database_info():
@@ -524,9 +824,15 @@ def get_database_info():
     applied_migrations = migration.get_applied_migrations()
     available_migrations = [version for version, _ in migration.get_available_migrations()]
 
+    batched_migrations = migration.get_batched_migrations()
+    for row in batched_migrations:
+        row['percent'] = min(100.0, row['progress'] * 100.0 / row['total']) if row['total'] else 100.0
+        row['rows_per_second'] = _batched_throughput.get(row['version'])
+
     return {
         "current_version": current_version,
         "applied_migrations": applied_migrations,
         "available_migrations": available_migrations,
-        "pending_migrations": [v for v in available_migrations if v not in applied_migrations]
+        "pending_migrations": [v for v in available_migrations if v not in applied_migrations],
+        "batched_migrations": batched_migrations
     }
\ No newline at end of file
@@ -4,6 +4,7 @@
 import json
 import logging
 from .database import get_db_connection
+from utils.metrics import instrument_db_functions
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +34,18 @@ def get_all_models():
     conn.close()
     return models
 
+def list_models(after=None, limit=None, query=None):
+    """分页获取模型列表，不返回api_key和参数等字段"""
+    from .pagination import fetch_page
+
+    filters, params = [], []
+    if query:
+        filters.append("(name LIKE ? OR description LIKE ?)")
+        params.extend([f"%{query}%"] * 2)
+
+    return fetch_page("SELECT id, name, description, dify_type, dify_url, created_at FROM models",
+                      ["name", "id"], False, filters, params, after, limit)
+
 def add_model(name, description, dify_url, dify_type, api_key, parameters=None):
     """添加模型"""
     conn = get_db_connection()
@@ -129,4 +142,8 @@ def delete_model(model_id):
     conn.commit()
     affected = conn.total_changes
     conn.close()
-    return affected > 0, "删除成功"
\ No newline at end of file
+    return affected > 0, "删除成功"
+
+
+# 记录每个数据访问函数的耗时
+instrument_db_functions(globals())
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import base64
+import logging
+from .database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(values):
+    """将排序键编码为URL安全的游标字符串"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii').rstrip("=")
+
+
+def decode_cursor(cursor):
+    """解析游标字符串，格式不正确时返回None（从第一页开始）"""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        logger.warning(f"无效的分页游标: {cursor}")
+        return None
+    return values if isinstance(values, list) else None
+
+
+def fetch_page(select_sql, order_columns, descending=False, filters=None, params=None, after=None,
+               limit=DEFAULT_PAGE_SIZE):
+    """按游标（keyset）分页查询，返回 {"items", "next_cursor"}
+
+    order_columns为排序字段，最后一个必须是唯一的（通常是id），这些字段需要出现在查询结果中；
+    翻页条件为 (排序字段...) 大于/小于 上一页最后一行的值，配合对应索引，翻到任何一页都只读取一页数据。
+    """
+    limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    conditions = list(filters or [])
+    args = list(params or [])
+
+    values = decode_cursor(after)
+    if values is not None and len(values) == len(order_columns):
+        placeholders = ", ".join("?" * len(order_columns))
+        conditions.append(f"({', '.join(order_columns)}) {'<' if descending else '>'} ({placeholders})")
+        args.extend(values)
+
+    direction = "DESC" if descending else "ASC"
+    sql = select_sql
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY " + ", ".join(f"{column} {direction}" for column in order_columns) + " LIMIT ?"
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, args + [limit + 1])
+        rows = [dict(row) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+    items = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor([last[column.split(".")[-1]] for column in order_columns])
+    return {"items": items, "next_cursor": next_cursor}
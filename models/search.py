@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import re
+import sqlite3
+import logging
+from config import Config
+from .database import get_db_connection
+from utils.metrics import instrument_db_functions
+
+logger = logging.getLogger(__name__)
+
+# 全文索引表及其对应的数据表、被索引的字段
+# 索引表为无内容（content=''）的FTS5表，rowid与数据表的id一致，只保存倒排索引，
+# 原文仍以压缩形式保存在数据表中；使用trigram分词，支持中文等任意子串搜索
+FTS_TABLES = {
+    "messages": ("messages_fts", ["content"]),
+    "webhook_logs": ("webhook_logs_fts", ["request_data", "response"]),
+}
+
+# trigram分词的最短可搜索长度
+MIN_TERM_LENGTH = 3
+# 摘要中关键词前后保留的字符数
+SNIPPET_CONTEXT = 60
+# 每页最多返回的结果数
+MAX_SEARCH_LIMIT = 100
+
+# (数据库路径, 索引表) -> 索引表是否存在
+_fts_ready = {}
+
+
+def create_search_tables(cursor):
+    """创建全文索引表，SQLite不支持FTS5或trigram分词时返回False"""
+    try:
+        for fts_table, columns in FTS_TABLES.values():
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} "
+                f"USING fts5({', '.join(columns)}, content='', tokenize='trigram')"
+            )
+    except sqlite3.OperationalError as e:
+        logger.warning(f"当前SQLite不支持FTS5 trigram全文索引，搜索功能不可用: {e}")
+        return False
+    finally:
+        _fts_ready.clear()
+    return True
+
+
+def search_available(cursor, table):
+    """判断数据表的全文索引是否可用"""
+    fts_table = FTS_TABLES[table][0]
+    key = (Config.DB_PATH, fts_table)
+    if key not in _fts_ready:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts_table,))
+        _fts_ready[key] = cursor.fetchone() is not None
+    return _fts_ready[key]
+
+
+def index_row(cursor, table, row_id, values):
+    """将一行的明文写入全文索引，values与FTS_TABLES中的字段一一对应
+
+    需要在写入数据表的同一事务中调用；索引不可用时不做任何操作。
+    """
+    if not search_available(cursor, table):
+        return
+    fts_table, columns = FTS_TABLES[table]
+    cursor.execute(
+        f"INSERT INTO {fts_table} (rowid, {', '.join(columns)}) VALUES (?{', ?' * len(columns)})",
+        [row_id] + [value or "" for value in values]
+    )
+
+
+def remove_from_index(cursor, table, rows):
+    """删除数据行之前，先从全文索引中移除
+
+    无内容索引删除时需要提供原文，rows需包含id和被索引的字段（可以是压缩后的值）。
+    """
+    from utils.compression import decompress_text
+
+    if table not in FTS_TABLES or not rows or not search_available(cursor, table):
+        return 0
+
+    fts_table, columns = FTS_TABLES[table]
+    ids = [row['id'] for row in rows]
+    # 分批回填尚未完成时，部分行可能还没有建立索引
+    cursor.execute(f"SELECT rowid FROM {fts_table} WHERE rowid IN ({','.join('?' * len(ids))})", ids)
+    indexed = {row[0] for row in cursor.fetchall()}
+
+    removed = 0
+    for row in rows:
+        if row['id'] not in indexed:
+            continue
+        cursor.execute(
+            f"INSERT INTO {fts_table} ({fts_table}, rowid, {', '.join(columns)}) "
+            f"VALUES ('delete', ?{', ?' * len(columns)})",
+            [row['id']] + [decompress_text(row[column]) or "" for column in columns]
+        )
+        removed += 1
+    return removed
+
+
+def backfill_index(cursor, table, last_key, batch_size):
+    """分批为已有数据建立索引，返回 (新的last_key, 扫描行数)，供分批迁移使用"""
+    from utils.compression import decompress_text
+
+    if not search_available(cursor, table):
+        return last_key, 0
+
+    fts_table, columns = FTS_TABLES[table]
+    cursor.execute(
+        f"SELECT id, {', '.join(columns)} FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+        (last_key or 0, batch_size)
+    )
+    rows = cursor.fetchall()
+    if not rows:
+        return last_key, 0
+
+    # 迁移之后新写入的行已由写入路径建立索引
+    cursor.execute(f"SELECT rowid FROM {fts_table} WHERE rowid BETWEEN ? AND ?", (rows[0]['id'], rows[-1]['id']))
+    indexed = {row[0] for row in cursor.fetchall()}
+
+    for row in rows:
+        if row['id'] not in indexed:
+            index_row(cursor, table, row['id'], [decompress_text(row[column]) for column in columns])
+
+    return rows[-1]['id'], len(rows)
+
+
+def build_match_query(query):
+    """将用户输入转换为FTS5查询：按空白拆分，每个词作为短语匹配，多个词之间为AND
+
+    词的长度小于MIN_TERM_LENGTH时无法使用trigram索引，抛出ValueError。
+    """
+    terms = (query or "").split()
+    if not terms:
+        raise ValueError("请输入搜索内容")
+    if any(len(term) < MIN_TERM_LENGTH for term in terms):
+        raise ValueError(f"每个搜索词至少需要{MIN_TERM_LENGTH}个字符")
+    return " AND ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def make_snippet(text, terms):
+    """截取第一个命中关键词附近的文本，返回 {"before", "match", "after"}"""
+    text = text or ""
+    pattern = re.compile("|".join(re.escape(term) for term in terms), re.IGNORECASE)
+    found = pattern.search(text)
+    if not found:
+        return {"before": text[:SNIPPET_CONTEXT * 2], "match": "", "after": ""}
+
+    start = max(0, found.start() - SNIPPET_CONTEXT)
+    end = min(len(text), found.end() + SNIPPET_CONTEXT)
+    return {
+        "before": ("…" if start > 0 else "") + text[start:found.start()],
+        "match": found.group(0),
+        "after": text[found.end():end] + ("…" if end < len(text) else ""),
+    }
+
+
+def _search(table, select_sql, filters, params, query, before_id, limit):
+    """执行全文搜索，按id从新到旧分页，返回 {"results", "next_before"}
+
+    select_sql中的{fts_table}替换为索引表名（FTS5的MATCH不能使用别名），filters为额外的过滤条件及其参数params。
+    """
+    from utils.compression import decompress_text
+
+    match = build_match_query(query)
+    terms = query.split()
+    limit = max(1, min(int(limit), MAX_SEARCH_LIMIT))
+    fts_table, columns = FTS_TABLES[table]
+
+    # 以rowid为游标分页，FTS5直接按rowid倒序扫描命中结果，翻页开销与页码无关
+    where = [f"{fts_table} MATCH ?"]
+    args = [match]
+    if before_id:
+        where.append(f"{fts_table}.rowid < ?")
+        args.append(before_id)
+    sql = (select_sql.format(fts_table=fts_table) + " WHERE " + " AND ".join(where + filters) +
+           f" ORDER BY {fts_table}.rowid DESC LIMIT ?")
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        if not search_available(cursor, table):
+            raise ValueError("全文搜索不可用，请确认数据库迁移已完成")
+        cursor.execute(sql, args + params + [limit + 1])
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    results = []
+    for row in rows[:limit]:
+        result = dict(row)
+        # 只解压当前页的内容用于生成摘要
+        text = " ".join(decompress_text(result.pop(column)) or "" for column in columns)
+        result["snippet"] = make_snippet(text, terms)
+        results.append(result)
+
+    next_before = results[-1]["id"] if len(rows) > limit else None
+    return {"results": results, "next_before": next_before}
+
+
+def search_messages(query, before_id=None, limit=20, user_id=None):
+    """搜索会话消息，可按用户过滤"""
+    select_sql = """
+        SELECT m.id, m.session_id, m.user_id, m.is_user, m.created_at, m.content
+        FROM {fts_table}
+        JOIN messages m ON m.id = {fts_table}.rowid
+    """
+    filters, params = [], []
+    if user_id:
+        filters.append("m.user_id = ?")
+        params.append(user_id)
+    return _search("messages", select_sql, filters, params, query, before_id, limit)
+
+
+def search_webhook_logs(query, before_id=None, limit=20, webhook_id=None):
+    """搜索Webhook调用日志，可按Webhook过滤"""
+    select_sql = """
+        SELECT l.id, l.webhook_id, w.name AS webhook_name, l.status, l.created_at, l.request_data, l.response
+        FROM {fts_table}
+        JOIN webhook_logs l ON l.id = {fts_table}.rowid
+        LEFT JOIN webhooks w ON w.id = l.webhook_id
+    """
+    filters, params = [], []
+    if webhook_id:
+        filters.append("l.webhook_id = ?")
+        params.append(webhook_id)
+    return _search("webhook_logs", select_sql, filters, params, query, before_id, limit)
+
+
+# 记录搜索函数的耗时，索引维护函数在迁移和批量写入中调用，不单独记录
+instrument_db_functions(globals(), names=("search_messages", "search_webhook_logs"))
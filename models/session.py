@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import sqlite3
 import logging
 from datetime import datetime, timedelta
 from .database import get_db_connection
+from utils.metrics import instrument_db_functions
 
 logger = logging.getLogger(__name__)
 
@@ -50,79 +52,70 @@ def get_all_configs():
     return configs
 
 
+# SQLite 3.35起支持RETURNING，查找并更新活动时间可以合并为一条语句
+SUPPORTS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# 新会话的模型：指定的模型 > 命令关联的模型 > 默认模型
+_INSERT_SESSION_SQL = """
+    INSERT INTO sessions (user_id, model_id, command_id, last_active_at)
+    SELECT ?, COALESCE(?, (SELECT model_id FROM commands WHERE id = ?),
+                       (SELECT CAST(value AS INTEGER) FROM configs
+                        WHERE key = 'default_model' AND value != '' AND value NOT GLOB '*[^0-9]*')),
+           ?, CURRENT_TIMESTAMP
+"""
+
+
+def _session_filter(user_id, model_id, command_id):
+    """活动会话的查找条件，与1.9.0迁移中的索引对应"""
+    if model_id and command_id:
+        return "user_id = ? AND model_id = ? AND command_id = ?", [user_id, model_id, command_id]
+    if model_id:
+        return "user_id = ? AND model_id = ? AND command_id IS NULL", [user_id, model_id]
+    if command_id:
+        return "user_id = ? AND command_id = ?", [user_id, command_id]
+    return "user_id = ?", [user_id]
+
+
 def get_or_create_session(user_id, model_id=None, command_id=None):
-    """获取或创建会话，支持模型和命令维度"""
+    """获取或创建会话，支持模型和命令维度
+
+    已有活动会话时，查找和更新活动时间在一条UPDATE ... RETURNING语句中完成；
+    没有时用一条INSERT ... SELECT创建，模型的回退也在语句中完成。
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
 
     timeout_minutes = int(get_config("session_timeout") or "30")
     timeout_timestamp = datetime.now() - timedelta(minutes=timeout_minutes)
 
-    # 查找活动会话
-    if model_id and command_id:
-        cursor.execute("""
-            SELECT * FROM sessions 
-            WHERE user_id = ? AND model_id = ? AND command_id = ? AND is_active = 1
-                AND last_active_at > ?
-            ORDER BY last_active_at DESC LIMIT 1
-        """, (user_id, model_id, command_id, timeout_timestamp))
-    elif model_id:
-        cursor.execute("""
-            SELECT * FROM sessions 
-            WHERE user_id = ? AND model_id = ? AND command_id IS NULL AND is_active = 1
-                AND last_active_at > ?
-            ORDER BY last_active_at DESC LIMIT 1
-        """, (user_id, model_id, timeout_timestamp))
-    elif command_id:
-        cursor.execute("""
-            SELECT s.* FROM sessions s
-            JOIN commands c ON s.command_id = c.id
-            WHERE s.user_id = ? AND s.command_id = ? AND s.is_active = 1
-                AND s.last_active_at > ?
-            ORDER BY s.last_active_at DESC LIMIT 1
-        """, (user_id, command_id, timeout_timestamp))
-    else:
-        cursor.execute("""
-            SELECT * FROM sessions 
-            WHERE user_id = ? AND is_active = 1 AND last_active_at > ?
-            ORDER BY last_active_at DESC LIMIT 1
-        """, (user_id, timeout_timestamp))
-
-    session = cursor.fetchone()
-
-    if session:
-        cursor.execute(
-            "UPDATE sessions SET updated_at = CURRENT_TIMESTAMP, last_active_at = CURRENT_TIMESTAMP WHERE id = ?",
-            (session['id'],)
-        )
-        conn.commit()
-        session_id = session['id']
-        conversation_id = session['conversation_id']
+    where, params = _session_filter(user_id, model_id, command_id)
+    lookup_sql = f"""
+        SELECT id FROM sessions
+        WHERE {where} AND is_active = 1 AND last_active_at > ?
+        ORDER BY last_active_at DESC LIMIT 1
+    """
+    touch_sql = "UPDATE sessions SET updated_at = CURRENT_TIMESTAMP, last_active_at = CURRENT_TIMESTAMP WHERE id = "
+    insert_params = (user_id, model_id, command_id, command_id)
+
+    if SUPPORTS_RETURNING:
+        cursor.execute(f"{touch_sql}({lookup_sql}) RETURNING id, conversation_id", params + [timeout_timestamp])
+        session = cursor.fetchone()
+        if session:
+            session_id, conversation_id = session['id'], session['conversation_id']
+        else:
+            cursor.execute(_INSERT_SESSION_SQL + " RETURNING id", insert_params)
+            session_id, conversation_id = cursor.fetchone()['id'], None
     else:
-        if not model_id and command_id:
-            cursor.execute("SELECT model_id FROM commands WHERE id = ?", (command_id,))
-            result = cursor.fetchone()
-            if result:
-                model_id = result['model_id']
-
-        if not model_id:
-            default_model_id = get_config("default_model")
-            if default_model_id:
-                try:
-                    model_id = int(default_model_id)
-                except (ValueError, TypeError):
-                    model_id = None
-
-        cursor.execute(
-            """INSERT INTO sessions 
-               (user_id, model_id, command_id, last_active_at) 
-               VALUES (?, ?, ?, CURRENT_TIMESTAMP)""",
-            (user_id, model_id, command_id)
-        )
-        conn.commit()
-        session_id = cursor.lastrowid
-        conversation_id = None
+        cursor.execute(lookup_sql.replace("SELECT id", "SELECT id, conversation_id", 1), params + [timeout_timestamp])
+        session = cursor.fetchone()
+        if session:
+            cursor.execute(touch_sql + "?", (session['id'],))
+            session_id, conversation_id = session['id'], session['conversation_id']
+        else:
+            cursor.execute(_INSERT_SESSION_SQL, insert_params)
+            session_id, conversation_id = cursor.lastrowid, None
 
+    conn.commit()
     conn.close()
     return session_id, conversation_id
 
@@ -145,15 +138,19 @@ def update_session_conversation(session_id, conversation_id):
 
 
 def add_message(session_id, user_id, content, is_user=1):
-    """添加消息记录"""
+    """添加消息记录，较长的内容压缩后存储，明文写入全文索引"""
+    from utils.compression import compress_text
+    from .search import index_row
+
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute(
         "INSERT INTO messages (session_id, user_id, content, is_user) VALUES (?, ?, ?, ?)",
-        (session_id, user_id, content, is_user)
+        (session_id, user_id, compress_text(content), is_user)
     )
-    conn.commit()
     message_id = cursor.lastrowid
+    index_row(cursor, "messages", message_id, [content])
+    conn.commit()
     conn.close()
     return message_id
 
@@ -189,4 +186,8 @@ def get_session_model(session_id):
                 return default_model
         return None
 
-    return dict(model) if model else None
\ No newline at end of file
+    return dict(model) if model else None
+
+
+# 记录每个数据访问函数的耗时
+instrument_db_functions(globals())
@@ -1,14 +1,142 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import time
+import atexit
 import logging
+import threading
+from collections import OrderedDict
+
+from config import Config
 from .database import get_db_connection
+from utils.metrics import instrument_db_functions, QUEUE_DEPTH
 
 logger = logging.getLogger(__name__)
 
+# 已知存在于数据库中的用户ID（有界LRU）
+_known_users = OrderedDict()
+# 等待批量写入的新用户
+_pending_users = set()
+# 管理员标记缓存: user_id -> bool（有界LRU）
+_admin_cache = OrderedDict()
+_user_cache_lock = threading.Lock()
+_flush_wakeup = threading.Event()
+_flush_thread = None
+QUEUE_DEPTH.register(lambda: {("user_flush",): len(_pending_users)})
+
+
+def _remember(cache, key, value):
+    """写入有界LRU缓存，需持有_user_cache_lock"""
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > Config.KNOWN_USERS_MAX_ENTRIES:
+        cache.popitem(last=False)
+
+
+def load_known_users():
+    """启动时加载最近活跃的用户ID和管理员标记"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT user_id, is_admin FROM users ORDER BY created_at DESC LIMIT ?",
+                   (Config.KNOWN_USERS_MAX_ENTRIES,))
+    rows = cursor.fetchall()
+    conn.close()
+
+    with _user_cache_lock:
+        for row in reversed(rows):
+            _remember(_known_users, row['user_id'], True)
+            _remember(_admin_cache, row['user_id'], row['is_admin'] == 1)
+
+    logger.info(f"已加载 {len(rows)} 个已知用户")
+    return len(rows)
+
+
+def ensure_user(user_id):
+    """确保用户存在
+
+    已知用户直接返回，不访问数据库；新用户加入待写入队列，由后台线程批量写入。
+    """
+    with _user_cache_lock:
+        if user_id in _known_users:
+            _known_users.move_to_end(user_id)
+            return
+        _remember(_known_users, user_id, True)
+        _pending_users.add(user_id)
+
+    _start_flush_thread()
+    _flush_wakeup.set()
+
+
+def flush_pending_users():
+    """将待写入的新用户批量写入数据库，返回写入的用户数"""
+    with _user_cache_lock:
+        if not _pending_users:
+            return 0
+        user_ids = list(_pending_users)
+        _pending_users.clear()
+
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.executemany("INSERT OR IGNORE INTO users (user_id, name, is_admin) VALUES (?, '', 0)",
+                           [(user_id,) for user_id in user_ids])
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        logger.error(f"批量写入用户失败: {e}")
+        # 下次再试
+        with _user_cache_lock:
+            _pending_users.update(user_ids)
+        return 0
+
+    logger.debug(f"批量写入 {len(user_ids)} 个新用户")
+    return len(user_ids)
+
+
+def _flush_loop():
+    while True:
+        _flush_wakeup.wait()
+        # 稍作等待，把同一时间段内的新用户合并为一批
+        time.sleep(Config.USER_FLUSH_INTERVAL)
+        _flush_wakeup.clear()
+        flush_pending_users()
+
+
+def _start_flush_thread():
+    global _flush_thread
+    if _flush_thread is not None:
+        return
+    with _user_cache_lock:
+        if _flush_thread is None:
+            _flush_thread = threading.Thread(target=_flush_loop, name="user-flush", daemon=True)
+            _flush_thread.start()
+
+
+def _flush_pending_user(user_id):
+    """用户在待写入队列中时先写入，保证随后的查询能读到"""
+    with _user_cache_lock:
+        pending = user_id in _pending_users
+    if pending:
+        flush_pending_users()
+
+
+def invalidate_user_cache(user_id=None):
+    """清除用户的管理员标记缓存，user_id为空时清除全部用户缓存"""
+    with _user_cache_lock:
+        if user_id is None:
+            _known_users.clear()
+            _admin_cache.clear()
+        else:
+            _admin_cache.pop(user_id, None)
+
+
+atexit.register(flush_pending_users)
+
 
 def get_user(user_id):
     """获取用户信息"""
+    _flush_pending_user(user_id)
+
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
@@ -25,38 +153,84 @@ def add_user(user_id, name="", is_admin=0):
                    (user_id, name, is_admin))
     conn.commit()
     conn.close()
+
+    with _user_cache_lock:
+        _remember(_known_users, user_id, True)
+        _admin_cache.pop(user_id, None)
     return True
 
 
 def check_admin(user_id):
-    """检查用户是否是管理员"""
+    """检查用户是否是管理员，结果缓存到set_user_admin修改为止"""
+    with _user_cache_lock:
+        if user_id in _admin_cache:
+            _admin_cache.move_to_end(user_id)
+            return _admin_cache[user_id]
+
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT is_admin FROM users WHERE user_id = ?", (user_id,))
     result = cursor.fetchone()
     conn.close()
 
-    if result and result['is_admin'] == 1:
-        return True
-    return False
+    is_admin = bool(result and result['is_admin'] == 1)
+    with _user_cache_lock:
+        _remember(_admin_cache, user_id, is_admin)
+    return is_admin
 
 
 def set_user_admin(user_id, is_admin=1):
     """设置用户管理员权限"""
+    _flush_pending_user(user_id)
+    invalidate_user_cache(user_id)
+
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("UPDATE users SET is_admin = ? WHERE user_id = ?", (is_admin, user_id))
     conn.commit()
     affected = conn.total_changes
     conn.close()
+
+    invalidate_user_cache(user_id)
     return affected > 0
 
 
+# 用户列表的排序方式: 名称 -> (排序字段, 是否倒序)
+USER_SORTS = {
+    "created_at": (["created_at", "id"], True),
+    "user_id": (["user_id", "id"], False),
+}
+
+
+def list_users(after=None, limit=None, query=None, admin_only=False, sort="created_at"):
+    """分页获取用户列表，可按用户ID/用户名搜索、只看管理员"""
+    from .pagination import fetch_page
+
+    flush_pending_users()
+
+    columns, descending = USER_SORTS.get(sort, USER_SORTS["created_at"])
+    filters, params = [], []
+    if query:
+        filters.append("(user_id LIKE ? OR name LIKE ?)")
+        params.extend([f"%{query}%"] * 2)
+    if admin_only:
+        filters.append("is_admin = 1")
+
+    return fetch_page("SELECT id, user_id, name, is_admin, created_at FROM users", columns, descending,
+                      filters, params, after, limit)
+
+
 def get_all_users():
     """获取所有用户"""
+    flush_pending_users()
+
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM users ORDER BY is_admin DESC, created_at DESC")
     users = [dict(row) for row in cursor.fetchall()]
     conn.close()
-    return users
\ No newline at end of file
+    return users
+
+
+# 记录每个数据访问函数的耗时
+instrument_db_functions(globals())
@@ -6,6 +6,7 @@ import secrets
 import sqlite3
 import logging
 from .database import get_db_connection
+from utils.metrics import instrument_db_functions
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +26,25 @@ def get_all_webhooks():
     return webhooks
 
 
+def list_webhooks(after=None, limit=None, query=None):
+    """分页获取webhook列表，附带订阅数，不返回token和提示词模板"""
+    from .pagination import fetch_page
+
+    filters, params = [], []
+    if query:
+        filters.append("(w.name LIKE ? OR w.description LIKE ?)")
+        params.extend([f"%{query}%"] * 2)
+
+    select_sql = """
+        SELECT w.id, w.name, w.description, w.model_id, w.is_active, w.bypass_ai, w.created_at,
+               m.name as model_name,
+               (SELECT COUNT(*) FROM webhook_subscriptions ws WHERE ws.webhook_id = w.id) as subscription_count
+        FROM webhooks w
+        LEFT JOIN models m ON w.model_id = m.id
+    """
+    return fetch_page(select_sql, ["w.created_at", "w.id"], True, filters, params, after, limit)
+
+
 def create_webhook(name, description, model_id, prompt_template=None, bypass_ai=0, fallback_mode='original',
                    fallback_message=None):
     """创建新的webhook"""
@@ -264,7 +284,10 @@ def get_user_subscriptions(user_id, include_chat=True):
 
 
 def log_webhook_call(webhook_id, request_data, response, status):
-    """记录webhook调用日志"""
+    """记录webhook调用日志，较长的请求和响应压缩后存储，明文写入全文索引"""
+    from utils.compression import compress_text
+    from .search import index_row
+
     conn = get_db_connection()
     cursor = conn.cursor()
 
@@ -280,15 +303,19 @@ def log_webhook_call(webhook_id, request_data, response, status):
         """INSERT INTO webhook_logs 
            (webhook_id, request_data, response, status) 
            VALUES (?, ?, ?, ?)""",
-        (webhook_id, request_data, response, status)
+        (webhook_id, compress_text(request_data), compress_text(response), status)
     )
+    index_row(cursor, "webhook_logs", cursor.lastrowid, [request_data, response])
     conn.commit()
     conn.close()
     return True
 
 
 def get_webhook_logs(webhook_id, limit=100):
-    """获取webhook调用日志"""
+    """获取webhook调用日志
+
+    request_data和response可能是压缩后的bytes，显示时再用utils.compression.decompress_text还原。
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
 
@@ -306,6 +333,38 @@ def get_webhook_logs(webhook_id, limit=100):
     return logs
 
 
+def list_webhook_logs(webhook_id, after=None, limit=None, status=None):
+    """分页获取webhook调用日志摘要，不读取请求和响应内容（查看详情时用get_webhook_log获取）"""
+    from .pagination import fetch_page
+
+    filters, params = ["webhook_id = ?"], [webhook_id]
+    if status:
+        filters.append("status = ?")
+        params.append(status)
+
+    select_sql = "SELECT id, webhook_id, status, created_at FROM webhook_logs"
+    # 使用 idx_webhook_logs_webhook_id (webhook_id, created_at) 索引
+    return fetch_page(select_sql, ["created_at", "id"], True, filters, params, after, limit)
+
+
+def get_webhook_log(log_id):
+    """获取单条webhook调用日志，请求和响应解压后返回"""
+    from utils.compression import decompress_text
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM webhook_logs WHERE id = ?", (log_id,))
+    row = cursor.fetchone()
+    conn.close()
+
+    if not row:
+        return None
+    log = dict(row)
+    log['request_data'] = decompress_text(log['request_data'])
+    log['response'] = decompress_text(log['response'])
+    return log
+
+
 def delete_webhook(webhook_id):
     """删除webhook及其所有订阅"""
     conn = get_db_connection()
@@ -318,4 +377,8 @@ def delete_webhook(webhook_id):
     affected = conn.total_changes
     conn.close()
 
-    return affected > 0
\ No newline at end of file
+    return affected > 0
+
+
+# 记录每个数据访问函数的耗时
+instrument_db_functions(globals())
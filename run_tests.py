@@ -33,8 +33,23 @@ def run_tests():
         return 1
 
 
+def run_benchmarks():
+    """运行热点函数微基准测试并与基线对比"""
+    print("\n开始运行微基准测试...")
+    cmd = [sys.executable, "benchmarks/bench_helpers.py", "--check"]
+    try:
+        result = subprocess.run(cmd, cwd=os.path.dirname(__file__))
+        return result.returncode
+    except Exception as e:
+        print(f"运行微基准测试时出错: {e}")
+        return 1
+
+
 if __name__ == "__main__":
     exit_code = run_tests()
+    # python run_tests.py --bench 在测试之后运行微基准测试
+    if "--bench" in sys.argv[1:]:
+        exit_code = run_benchmarks() or exit_code
     if exit_code == 0:
         print("\n✅ 所有测试通过！")
         print("📊 查看覆盖率报告: htmlcov/index.html")
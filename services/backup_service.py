@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import gzip
+import time
+import shutil
+import logging
+import threading
+from datetime import datetime
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class BackupService:
+    """数据库定时热备份服务
+
+    数据库为WAL模式，使用SQLite在线备份API在一个读事务中按页分步复制同一个快照，
+    备份期间机器人的写入照常提交，每步之间短暂暂停以限制备份占用的磁盘I/O。
+    备份文件可选gzip压缩，只保留最近的若干份。
+    """
+
+    def __init__(self, backup_dir=None, keep=None, compress=None):
+        self.backup_dir = backup_dir or Config.BACKUP_DIR
+        self.keep = Config.BACKUP_KEEP if keep is None else keep
+        self.compress = Config.BACKUP_COMPRESS if compress is None else compress
+        self._backup_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._scheduler = None
+        self._stats = {"count": 0, "failures": 0, "last": None}
+
+    def _backup_prefix(self):
+        return os.path.splitext(os.path.basename(Config.DB_PATH))[0] + "_"
+
+    def list_backups(self):
+        """列出已有备份，按时间从新到旧"""
+        if not os.path.isdir(self.backup_dir):
+            return []
+
+        prefix = self._backup_prefix()
+        backups = []
+        for name in os.listdir(self.backup_dir):
+            if not name.startswith(prefix) or not (name.endswith(".db") or name.endswith(".db.gz")):
+                continue
+            path = os.path.join(self.backup_dir, name)
+            backups.append({
+                "name": name,
+                "path": path,
+                "size": os.path.getsize(path),
+                "created_at": datetime.fromtimestamp(os.path.getmtime(path)).strftime('%Y-%m-%d %H:%M:%S'),
+            })
+
+        backups.sort(key=lambda backup: backup["name"], reverse=True)
+        return backups
+
+    def apply_retention(self):
+        """只保留最近的keep份备份，返回删除的文件数"""
+        removed = 0
+        for backup in self.list_backups()[self.keep:]:
+            try:
+                os.remove(backup["path"])
+                removed += 1
+                logger.info(f"删除过期备份: {backup['name']}")
+            except OSError as e:
+                logger.warning(f"删除备份失败: {backup['name']}: {e}")
+        return removed
+
+    def _reserve_backup_path(self):
+        """以独占方式创建备份文件，同一秒内的多次备份（如手动备份与定时备份）不会互相覆盖"""
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        for attempt in range(100):
+            suffix = f"_{attempt}" if attempt else ""
+            db_path = os.path.join(self.backup_dir, f"{self._backup_prefix()}{timestamp}{suffix}.db")
+            if os.path.exists(f"{db_path}.gz"):
+                continue
+            try:
+                fd = os.open(db_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+            os.close(fd)
+            return db_path
+        raise FileExistsError(f"无法创建备份文件: {timestamp}")
+
+    def create_backup(self):
+        """立即执行一次备份，返回备份文件路径，失败返回None"""
+        from models.database import backup_database
+
+        with self._backup_lock:
+            os.makedirs(self.backup_dir, exist_ok=True)
+            db_path = self._reserve_backup_path()
+            started_at = time.perf_counter()
+            steps = [0]
+
+            def progress(status, remaining, total):
+                steps[0] += 1
+                if remaining:
+                    time.sleep(Config.BACKUP_STEP_PAUSE)
+
+            try:
+                backup_database(db_path, pages=Config.BACKUP_PAGES_PER_STEP, progress=progress)
+                raw_size = os.path.getsize(db_path)
+
+                backup_path = db_path
+                if self.compress:
+                    backup_path = f"{db_path}.gz"
+                    with open(db_path, 'rb') as src, gzip.open(backup_path, 'wb', compresslevel=6) as dst:
+                        shutil.copyfileobj(src, dst, Config.IMAGE_DOWNLOAD_CHUNK_SIZE)
+                    os.remove(db_path)
+
+                duration = time.perf_counter() - started_at
+                size = os.path.getsize(backup_path)
+                self._record({
+                    "path": backup_path,
+                    "finished_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    "duration": duration,
+                    "steps": steps[0],
+                    "db_size": raw_size,
+                    "size": size,
+                    "success": True,
+                })
+                logger.info(f"数据库备份完成: {backup_path}，{steps[0]} 步，耗时 {duration:.2f}s，"
+                            f"大小 {raw_size} -> {size} bytes")
+
+            except Exception as e:
+                logger.error(f"数据库备份失败: {e}")
+                self._record({
+                    "finished_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    "duration": time.perf_counter() - started_at,
+                    "success": False,
+                    "error": str(e),
+                })
+                for path in (db_path, f"{db_path}.gz"):
+                    if os.path.exists(path):
+                        os.remove(path)
+                return None
+
+            self.apply_retention()
+            return backup_path
+
+    def _record(self, result):
+        """记录一次备份结果"""
+        with self._stats_lock:
+            self._stats["count" if result["success"] else "failures"] += 1
+            self._stats["last"] = result
+
+    def get_stats(self):
+        """获取备份统计：最近一次备份的耗时、大小以及现有备份列表"""
+        with self._stats_lock:
+            stats = {
+                "count": self._stats["count"],
+                "failures": self._stats["failures"],
+                "last": dict(self._stats["last"]) if self._stats["last"] else None,
+            }
+        stats["backups"] = self.list_backups()
+        stats["interval"] = Config.BACKUP_INTERVAL
+        stats["keep"] = self.keep
+        stats["compress"] = self.compress
+        return stats
+
+    def start_scheduler(self, interval=None):
+        """启动定时备份线程，间隔为0时不启动"""
+        interval = Config.BACKUP_INTERVAL if interval is None else interval
+        if not interval:
+            logger.info("未启用定时数据库备份")
+            return
+
+        if self._scheduler and self._scheduler.is_alive():
+            return
+
+        self._stop_event.clear()
+
+        def run():
+            while not self._stop_event.wait(interval):
+                self.create_backup()
+
+        self._scheduler = threading.Thread(target=run, name="db-backup", daemon=True)
+        self._scheduler.start()
+        logger.info(f"定时数据库备份已启动，间隔 {interval} 秒，保留 {self.keep} 份")
+
+    def stop_scheduler(self):
+        """停止定时备份线程"""
+        self._stop_event.set()
+        if self._scheduler:
+            self._scheduler.join(timeout=5)
+            self._scheduler = None
+
+
+# 全局备份服务
+backup_service = BackupService()
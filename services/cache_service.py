@@ -2,125 +2,340 @@
 # -*- coding: utf-8 -*-
 
 import os
-import tempfile
+import json
+import time
+import uuid
+import hashlib
 import logging
-from datetime import datetime, timedelta
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from config import Config
-from models.database import get_db_connection
+from utils.metrics import register_executor
+from utils import tracing
 
 logger = logging.getLogger(__name__)
 
 
 class ImageCacheService:
-    """图片缓存服务"""
-
-    def __init__(self):
-        self.cache_dir = tempfile.mkdtemp()
+    """图片缓存服务
+
+    两级缓存：
+    - 内存LRU：按用户保存图片key、本地文件路径和预取结果，热点查询无需访问数据库或磁盘
+    - 磁盘存储：图片文件及每个用户的元数据文件保存在缓存目录中，进程重启后仍可使用，
+      图片总大小超过上限时按最后修改时间淘汰最旧的文件
+    磁盘上有哪些用户的元数据在启动时扫描一次并随写入和删除更新，
+    没有缓存图片的用户（大多数文本消息）查询时不访问磁盘。
+    后台清理线程定期删除过期的缓存记录和文件。
+    """
+
+    def __init__(self, cache_dir=None, memory_entries=None, disk_max_size=None):
+        self.cache_dir = cache_dir or Config.IMAGE_CACHE_DIR
+        self.memory_entries = memory_entries or Config.IMAGE_CACHE_MEMORY_ENTRIES
+        self.disk_max_size = disk_max_size or Config.IMAGE_CACHE_DISK_MAX_SIZE
+        os.makedirs(self.cache_dir, exist_ok=True)
         logger.info(f"图片缓存目录: {self.cache_dir}")
 
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        # 磁盘上有元数据文件的用户（文件名前缀）
+        self._disk_users = self._scan_disk_users()
+
+        # 图片预取：收到图片后立即在后台下载并上传到Dify
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=Config.IMAGE_PREFETCH_WORKERS,
+                                                     thread_name_prefix="image-prefetch")
+        register_executor("image_prefetch", self._prefetch_executor)
+
+        self._sweeper = None
+        self._stop_event = threading.Event()
+
+    # ==================== 缓存条目 ====================
+
+    def _user_hash(self, user_id):
+        """用户ID对应的文件名前缀"""
+        return hashlib.sha1(user_id.encode('utf-8')).hexdigest()
+
+    def _meta_path(self, user_id):
+        """用户缓存元数据文件路径"""
+        return os.path.join(self.cache_dir, f"{self._user_hash(user_id)}.json")
+
+    def _new_image_path(self, user_id):
+        """生成新的本地缓存文件路径"""
+        return os.path.join(self.cache_dir, f"{self._user_hash(user_id)}_{time.time()}.jpg")
+
+    def _new_entry(self, user_id, image_key=None, image_path=None):
+        """创建缓存条目"""
+        return {
+            'id': uuid.uuid4().hex,
+            'user_id': user_id,
+            'image_key': image_key,
+            'image_path': image_path,
+            'model_id': None,
+            'upload_file_id': None,
+            'expires_at': time.time() + Config.IMAGE_CACHE_EXPIRE_MINUTES * 60,
+        }
+
+    def _scan_disk_users(self):
+        """扫描缓存目录中的元数据文件"""
+        try:
+            with os.scandir(self.cache_dir) as it:
+                return {item.name[:-len('.json')] for item in it if item.name.endswith('.json')}
+        except FileNotFoundError:
+            return set()
+
+    def _persist_entry(self, entry):
+        """将条目元数据写入磁盘（不包含预取任务等运行时字段）"""
+        data = {key: value for key, value in entry.items() if key != 'future'}
+        user_hash = self._user_hash(entry['user_id'])
+        meta_path = os.path.join(self.cache_dir, f"{user_hash}.json")
+        tmp_path = f"{meta_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, meta_path)
+            self._disk_users.add(user_hash)
+        except Exception as e:
+            logger.error(f"写入图片缓存元数据失败: {e}")
+
+    def _load_entry(self, meta_path):
+        """从磁盘读取条目元数据"""
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"读取图片缓存元数据失败: {meta_path}: {e}")
+            return None
+
+    def _put_entry(self, entry):
+        """写入内存LRU和磁盘"""
+        with self._lock:
+            self._entries[entry['user_id']] = entry
+            self._entries.move_to_end(entry['user_id'])
+            while len(self._entries) > self.memory_entries:
+                # 仅从内存淘汰，磁盘上的元数据仍可按需重新加载
+                self._entries.popitem(last=False)
+            self._persist_entry(entry)
+
+    def _get_entry(self, user_id):
+        """获取未过期的缓存条目，内存未命中时从磁盘加载
+
+        磁盘上没有该用户的元数据时直接返回None；读取磁盘时不持有锁，不阻塞其他用户的查询。
+        """
+        user_hash = self._user_hash(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                return self._unexpired(user_id, entry)
+            if user_hash not in self._disk_users:
+                return None
+
+        loaded = self._load_entry(os.path.join(self.cache_dir, f"{user_hash}.json"))
+
+        with self._lock:
+            # 读取期间可能已被其他线程加载、替换或删除
+            entry = self._entries.get(user_id)
+            if entry is None:
+                if loaded is None:
+                    self._disk_users.discard(user_hash)
+                    return None
+                if user_hash not in self._disk_users:
+                    return None
+                entry = self._entries[user_id] = loaded
+                while len(self._entries) > self.memory_entries:
+                    self._entries.popitem(last=False)
+            return self._unexpired(user_id, entry)
+
+    def _unexpired(self, user_id, entry):
+        """条目已过期时删除并返回None，否则标记为最近使用（调用方持有锁）"""
+        if entry['expires_at'] <= time.time():
+            self._remove_entry(user_id)
+            return None
+        self._entries.move_to_end(user_id)
+        return entry
+
+    def _remove_entry(self, user_id):
+        """删除条目及其图片文件，返回是否存在条目"""
+        user_hash = self._user_hash(user_id)
+        with self._lock:
+            entry = self._entries.pop(user_id, None)
+            if entry is None and user_hash not in self._disk_users:
+                return False
+            meta_path = self._meta_path(user_id)
+            if entry is None:
+                entry = self._load_entry(meta_path)
+            self._remove_file(meta_path)
+            self._disk_users.discard(user_hash)
+
+        if entry:
+            self._remove_file(entry.get('image_path'))
+        return entry is not None
+
+    def _remove_file(self, file_path):
+        """删除本地缓存文件"""
+        if file_path and os.path.exists(file_path):
+            try:
+                os.remove(file_path)
+                logger.debug(f"删除缓存文件: {file_path}")
+            except Exception as e:
+                logger.error(f"删除缓存文件失败: {e}")
+
+    def _update_entry(self, entry, **fields):
+        """更新条目字段并持久化
+
+        条目可能已被内存LRU淘汰后重新加载，因此同时更新当前生效的条目对象。
+        条目已被新图片替换或被清除时返回False。
+        """
+        with self._lock:
+            current = self._get_entry(entry['user_id'])
+            if current is None or current['id'] != entry['id']:
+                return False
+            entry.update(fields)
+            current.update(fields)
+            self._persist_entry(current)
+            return True
+
+    # ==================== 对外接口 ====================
+
     def save_user_image_key(self, user_id, image_key):
         """保存用户图片key，延迟下载"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
         # 清理该用户的旧缓存
         self.clear_user_image(user_id)
 
-        # 计算过期时间
-        expires_at = datetime.now() + timedelta(minutes=Config.IMAGE_CACHE_EXPIRE_MINUTES)
-
-        # 保存图片key到数据库
-        cursor.execute(
-            """INSERT INTO image_cache (user_id, image_path, expires_at) 
-               VALUES (?, ?, ?)""",
-            (user_id, image_key, expires_at)  # 这里先存image_key
-        )
-        conn.commit()
-        conn.close()
+        self._put_entry(self._new_entry(user_id, image_key=image_key))
 
         logger.info(f"用户 {user_id} 的图片key已缓存: {image_key}")
         return True
 
     def get_user_image_key(self, user_id):
         """获取用户缓存的图片key"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        entry = self._get_entry(user_id)
+        if entry:
+            return entry['image_key'] or entry['image_path']
+        return None
 
-        cursor.execute(
-            """SELECT image_path, expires_at FROM image_cache 
-               WHERE user_id = ? AND expires_at > CURRENT_TIMESTAMP
-               ORDER BY id DESC LIMIT 1""",
-            (user_id,)
-        )
+    def _download_entry_image(self, entry):
+        """下载条目对应的图片到磁盘存储，返回本地路径"""
+        from services.lark_service import download_image_to_file
 
-        result = cursor.fetchone()
-        conn.close()
+        # 流式下载图片，直接写入缓存文件
+        image_path = self._new_image_path(entry['user_id'])
+        if download_image_to_file(entry['image_key'], image_path) is None:
+            return None
 
-        if result:
-            return result['image_path']  # 这里返回的是image_key
+        if not self._update_entry(entry, image_path=image_path):
+            # 下载期间用户发送了新图片或缓存已被清除
+            self._remove_file(image_path)
+            return None
 
-        return None
+        self._enforce_disk_limit()
+        logger.info(f"图片已下载并缓存: {image_path}")
+        return image_path
 
     def download_and_cache_image(self, user_id, image_key):
         """下载图片并缓存到本地"""
-        from services.lark_service import download_image
+        entry = self._get_entry(user_id)
+        if not entry or image_key not in (entry['image_key'], entry['image_path']):
+            entry = self._new_entry(user_id, image_key=image_key)
+            self._put_entry(entry)
 
-        # 下载图片
-        image_data = download_image(image_key)
-        if not image_data:
+        if entry['image_path'] and os.path.exists(entry['image_path']):
+            return entry['image_path']
+
+        try:
+            return self._download_entry_image(entry)
+        except Exception as e:
+            logger.error(f"缓存图片失败: {e}")
             return None
 
-        # 保存到本地文件
-        timestamp = datetime.now()
-        image_path = os.path.join(self.cache_dir, f"{user_id}_{timestamp.timestamp()}.jpg")
+    def start_prefetch(self, user_id, image_key):
+        """收到图片后在后台预取：下载图片并上传到用户当前会话的模型"""
+        with self._lock:
+            entry = self._get_entry(user_id)
+            if not entry or entry['image_key'] != image_key:
+                entry = self._new_entry(user_id, image_key=image_key)
+                self._put_entry(entry)
+            entry['future'] = self._prefetch_executor.submit(tracing.bind(self._run_prefetch), entry)
+
+        logger.info(f"开始预取用户 {user_id} 的图片: {image_key}")
+        return entry['future']
+
+    @tracing.traced("image.prefetch")
+    def _run_prefetch(self, entry):
+        """执行图片预取，返回 {'image_path', 'model_id', 'upload_file_id'}"""
+        from services.dify_service import upload_image_to_dify
+        from models.session import get_or_create_session, get_session_model
+
+        user_id = entry['user_id']
+        result = {'image_path': None, 'model_id': None, 'upload_file_id': None}
 
         try:
-            with open(image_path, 'wb') as f:
-                f.write(image_data)
+            image_path = self._download_entry_image(entry)
+            if not image_path:
+                return result
+            result['image_path'] = image_path
 
-            # 更新数据库记录
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute(
-                """UPDATE image_cache SET image_path = ? 
-                   WHERE user_id = ? AND image_path = ?""",
-                (image_path, user_id, image_key)
-            )
-            conn.commit()
-            conn.close()
-
-            logger.info(f"图片已下载并缓存: {image_path}")
-            return image_path
+            session_id, _ = get_or_create_session(user_id)
+            model = get_session_model(session_id)
+            if not model:
+                logger.info(f"用户 {user_id} 没有可用模型，仅预取图片文件")
+                return result
+
+            upload_result = upload_image_to_dify(model, image_path, user_id)
+            if upload_result:
+                result['model_id'] = model['id']
+                result['upload_file_id'] = upload_result['id']
+
+                self._update_entry(entry, model_id=model['id'], upload_file_id=upload_result['id'])
+
+                logger.info(f"图片预取完成: user={user_id}, upload_file_id={upload_result['id']}")
         except Exception as e:
-            logger.error(f"缓存图片失败: {e}")
+            logger.error(f"图片预取失败: {e}")
+
+        return result
+
+    def get_prefetch_result(self, user_id, image_key, timeout=None):
+        """获取图片预取结果，预取仍在进行时等待其完成
+
+        image_key 既可以是原始图片key，也可以是已下载的本地路径。
+        没有可用的本地文件时返回None。
+        """
+        entry = self._get_entry(user_id)
+        if not entry or image_key not in (entry['image_key'], entry['image_path']):
+            return None
+
+        future = entry.get('future')
+        if future is not None:
+            try:
+                with tracing.span("image.wait_prefetch", done=future.done()):
+                    future.result(timeout=timeout)
+            except Exception as e:
+                logger.warning(f"等待图片预取结果失败: {e}")
+                return None
+
+        if not entry['image_path'] or not os.path.exists(entry['image_path']):
             return None
 
+        return {
+            'image_path': entry['image_path'],
+            'model_id': entry['model_id'],
+            'upload_file_id': entry['upload_file_id'],
+        }
+
     def save_user_image(self, user_id, image_data):
         """保存用户图片数据到缓存"""
-        timestamp = datetime.now()
-        image_path = os.path.join(self.cache_dir, f"{user_id}_{timestamp.timestamp()}.jpg")
+        image_path = self._new_image_path(user_id)
 
         try:
-            with open(image_path, 'wb') as f:
-                f.write(image_data)
-
-            conn = get_db_connection()
-            cursor = conn.cursor()
-
             # 清理该用户的旧缓存
             self.clear_user_image(user_id)
 
-            # 计算过期时间
-            expires_at = datetime.now() + timedelta(minutes=Config.IMAGE_CACHE_EXPIRE_MINUTES)
+            with open(image_path, 'wb') as f:
+                f.write(image_data)
 
-            # 保存到数据库
-            cursor.execute(
-                """INSERT INTO image_cache (user_id, image_path, expires_at) 
-                   VALUES (?, ?, ?)""",
-                (user_id, image_path, expires_at)
-            )
-            conn.commit()
-            conn.close()
+            self._put_entry(self._new_entry(user_id, image_path=image_path))
+            self._enforce_disk_limit()
 
             logger.info(f"用户 {user_id} 的图片已缓存: {image_path}")
             return image_path
@@ -130,88 +345,117 @@ class ImageCacheService:
 
     def get_user_image(self, user_id):
         """获取用户缓存的图片"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        cursor.execute(
-            """SELECT image_path, expires_at FROM image_cache 
-               WHERE user_id = ? AND expires_at > CURRENT_TIMESTAMP
-               ORDER BY id DESC LIMIT 1""",
-            (user_id,)
-        )
-
-        result = cursor.fetchone()
-        conn.close()
-
-        if result:
-            image_path = result['image_path']
-            # 检查文件是否存在（对于本地文件）
-            if os.path.exists(image_path):
-                return image_path
-            else:
-                # 文件不存在，清理数据库记录
-                self.clear_user_image(user_id)
-                return None
+        entry = self._get_entry(user_id)
+        if not entry or not entry['image_path']:
+            return None
 
+        # 检查文件是否存在（可能已被容量淘汰）
+        if os.path.exists(entry['image_path']):
+            return entry['image_path']
+
+        self.clear_user_image(user_id)
         return None
 
     def clear_user_image(self, user_id):
         """清除用户缓存的图片"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # 获取要删除的文件路径
-        cursor.execute(
-            "SELECT image_path FROM image_cache WHERE user_id = ?",
-            (user_id,)
-        )
-        results = cursor.fetchall()
-
-        # 删除文件
-        for result in results:
-            image_path = result['image_path']
-            if os.path.exists(image_path):
-                try:
-                    os.remove(image_path)
-                    logger.info(f"删除缓存文件: {image_path}")
-                except Exception as e:
-                    logger.error(f"删除缓存文件失败: {e}")
+        if self._remove_entry(user_id):
+            logger.info(f"清除用户 {user_id} 的图片缓存")
 
-        # 删除数据库记录
-        cursor.execute("DELETE FROM image_cache WHERE user_id = ?", (user_id,))
-        conn.commit()
-        conn.close()
-
-        logger.info(f"清除用户 {user_id} 的图片缓存")
+    # ==================== 清理与容量控制 ====================
 
     def cleanup_expired_cache(self):
-        """清理过期的缓存"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # 获取过期的缓存记录
-        cursor.execute(
-            "SELECT image_path FROM image_cache WHERE expires_at <= CURRENT_TIMESTAMP"
-        )
-        results = cursor.fetchall()
-
-        # 删除过期文件
-        for result in results:
-            image_path = result['image_path']
-            if os.path.exists(image_path):
-                try:
-                    os.remove(image_path)
-                    logger.info(f"删除过期缓存文件: {image_path}")
-                except Exception as e:
-                    logger.error(f"删除过期缓存文件失败: {e}")
-
-        # 删除过期记录
-        cursor.execute("DELETE FROM image_cache WHERE expires_at <= CURRENT_TIMESTAMP")
-        conn.commit()
-        affected = conn.total_changes
-        conn.close()
+        """清理过期的缓存，返回清理的条目数"""
+        now = time.time()
+        affected = 0
+
+        # 内存中的过期条目
+        with self._lock:
+            expired_users = [user_id for user_id, entry in self._entries.items() if entry['expires_at'] <= now]
+        for user_id in expired_users:
+            if self._remove_entry(user_id):
+                affected += 1
+
+        # 磁盘上的过期元数据，以及没有元数据引用的孤立图片
+        referenced = set()
+        orphan_candidates = []
+        try:
+            with os.scandir(self.cache_dir) as it:
+                files = list(it)
+        except FileNotFoundError:
+            return affected
+
+        for item in files:
+            if item.name.endswith('.json'):
+                entry = self._load_entry(item.path)
+                if entry is None:
+                    continue
+                if entry['expires_at'] <= now:
+                    if self._remove_entry(entry['user_id']):
+                        affected += 1
+                elif entry.get('image_path'):
+                    referenced.add(os.path.abspath(entry['image_path']))
+            elif item.name.endswith('.jpg'):
+                orphan_candidates.append(item)
+
+        orphan_deadline = now - Config.IMAGE_CACHE_EXPIRE_MINUTES * 60
+        for item in orphan_candidates:
+            try:
+                if os.path.abspath(item.path) not in referenced and item.stat().st_mtime <= orphan_deadline:
+                    self._remove_file(item.path)
+            except FileNotFoundError:
+                pass
 
         if affected > 0:
             logger.info(f"清理了 {affected} 个过期缓存记录")
 
-        return affected
\ No newline at end of file
+        return affected
+
+    def _enforce_disk_limit(self):
+        """图片总大小超过上限时，按修改时间淘汰最旧的图片"""
+        try:
+            with os.scandir(self.cache_dir) as it:
+                images = [(item.stat().st_mtime, item.stat().st_size, item.path)
+                          for item in it if item.name.endswith('.jpg')]
+        except FileNotFoundError:
+            return 0
+
+        total = sum(size for _, size, _ in images)
+        if total <= self.disk_max_size:
+            return 0
+
+        evicted = 0
+        for _, size, image_path in sorted(images):
+            if total <= self.disk_max_size:
+                break
+            self._remove_file(image_path)
+            total -= size
+            evicted += 1
+
+        logger.info(f"图片缓存超过容量上限，淘汰了 {evicted} 个文件")
+        return evicted
+
+    def start_sweeper(self, interval=None):
+        """启动后台过期清理线程"""
+        if self._sweeper and self._sweeper.is_alive():
+            return
+
+        interval = interval or Config.IMAGE_CACHE_SWEEP_INTERVAL
+        self._stop_event.clear()
+
+        def sweep():
+            while not self._stop_event.wait(interval):
+                try:
+                    self.cleanup_expired_cache()
+                except Exception as e:
+                    logger.error(f"清理图片缓存出错: {e}")
+
+        self._sweeper = threading.Thread(target=sweep, name="image-cache-sweeper", daemon=True)
+        self._sweeper.start()
+        logger.info(f"图片缓存清理线程已启动，间隔 {interval} 秒")
+
+    def stop_sweeper(self):
+        """停止后台过期清理线程"""
+        self._stop_event.set()
+        if self._sweeper:
+            self._sweeper.join(timeout=5)
+            self._sweeper = None
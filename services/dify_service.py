@@ -9,14 +9,47 @@ import urllib.request
 import urllib.parse
 import traceback
 import os
+import time
+import socket
+import hashlib
 import mimetypes
-from datetime import datetime
+import itertools
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
 
 from config import Config
+from models.database import commit_unit_of_work
 from models.session import update_session_conversation, add_message
+from services.image_service import preprocess_image
 from utils.helpers import http_request_with_retry
+from utils.metrics import DIFY_FIRST_BYTE, DIFY_DURATION, DIFY_REQUESTS, DIFY_INFLIGHT
+from utils import tracing
 
 logger = logging.getLogger(__name__)
+# 工作流节点、agent思考等高频流式事件，按 Config.LOG_SAMPLE_RATES 采样
+stream_logger = logging.getLogger(f"{__name__}.stream")
+
+# 已上传文件的内容索引: (模型标识, sha256) -> (上传结果, 过期时间)
+_upload_index = OrderedDict()
+_upload_index_lock = threading.Lock()
+_upload_index_stats = {"hits": 0, "misses": 0, "bytes_saved": 0}
+
+# 进行中的生成: user_id -> 生成任务，从收到消息开始登记
+_inflight_generations = {}
+_inflight_lock = threading.Lock()
+_generation_seq = itertools.count(1)
+DIFY_INFLIGHT.register(lambda: len(_inflight_generations))
+
+# 流式看门狗触发次数: 模型名称 -> {超时类型: 次数}
+_watchdog_stats = {}
+_watchdog_stats_lock = threading.Lock()
+
+# 计入首字/间隔超时的内容事件，ping等保活事件不算
+_CONTENT_EVENTS = {"message", "agent_message", "message_replace", "message_file"}
+
+# 流式响应每次读取的最大字节数，read1有数据即返回，不会因此增加延迟
+_SSE_READ_SIZE = 64 * 1024
 
 
 def dify_request(model, endpoint, method="POST", data=None, files=None, params=None, stream=False):
@@ -29,6 +62,7 @@ def dify_request(model, endpoint, method="POST", data=None, files=None, params=N
     headers = {
         "Authorization": f"Bearer {model['api_key']}"
     }
+    data_bytes = None
 
     if method == "GET":
         if params:
@@ -36,14 +70,13 @@ def dify_request(model, endpoint, method="POST", data=None, files=None, params=N
         req = urllib.request.Request(url, headers=headers)
     else:
         if files:
-            # 处理multipart/form-data文件上传
-            data_bytes, content_type = encode_multipart_formdata(files, data)
+            # 处理multipart/form-data文件上传，文件内容按块从磁盘读取
+            data_bytes, content_type, content_length = encode_multipart_formdata_stream(files, data)
             headers['Content-Type'] = content_type
+            headers['Content-Length'] = str(content_length)
         elif data:
             headers["Content-Type"] = "application/json"
             data_bytes = json.dumps(data).encode('utf-8')
-        else:
-            data_bytes = None
 
         req = urllib.request.Request(url, data=data_bytes, headers=headers, method=method)
 
@@ -52,24 +85,34 @@ def dify_request(model, endpoint, method="POST", data=None, files=None, params=N
     ctx.verify_mode = ssl.CERT_NONE
 
     try:
-        if stream:
-            return urllib.request.urlopen(req, context=ctx, timeout=Config.API_TIMEOUT)
-        else:
-            with urllib.request.urlopen(req, context=ctx, timeout=Config.API_TIMEOUT) as response:
-                response_data = response.read()
-                if response_data:
-                    return json.loads(response_data.decode('utf-8'))
-                return None
+        # 流式请求只记录到收到响应头为止，之后的读取由process_dify_message记录
+        with tracing.span("dify.request", endpoint=endpoint, stream=stream):
+            if stream:
+                return urllib.request.urlopen(req, context=ctx, timeout=Config.API_TIMEOUT)
+            else:
+                with urllib.request.urlopen(req, context=ctx, timeout=Config.API_TIMEOUT) as response:
+                    response_data = response.read()
+                    if response_data:
+                        return json.loads(response_data.decode('utf-8'))
+                    return None
     except Exception as e:
         logger.error(f"Dify API请求失败: {e}")
         logger.error(traceback.format_exc())
         return None
+    finally:
+        if isinstance(data_bytes, MultipartStream):
+            data_bytes.close()
 
 
-def encode_multipart_formdata(files, fields=None):
-    """编码multipart/form-data"""
-    boundary = '----WebKitFormBoundary' + ''.join(
+def generate_multipart_boundary():
+    """生成multipart边界字符串"""
+    return '----WebKitFormBoundary' + ''.join(
         random.choices('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz', k=16))
+
+
+def encode_multipart_formdata(files, fields=None, boundary=None):
+    """编码multipart/form-data"""
+    boundary = boundary or generate_multipart_boundary()
     body = []
 
     # 添加表单字段
@@ -109,6 +152,100 @@ def encode_multipart_formdata(files, fields=None):
     return b'\r\n'.join(body), content_type
 
 
+class MultipartStream:
+    """流式multipart请求体
+
+    由若干字节片段和文件路径组成，read()时按需从磁盘读取文件内容，
+    整个请求体不会一次性加载到内存中。
+    """
+
+    def __init__(self, segments):
+        self.segments = segments
+        self.length = sum(
+            len(segment) if isinstance(segment, bytes) else os.path.getsize(segment)
+            for segment in segments
+        )
+        self._index = 0
+        self._offset = 0
+        self._file = None
+
+    def read(self, size=-1):
+        """读取最多size字节，全部读完后返回空字节串"""
+        if size is None or size < 0:
+            size = Config.IMAGE_DOWNLOAD_CHUNK_SIZE
+
+        while self._index < len(self.segments):
+            segment = self.segments[self._index]
+
+            if isinstance(segment, bytes):
+                chunk = segment[self._offset:self._offset + size]
+                self._offset += len(chunk)
+            else:
+                if self._file is None:
+                    self._file = open(segment, 'rb')
+                chunk = self._file.read(size)
+                if not chunk:
+                    self._file.close()
+                    self._file = None
+
+            if chunk:
+                return chunk
+
+            self._index += 1
+            self._offset = 0
+
+        return b''
+
+    def close(self):
+        """关闭当前打开的文件"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def encode_multipart_formdata_stream(files, fields=None, boundary=None):
+    """编码multipart/form-data为流式请求体
+
+    与encode_multipart_formdata生成的字节完全一致，但文件内容不会被读入内存。
+    返回 (请求体, Content-Type, Content-Length)。
+    """
+    boundary = boundary or generate_multipart_boundary()
+    segments = []
+
+    # 添加表单字段
+    if fields:
+        for key, value in fields.items():
+            segments.append(
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'.encode())
+
+    # 添加文件
+    for key, file_info in files.items():
+        if isinstance(file_info, dict):
+            filename = file_info.get('filename', 'file')
+            content = file_info.get('content', b'')
+            content_type = file_info.get('content_type', 'application/octet-stream')
+        else:
+            # 假设是文件路径
+            filename = os.path.basename(file_info)
+            content_type, _ = mimetypes.guess_type(file_info)
+            if content_type is None:
+                content_type = 'application/octet-stream'
+            content = file_info
+
+        segments.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'.encode())
+        segments.append(content)
+        segments.append(b'\r\n')
+
+    segments.append(f'--{boundary}--'.encode())
+
+    body = MultipartStream(segments)
+    content_type = f'multipart/form-data; boundary={boundary}'
+    return body, content_type, body.length
+
+
+@tracing.traced("dify.upload_file")
 def upload_file_to_dify(model, file_path, user_id="default_user"):
     """上传文件到Dify"""
     try:
@@ -124,14 +261,22 @@ def upload_file_to_dify(model, file_path, user_id="default_user"):
             logger.error(f"不支持的文件格式: {file_ext}")
             return None
 
-        # 检查文件大小（假设限制为10MB）
+        # 检查文件大小
         file_size = os.path.getsize(file_path)
-        max_size = 10 * 1024 * 1024  # 10MB
+        max_size = Config.IMAGE_CACHE_MAX_SIZE
 
         if file_size > max_size:
             logger.error(f"文件过大: {file_size} bytes, 最大支持: {max_size} bytes")
             return None
 
+        # 相同内容已上传到同一模型时直接复用文件ID
+        index_key = (_model_upload_key(model), file_sha256(file_path))
+        cached = _lookup_uploaded_file(index_key, file_size)
+        tracing.set_attribute("dedup_hit", bool(cached))
+        if cached:
+            logger.info(f"文件内容已上传过，复用文件ID: {cached['id']}")
+            return cached
+
         # 准备上传
         files = {
             'file': file_path
@@ -146,6 +291,7 @@ def upload_file_to_dify(model, file_path, user_id="default_user"):
 
         if response and 'id' in response:
             logger.info(f"文件上传成功: {response['id']}")
+            _remember_uploaded_file(index_key, response)
             return response
         else:
             logger.error(f"文件上传失败: {response}")
@@ -157,6 +303,68 @@ def upload_file_to_dify(model, file_path, user_id="default_user"):
         return None
 
 
+def upload_image_to_dify(model, image_path, user_id="default_user"):
+    """按模型配置预处理图片（缩放、去除元数据、重新编码）后上传到Dify"""
+    upload_path = preprocess_image(model, image_path)
+    try:
+        return upload_file_to_dify(model, upload_path, user_id)
+    finally:
+        if upload_path != image_path and os.path.exists(upload_path):
+            os.remove(upload_path)
+
+
+def file_sha256(file_path):
+    """分块计算文件的sha256"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(Config.IMAGE_DOWNLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _model_upload_key(model):
+    """上传文件所属的模型标识（Dify地址 + API密钥），不保存明文密钥"""
+    raw = f"{model['dify_url'].rstrip('/')}|{model['api_key']}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _lookup_uploaded_file(index_key, file_size):
+    """查询内容索引，命中时返回之前的上传结果"""
+    with _upload_index_lock:
+        entry = _upload_index.get(index_key)
+        if entry and entry[1] > datetime.now():
+            _upload_index.move_to_end(index_key)
+            _upload_index_stats["hits"] += 1
+            _upload_index_stats["bytes_saved"] += file_size
+            return dict(entry[0])
+
+        if entry:
+            del _upload_index[index_key]
+        _upload_index_stats["misses"] += 1
+        return None
+
+
+def _remember_uploaded_file(index_key, upload_result):
+    """记录上传结果，有效期与Dify文件保留时间一致"""
+    expires_at = datetime.now() + timedelta(minutes=Config.DIFY_FILE_RETENTION_MINUTES)
+    with _upload_index_lock:
+        _upload_index[index_key] = (dict(upload_result), expires_at)
+        _upload_index.move_to_end(index_key)
+        while len(_upload_index) > Config.DIFY_UPLOAD_INDEX_MAX_ENTRIES:
+            _upload_index.popitem(last=False)
+
+
+def get_upload_dedup_stats():
+    """获取上传去重的命中统计"""
+    with _upload_index_lock:
+        stats = dict(_upload_index_stats)
+        stats["entries"] = len(_upload_index)
+
+    total = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / total if total else 0.0
+    return stats
+
+
 def get_dify_file_types_support():
     """获取Dify支持的文件类型"""
     # 根据API文档，支持以下图片格式
@@ -186,9 +394,13 @@ def ask_dify_chatbot(model, query, conversation_id=None, user_id="default_user",
             return None
         return response_obj
     else:
-        response = dify_request(model, "chat-messages", data=data)
+        labels = _metric_labels(model)
+        with DIFY_DURATION.time(*labels, "blocking"):
+            response = dify_request(model, "chat-messages", data=data)
         if response and "answer" in response:
+            DIFY_REQUESTS.inc(*labels, "blocking", "ok")
             return response["answer"], response.get("conversation_id")
+        DIFY_REQUESTS.inc(*labels, "blocking", "error")
         logger.warning(f"未找到回答字段: {response}")
         return "抱歉，无法获取回答", None
 
@@ -217,8 +429,202 @@ def ask_dify_blocking(model, query, conversation_id=None, user_id="default_user"
     return answer
 
 
-def process_dify_stream(stream, session_id, user_id):
-    """处理Dify流式响应并逐步返回结果"""
+def _abort_stream(stream):
+    """中断流式响应的连接，使其他线程中阻塞的read立即返回"""
+    try:
+        # fromfd复制文件描述符，shutdown作用于同一个连接，阻塞中的读取收到EOF后返回
+        with socket.fromfd(stream.fileno(), socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.shutdown(socket.SHUT_RDWR)
+    except (OSError, ValueError, AttributeError) as e:
+        # 连接已关闭或不是socket连接时直接关闭响应
+        logger.debug(f"无法中断流式连接，直接关闭响应: {e}")
+        try:
+            stream.close()
+        except Exception:
+            pass
+
+
+def _request_stop(generation):
+    """在后台调用Dify停止接口，不阻塞调用方"""
+    task_id = generation.get('task_id')
+    if not task_id:
+        return
+
+    threading.Thread(
+        target=stop_dify_response,
+        args=(generation['model'], task_id, generation['user_id']),
+        name="dify-stop",
+        daemon=True
+    ).start()
+
+
+def register_generation(user_id, reason="收到新消息"):
+    """收到用户消息时登记生成任务，并取消该用户之前的生成
+
+    每个任务带有递增的序号，登记和取代在同一把锁内完成，较早的消息不会取消较新的任务。
+    流式响应打开后由attach_stream关联到任务上。
+    """
+    generation = {
+        'user_id': user_id,
+        'model': None,
+        'session_id': None,
+        'stream': None,
+        'task_id': None,
+        'cancelled': threading.Event(),
+    }
+    with _inflight_lock:
+        generation['seq'] = next(_generation_seq)
+        previous = _inflight_generations.get(user_id)
+        _inflight_generations[user_id] = generation
+
+    if previous is not None:
+        _cancel(previous, reason)
+    return generation
+
+
+def attach_stream(generation, model, session_id, stream):
+    """将打开的流式响应关联到生成任务，任务已被取消或取代时返回False"""
+    with _inflight_lock:
+        if generation['cancelled'].is_set() or _inflight_generations.get(generation['user_id']) is not generation:
+            return False
+        generation.update(model=model, session_id=session_id, stream=stream, task_id=None)
+    return True
+
+
+def detach_stream(generation):
+    """流式响应结束后解除关联，任务仍保持登记直到消息处理完成"""
+    with _inflight_lock:
+        generation['stream'] = None
+
+
+def unregister_generation(generation):
+    """消息处理结束后移除登记"""
+    with _inflight_lock:
+        if _inflight_generations.get(generation['user_id']) is generation:
+            del _inflight_generations[generation['user_id']]
+
+
+def _cancel(generation, reason):
+    """标记任务已取消，通知Dify停止任务并中断已打开的流式响应"""
+    with _inflight_lock:
+        # 与attach_stream互斥：要么关联前已看到取消标记，要么这里能拿到已关联的流
+        generation['cancelled'].set()
+        stream = generation['stream']
+
+    logger.info(f"取消用户 {generation['user_id']} 进行中的生成#{generation['seq']}: {reason} "
+                f"(task_id={generation['task_id']})")
+    _request_stop(generation)
+    if stream is not None:
+        _abort_stream(stream)
+
+
+def cancel_generation(user_id, reason=""):
+    """取消用户进行中的生成：通知Dify停止任务并关闭连接
+
+    返回是否有被取消的生成。
+    """
+    with _inflight_lock:
+        generation = _inflight_generations.pop(user_id, None)
+
+    if generation is None:
+        return False
+
+    _cancel(generation, reason)
+    return True
+
+
+class StreamWatchdog:
+    """流式响应看门狗
+
+    在后台线程中检查首字时间、内容事件间隔和总时长，任一超限时
+    停止Dify任务并中断连接，使阻塞中的读取立即返回。
+    """
+
+    def __init__(self, stream, model=None, generation=None, first_token_timeout=None,
+                 idle_timeout=None, total_timeout=None, interval=None):
+        self.stream = stream
+        self.model = model
+        self.generation = generation
+        self.first_token_timeout = Config.DIFY_STREAM_FIRST_TOKEN_TIMEOUT \
+            if first_token_timeout is None else first_token_timeout
+        self.idle_timeout = Config.DIFY_STREAM_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        self.total_timeout = Config.DIFY_STREAM_TOTAL_TIMEOUT if total_timeout is None else total_timeout
+        limits = [limit for limit in (self.first_token_timeout, self.idle_timeout, self.total_timeout) if limit]
+        # 检查周期不超过最短超时的四分之一
+        self.interval = interval or min([1.0] + [limit / 4 for limit in limits])
+        self.tripped = None
+        self.started_at = time.monotonic()
+        self.last_content_at = None
+        self._done = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """启动看门狗线程"""
+        if not (self.first_token_timeout or self.idle_timeout or self.total_timeout):
+            return self
+
+        self._thread = threading.Thread(target=self._run, name="dify-stream-watchdog", daemon=True)
+        self._thread.start()
+        return self
+
+    def content_received(self):
+        """收到内容事件时调用"""
+        self.last_content_at = time.monotonic()
+
+    def stop(self):
+        """流式响应结束时调用"""
+        self._done.set()
+
+    def _check(self):
+        """返回触发的超时类型，未超时返回None"""
+        now = time.monotonic()
+
+        if self.total_timeout and now - self.started_at > self.total_timeout:
+            return "total"
+        if self.last_content_at is None:
+            if self.first_token_timeout and now - self.started_at > self.first_token_timeout:
+                return "first_token"
+        elif self.idle_timeout and now - self.last_content_at > self.idle_timeout:
+            return "idle"
+        return None
+
+    def _run(self):
+        while not self._done.wait(self.interval):
+            reason = self._check()
+            if reason is None:
+                continue
+
+            self.tripped = reason
+            model_name = self.model.get('name', self.model.get('id')) if self.model else "unknown"
+            logger.warning(f"Dify流式响应超时({reason})，模型: {model_name}，"
+                           f"已耗时 {time.monotonic() - self.started_at:.1f}s")
+            _record_watchdog_trip(model_name, reason)
+
+            if self.generation:
+                _request_stop(self.generation)
+            _abort_stream(self.stream)
+            return
+
+
+def _record_watchdog_trip(model_name, reason):
+    """记录看门狗触发次数"""
+    with _watchdog_stats_lock:
+        counts = _watchdog_stats.setdefault(model_name, {"first_token": 0, "idle": 0, "total": 0})
+        counts[reason] += 1
+
+
+def get_stream_watchdog_stats():
+    """获取各模型的流式看门狗触发次数"""
+    with _watchdog_stats_lock:
+        return {name: dict(counts) for name, counts in _watchdog_stats.items()}
+
+
+def process_dify_stream(stream, session_id, user_id, generation=None, model=None):
+    """处理Dify流式响应并逐步返回结果
+
+    generation 为register_generation登记的生成任务，被取消时停止读取。
+    首字、间隔或总时长超限时由看门狗中断，并返回已收到的部分内容。
+    """
     if stream is None:
         error_msg = "无法获取流式响应"
         logger.error(error_msg)
@@ -227,26 +633,49 @@ def process_dify_stream(stream, session_id, user_id):
 
     full_response = ""
     conversation_id = None
-    buffer = b""
+    buffer = bytearray()
+    scanned = 0  # 缓冲区开头已确认不含事件分隔符的字节数
     file_urls = []  # 收集文件URL
 
+    cancelled = generation['cancelled'] if generation else threading.Event()
+    if model is None and generation:
+        model = generation['model']
+    watchdog = StreamWatchdog(stream, model, generation).start()
+
+    # read1 有数据即返回，不会为凑满缓冲区而阻塞，取消和逐步输出更及时
+    read_chunk = getattr(stream, 'read1', stream.read)
+
     try:
-        while True:
-            chunk = stream.read(1024)
-            if not chunk:
+        while not cancelled.is_set():
+            chunk = read_chunk(_SSE_READ_SIZE)
+            if not chunk or cancelled.is_set():
                 break
 
             buffer += chunk
 
-            while b"\n\n" in buffer:
+            # 只在新到达的数据中查找事件分隔符，大事件跨越多个数据块时不会反复扫描和复制整个缓冲区
+            while True:
+                end = buffer.find(b"\n\n", max(0, scanned - 1))
+                if end < 0:
+                    scanned = len(buffer)
+                    break
+                event = bytes(buffer[:end])
+                del buffer[:end + 2]
+                scanned = 0
                 try:
-                    event, buffer = buffer.split(b"\n\n", 1)
                     if event.startswith(b"data: "):
                         event_data = event[6:]
                         try:
                             event_json = json.loads(event_data)
                             event_type = event_json.get("event")
 
+                            # 记录task_id，用于取消时调用停止接口
+                            if generation and not generation['task_id'] and event_json.get("task_id"):
+                                generation['task_id'] = event_json["task_id"]
+
+                            if event_type in _CONTENT_EVENTS:
+                                watchdog.content_received()
+
                             if event_type == "message":
                                 response_part = event_json.get("answer", "")
                                 full_response += response_part
@@ -258,22 +687,22 @@ def process_dify_stream(stream, session_id, user_id):
                                 yield response_part
 
                             elif event_type == "workflow_started":
-                                logger.info(f"Workflow started: {event_json}")
+                                stream_logger.info("Workflow started: %s", event_json)
 
                             elif event_type == "node_started":
-                                logger.info(f"Node started: {event_json}")
+                                stream_logger.info("Node started: %s", event_json)
 
                             elif event_type == "node_finished":
-                                logger.info(f"Node finished: {event_json}")
+                                stream_logger.info("Node finished: %s", event_json)
 
                             elif event_type == "workflow_finished":
-                                logger.info(f"Workflow finished: {event_json}")
+                                stream_logger.info("Workflow finished: %s", event_json)
 
                             elif event_type == "agent_thought":
-                                logger.info(f"Agent thought: {event_json}")
+                                stream_logger.info("Agent thought: %s", event_json)
 
                             elif event_type == "message_file":
-                                logger.info(f"File message: {event_json}")
+                                logger.info("File message: %s", event_json)
                                 file_url = event_json.get("url", "")
                                 if file_url:
                                     file_urls.append(file_url)
@@ -281,7 +710,7 @@ def process_dify_stream(stream, session_id, user_id):
 
                             elif event_type == "tts_message":
                                 # TTS音频流事件
-                                logger.info("收到TTS音频流事件")
+                                stream_logger.info("收到TTS音频流事件")
                                 # 这里可以处理音频数据，当前只记录日志
 
                             elif event_type == "tts_message_end":
@@ -303,6 +732,8 @@ def process_dify_stream(stream, session_id, user_id):
                                 if "conversation_id" in event_json:
                                     conversation_id = event_json["conversation_id"]
                                     update_session_conversation(session_id, conversation_id)
+                                    # 流式响应可能尚未结束，先提交，不在读取网络数据时持有写锁
+                                    commit_unit_of_work()
                                 logger.info("Message stream ended")
 
                             elif event_type == "error":
@@ -312,36 +743,78 @@ def process_dify_stream(stream, session_id, user_id):
                                 full_response += error_msg
 
                         except json.JSONDecodeError:
-                            logger.error(f"解析响应JSON失败: {event_data}")
+                            logger.error("解析响应JSON失败: %s", event_data)
                 except ValueError:
                     break
     except Exception as e:
-        error_msg = f"处理流式响应出错: {str(e)}"
-        logger.error(error_msg)
-        logger.error(traceback.format_exc())
-        yield error_msg
-        full_response += error_msg
+        if cancelled.is_set():
+            logger.info(f"流式响应已取消: {e}")
+        elif watchdog.tripped:
+            logger.info(f"流式响应已被看门狗中断: {e}")
+        else:
+            error_msg = f"处理流式响应出错: {str(e)}"
+            logger.error(error_msg)
+            logger.error(traceback.format_exc())
+            yield error_msg
+            full_response += error_msg
     finally:
+        watchdog.stop()
         try:
             if stream:
                 stream.close()
         except:
             pass
 
+    if watchdog.tripped and not cancelled.is_set():
+        if full_response:
+            timeout_note = "\n\n（响应超时，以上为部分回答）"
+        else:
+            timeout_note = "AI服务响应超时，请稍后重试。"
+        yield timeout_note
+        full_response += timeout_note
+
     # 如果有文件，将文件信息也加入到响应中
     if file_urls:
         file_info = "\n\n生成的文件:\n" + "\n".join([f"- {url}" for url in file_urls])
         full_response += file_info
 
+    if cancelled.is_set():
+        logger.info(f"会话 {session_id} 的生成已被取消，已接收 {len(full_response)} 个字符")
+        if full_response:
+            full_response += "\n\n（已取消）"
+
     if full_response:
         add_message(session_id, user_id, full_response, is_user=0)
+        # 调用方随后等待处理中提示并发送回复，发送前不持有写锁
+        commit_unit_of_work()
 
     return full_response, conversation_id
 
 
-def process_dify_message(model, content, conversation_id, user_id, session_id, files=None):
-    """处理Dify消息并返回完整响应"""
+def _metric_labels(model):
+    """指标的模型标签: (模型名称, Dify类型)"""
+    return str(model.get('name', model.get('id'))), model.get('dify_type')
+
+
+@tracing.traced("dify.chat")
+def process_dify_message(model, content, conversation_id, user_id, session_id, files=None, generation=None):
+    """处理Dify消息并返回完整响应，生成被取消时返回None
+
+    generation 为收到消息时register_generation登记的任务，未提供时在这里登记。
+    """
+    labels = _metric_labels(model)
+    tracing.set_attribute("model", labels[0])
+    tracing.set_attribute("dify_type", labels[1])
+    started_at = time.perf_counter()
+    result = "error"
+    own_generation = generation is None
+    if own_generation:
+        generation = register_generation(user_id, "新的请求")
     try:
+        if generation['cancelled'].is_set():
+            result = "cancelled"
+            return None
+
         if model['dify_type'] == 'chatbot':
             stream = ask_dify_chatbot(model, content, conversation_id, user_id, files=files)
         elif model['dify_type'] == 'agent':
@@ -352,31 +825,68 @@ def process_dify_message(model, content, conversation_id, user_id, session_id, f
             return f"不支持的模型类型：{model['dify_type']}"
 
         if stream is None:
+            result = "connect_error"
             return "无法连接到Dify API，请检查API地址和密钥是否正确，或者网络连接是否正常。"
 
-        full_response = ""
-        for chunk in process_dify_stream(stream, session_id, user_id):
-            full_response += chunk
+        if not attach_stream(generation, model, session_id, stream):
+            # 等待Dify响应期间已被新消息取代
+            stream.close()
+            result = "cancelled"
+            return None
+
+        stream_started_at = time.perf_counter()
+        try:
+            full_response = ""
+            for chunk in process_dify_stream(stream, session_id, user_id, generation, model):
+                if not full_response:
+                    DIFY_FIRST_BYTE.observe(time.perf_counter() - started_at, *labels)
+                    tracing.record_span("dify.first_content", stream_started_at)
+                full_response += chunk
+        finally:
+            detach_stream(generation)
+            # 生成器在多次yield之间挂起，不能用with span包住，结束后再记录
+            tracing.record_span("dify.stream", stream_started_at, chars=len(full_response))
+
+        if generation['cancelled'].is_set():
+            # 已被新的请求、清除会话或切换模型取代，不再回复
+            result = "cancelled"
+            return None
 
+        result = "ok"
         return full_response
     except Exception as e:
         logger.error(f"处理Dify消息出错: {str(e)}")
         logger.error(traceback.format_exc())
         return f"处理消息时出错: {str(e)}"
+    finally:
+        if own_generation:
+            unregister_generation(generation)
+        DIFY_DURATION.observe(time.perf_counter() - started_at, *labels, "streaming")
+        DIFY_REQUESTS.inc(*labels, "streaming", result)
+
 
+def process_image_and_text(model, image_path, text, conversation_id, user_id, session_id, upload_file_id=None,
+                           generation=None):
+    """处理图片和文本的组合输入
 
-def process_image_and_text(model, image_path, text, conversation_id, user_id, session_id):
-    """处理图片和文本的组合输入"""
+    upload_file_id 为预取阶段已上传到该模型的文件ID，提供时跳过上传。
+    generation 为收到消息时登记的生成任务，见process_dify_message。
+    """
     try:
         logger.info(f"处理图片+文本: 图片={image_path}, 文本={text}")
 
-        # 1. 先上传图片到Dify
-        upload_result = upload_file_to_dify(model, image_path, user_id)
+        # 1. 先上传图片到Dify（已预取上传时直接复用）
+        if upload_file_id:
+            logger.info(f"复用预取上传的文件: {upload_file_id}")
+            upload_result = {'id': upload_file_id}
+        else:
+            upload_result = upload_image_to_dify(model, image_path, user_id)
 
         if not upload_result:
             # 上传失败，降级处理
             logger.warning("图片上传失败，降级为纯文本处理")
-            return process_fallback_image_text(model, image_path, text, conversation_id, user_id, session_id)
+            return process_fallback_image_text(model, image_path, text, conversation_id, user_id, session_id,
+                                               generation)
 
         # 2. 构建files参数
         files = [
@@ -389,16 +899,18 @@ def process_image_and_text(model, image_path, text, conversation_id, user_id, se
 
         # 3. 发送带图片的请求
         logger.info(f"发送图片+文本请求到Dify API")
-        return process_dify_message(model, text, conversation_id, user_id, session_id, files=files)
+        return process_dify_message(model, text, conversation_id, user_id, session_id, files=files,
+                                    generation=generation)
 
     except Exception as e:
         logger.error(f"处理图片和文本组合失败: {e}")
         logger.error(traceback.format_exc())
         # 最终降级：只处理文本部分
-        return process_fallback_image_text(model, image_path, text, conversation_id, user_id, session_id)
+        return process_fallback_image_text(model, image_path, text, conversation_id, user_id, session_id,
+                                           generation)
 
 
-def process_fallback_image_text(model, image_path, text, conversation_id, user_id, session_id):
+def process_fallback_image_text(model, image_path, text, conversation_id, user_id, session_id, generation=None):
     """图片处理失败时的降级方案"""
     try:
         import os
@@ -412,7 +924,8 @@ def process_fallback_image_text(model, image_path, text, conversation_id, user_i
             combined_text = f"用户发送了一张图片（{image_name}）。抱歉，目前无法直接分析图片内容，请您描述一下图片的内容或者您希望了解什么？"
 
         logger.info(f"图片+文本降级处理: {combined_text}")
-        return process_dify_message(model, combined_text, conversation_id, user_id, session_id)
+        return process_dify_message(model, combined_text, conversation_id, user_id, session_id,
+                                    generation=generation)
 
     except Exception as e:
         logger.error(f"降级处理也失败了: {e}")
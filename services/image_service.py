@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import logging
+import threading
+
+from config import Config
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow为可选依赖，未安装时跳过图片预处理
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# 预处理统计
+_preprocess_stats = {"processed": 0, "skipped": 0, "bytes_before": 0, "bytes_after": 0, "cpu_seconds": 0.0}
+_preprocess_stats_lock = threading.Lock()
+
+_OUTPUT_EXTENSIONS = {"webp": ".webp", "jpeg": ".jpg", "png": ".png"}
+
+
+def get_image_settings(model):
+    """获取模型的图片预处理配置
+
+    默认值来自Config，可以在模型parameters中通过 "image_preprocess" 覆盖，例如：
+    {"image_preprocess": {"enabled": true, "max_dimension": 1024, "format": "jpeg", "quality": 75}}
+    """
+    settings = {
+        "enabled": Config.IMAGE_PREPROCESS_ENABLED,
+        "max_dimension": Config.IMAGE_PREPROCESS_MAX_DIMENSION,
+        "format": Config.IMAGE_PREPROCESS_FORMAT,
+        "quality": Config.IMAGE_PREPROCESS_QUALITY,
+    }
+
+    parameters = model.get('parameters') if model else None
+    if isinstance(parameters, str):
+        try:
+            parameters = json.loads(parameters)
+        except (TypeError, json.JSONDecodeError):
+            parameters = None
+
+    if isinstance(parameters, dict) and isinstance(parameters.get("image_preprocess"), dict):
+        settings.update(parameters["image_preprocess"])
+
+    settings["format"] = str(settings["format"]).lower()
+    return settings
+
+
+def _record_stats(processed, bytes_before=0, bytes_after=0, cpu_seconds=0.0):
+    """记录预处理统计"""
+    with _preprocess_stats_lock:
+        if processed:
+            _preprocess_stats["processed"] += 1
+            _preprocess_stats["bytes_before"] += bytes_before
+            _preprocess_stats["bytes_after"] += bytes_after
+            _preprocess_stats["cpu_seconds"] += cpu_seconds
+        else:
+            _preprocess_stats["skipped"] += 1
+
+
+def get_image_preprocess_stats():
+    """获取图片预处理统计：节省的字节数和消耗的CPU时间"""
+    with _preprocess_stats_lock:
+        stats = dict(_preprocess_stats)
+    stats["bytes_saved"] = stats["bytes_before"] - stats["bytes_after"]
+    return stats
+
+
+def preprocess_image(model, image_path):
+    """按模型配置缩放并重新编码图片
+
+    - 长边超过 max_dimension 时等比缩小
+    - 按EXIF方向摆正后丢弃所有元数据
+    - 以配置的格式和质量重新编码
+
+    返回处理后的文件路径；未启用、Pillow未安装、动图或处理后反而更大时返回原路径。
+    调用方负责删除与原路径不同的返回文件。
+    """
+    settings = get_image_settings(model)
+    if not settings["enabled"]:
+        return image_path
+
+    if Image is None:
+        logger.debug("未安装Pillow，跳过图片预处理")
+        _record_stats(False)
+        return image_path
+
+    output_format = settings["format"]
+    if output_format not in _OUTPUT_EXTENSIONS:
+        logger.warning(f"不支持的图片输出格式: {output_format}")
+        _record_stats(False)
+        return image_path
+
+    cpu_start = time.thread_time()
+    output_path = f"{os.path.splitext(image_path)[0]}_processed{_OUTPUT_EXTENSIONS[output_format]}"
+
+    try:
+        bytes_before = os.path.getsize(image_path)
+
+        with Image.open(image_path) as image:
+            if getattr(image, "is_animated", False):
+                # 动图保持原样
+                _record_stats(False)
+                return image_path
+
+            image = ImageOps.exif_transpose(image)
+
+            max_dimension = int(settings["max_dimension"])
+            if max_dimension > 0 and max(image.size) > max_dimension:
+                image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+            if output_format == "jpeg" and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            elif image.mode not in ("RGB", "RGBA", "L", "LA"):
+                image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+            save_kwargs = {"optimize": True}
+            if output_format in ("webp", "jpeg"):
+                save_kwargs["quality"] = int(settings["quality"])
+            image.save(output_path, format=output_format.upper(), **save_kwargs)
+
+        bytes_after = os.path.getsize(output_path)
+        cpu_seconds = time.thread_time() - cpu_start
+
+        if bytes_after >= bytes_before:
+            os.remove(output_path)
+            logger.info(f"图片预处理后未变小({bytes_before} -> {bytes_after} bytes)，使用原图")
+            _record_stats(True, bytes_before, bytes_before, cpu_seconds)
+            return image_path
+
+        _record_stats(True, bytes_before, bytes_after, cpu_seconds)
+        logger.info(f"图片预处理完成: {bytes_before} -> {bytes_after} bytes，"
+                    f"节省 {bytes_before - bytes_after} bytes，CPU {cpu_seconds * 1000:.1f}ms")
+        return output_path
+
+    except Exception as e:
+        logger.error(f"图片预处理失败，使用原图: {e}")
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        _record_stats(False)
+        return image_path
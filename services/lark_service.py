@@ -1,18 +1,48 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
 import json
+import time
 import logging
 import urllib.request
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from config import Config
 from utils.helpers import http_request_with_retry, is_markdown
+from utils.metrics import FEISHU_REQUEST_DURATION, FEISHU_SEND, register_executor
+from utils import tracing
 
 logger = logging.getLogger(__name__)
+# 每条消息都会记录的发送结果，按 Config.LOG_SAMPLE_RATES 采样
+send_logger = logging.getLogger(f"{__name__}.send")
+
+# 异步发送"处理中"提示，使其不占用调用Dify的关键路径
+_ack_executor = ThreadPoolExecutor(max_workers=Config.FEISHU_SEND_WORKERS, thread_name_prefix="lark-ack")
+register_executor("lark_ack", _ack_executor)
+
+
+def send_acknowledgement(reply_func, content):
+    """在后台发送处理中提示，返回Future
+
+    发送最终回复前应调用wait_acknowledgement，保证提示先于回复到达。
+    """
+    return _ack_executor.submit(tracing.bind(reply_func), content)
+
+
+def wait_acknowledgement(future, timeout=None):
+    """等待处理中提示发送完成，发送失败不影响后续回复"""
+    if future is None:
+        return
+    try:
+        future.result(timeout=timeout or Config.API_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"发送处理中提示失败: {e}")
+
 
 def get_tenant_access_token():
     """获取tenant_access_token用于API调用"""
-    url = "https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal"
+    url = f"{Config.FEISHU_API_BASE}/open-apis/auth/v3/tenant_access_token/internal"
     headers = {
         "Content-Type": "application/json"
     }
@@ -25,7 +55,8 @@ def get_tenant_access_token():
     req = urllib.request.Request(url, data=data_bytes, headers=headers, method="POST")
 
     try:
-        response_data = http_request_with_retry(req)
+        with FEISHU_REQUEST_DURATION.time("tenant_access_token"), tracing.span("feishu.tenant_access_token"):
+            response_data = http_request_with_retry(req)
         if response_data:
             response_json = json.loads(response_data.decode('utf-8'))
             token = response_json.get("tenant_access_token")
@@ -38,7 +69,7 @@ def get_tenant_access_token():
 
 def send_message(open_id=None, chat_id=None, content=None):
     """发送消息到用户或群组，支持文本和Markdown格式"""
-    base_url = "https://open.feishu.cn/open-apis/im/v1/messages"
+    base_url = f"{Config.FEISHU_API_BASE}/open-apis/im/v1/messages"
 
     params = {"receive_id_type": "open_id" if open_id else "chat_id"}
     url = f"{base_url}?{urllib.parse.urlencode(params)}"
@@ -83,33 +114,85 @@ def send_message(open_id=None, chat_id=None, content=None):
     req = urllib.request.Request(url, data=data_bytes, headers=headers, method="POST")
 
     try:
-        response_data = http_request_with_retry(req)
+        with FEISHU_REQUEST_DURATION.time("send_message"), \
+                tracing.span("feishu.send_message", msg_type=data["msg_type"], size=len(data["content"])) as span:
+            response_data = http_request_with_retry(req)
+            if response_data:
+                response_json = json.loads(response_data.decode('utf-8'))
+                span.set_attribute("code", response_json.get("code"))
         if response_data:
-            response_json = json.loads(response_data.decode('utf-8'))
-            logger.info(f"消息发送成功: {response_json}")
+            send_logger.info("消息发送成功: %s", response_json)
+            FEISHU_SEND.inc(response_json.get("code"))
             return response_json
+        FEISHU_SEND.inc(-1)
         return {"code": -1, "msg": "请求失败"}
     except Exception as e:
         logger.error(f"发送消息失败: {e}")
+        # HTTP错误码也记录下来，便于区分限流（429）和服务端错误
+        FEISHU_SEND.inc(f"http_{e.code}" if hasattr(e, 'code') else -1)
         return {"code": -1, "msg": str(e)}
 
 
-def download_image(image_key):
-    """从飞书下载图片"""
-    url = f"https://open.feishu.cn/open-apis/im/v1/images/{image_key}"
+def iter_image_chunks(image_key, max_size=None):
+    """从飞书分块下载图片，超过大小上限时立即中止
+
+    优先根据Content-Length提前拒绝过大的图片，否则在累计读取超过上限时抛出ValueError。
+    """
+    max_size = max_size or Config.IMAGE_CACHE_MAX_SIZE
+    url = f"{Config.FEISHU_API_BASE}/open-apis/im/v1/images/{image_key}"
     headers = {
         "Authorization": f"Bearer {get_tenant_access_token()}"
     }
 
     req = urllib.request.Request(url, headers=headers)
 
+    started_at = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=Config.API_TIMEOUT) as response:
+        FEISHU_REQUEST_DURATION.observe(time.perf_counter() - started_at, "download_image")
+
+        if response.status != 200:
+            raise ValueError(f"下载图片失败: {response.status}")
+
+        content_length = response.headers.get("Content-Length")
+        if content_length and int(content_length) > max_size:
+            raise ValueError(f"图片过大: {content_length} bytes, 最大支持: {max_size} bytes")
+
+        total = 0
+        while True:
+            chunk = response.read(Config.IMAGE_DOWNLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            total += len(chunk)
+            if total > max_size:
+                raise ValueError(f"图片过大: 已超过 {max_size} bytes")
+            yield chunk
+
+
+def download_image(image_key, max_size=None):
+    """从飞书下载图片到内存"""
     try:
-        with urllib.request.urlopen(req) as response:
-            if response.status == 200:
-                return response.read()
-            else:
-                logger.error(f"下载图片失败: {response.status}")
-                return None
+        with tracing.span("feishu.download_image"):
+            return b"".join(iter_image_chunks(image_key, max_size))
     except Exception as e:
         logger.error(f"下载图片出错: {e}")
-        return None
\ No newline at end of file
+        return None
+
+
+def download_image_to_file(image_key, file_path, max_size=None):
+    """从飞书流式下载图片并直接写入本地文件，返回写入的字节数"""
+    total = 0
+    try:
+        with tracing.span("feishu.download_image") as span, open(file_path, 'wb') as f:
+            for chunk in iter_image_chunks(image_key, max_size):
+                f.write(chunk)
+                total += len(chunk)
+            span.set_attribute("bytes", total)
+        return total
+    except Exception as e:
+        logger.error(f"下载图片出错: {e}")
+        try:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        except OSError:
+            pass
+        return None
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import gzip
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# 各表的清理条件
+# time_column: 判断数据年龄的时间字段（UTC，与CURRENT_TIMESTAMP一致）
+# condition: 额外条件，只有满足条件的行才会被清理
+_TABLES = {
+    "messages": {
+        "time_column": "created_at",
+        "condition": None,
+    },
+    "webhook_logs": {
+        "time_column": "created_at",
+        "condition": None,
+    },
+    "admin_tokens": {
+        "time_column": "last_active_at",
+        # 只清理已失效的token
+        "condition": "(is_valid = 0 OR expired_at < datetime('now', 'localtime'))",
+    },
+    "sessions": {
+        "time_column": "last_active_at",
+        # 消息引用了会话，会话下的消息清理完后才能删除
+        "condition": "NOT EXISTS (SELECT 1 FROM messages m WHERE m.session_id = sessions.id)",
+    },
+}
+
+# 清理顺序：先清理子表再清理父表
+_TABLE_ORDER = ["messages", "webhook_logs", "admin_tokens", "sessions"]
+
+
+class RetentionService:
+    """数据保留与压缩服务
+
+    按Config.RETENTION_POLICIES中每张表的策略（最长保留天数、最大行数、是否归档）
+    定时清理旧数据：可选先归档为gzip压缩的NDJSON文件，再分批小事务删除，
+    最后执行增量vacuum把空闲页还给文件系统。
+    """
+
+    def __init__(self, policies=None, archive_dir=None):
+        self.policies = policies if policies is not None else Config.RETENTION_POLICIES
+        self.archive_dir = archive_dir or Config.RETENTION_ARCHIVE_DIR
+        self._run_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._scheduler = None
+        self._last_run = None
+
+    def _where(self, table, policy, cursor):
+        """生成需要清理的行的条件，没有需要清理的内容时返回None"""
+        spec = _TABLES[table]
+        clauses = []
+        params = []
+
+        if policy.get("max_age_days"):
+            clauses.append(f"{spec['time_column']} < datetime('now', ?)")
+            params.append(f"-{int(policy['max_age_days'])} days")
+
+        if policy.get("max_rows"):
+            # 超出行数上限时，清理最旧的行
+            cursor.execute(f"SELECT id FROM {table} ORDER BY id DESC LIMIT 1 OFFSET ?", (int(policy["max_rows"]),))
+            row = cursor.fetchone()
+            if row:
+                clauses.append("id <= ?")
+                params.append(row[0])
+
+        if not clauses:
+            return None, []
+
+        where = "(" + " OR ".join(clauses) + ")"
+        if spec["condition"]:
+            where += f" AND {spec['condition']}"
+        return where, params
+
+    def _archive(self, table, rows):
+        """将要删除的行追加写入归档文件（gzip压缩的NDJSON），压缩存储的字段解压后写入"""
+        from utils.compression import decompress_text
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, f"{table}_{datetime.now().strftime('%Y%m%d')}.ndjson.gz")
+        # gzip允许多个成员拼接，追加写入后仍可整体解压
+        with gzip.open(path, 'at', encoding='utf-8') as f:
+            for row in rows:
+                record = {key: decompress_text(row[key]) for key in row.keys()}
+                f.write(json.dumps(record, ensure_ascii=False, default=str))
+                f.write("\n")
+        return path
+
+    def purge_table(self, table, policy):
+        """按策略分批清理一张表，返回 (删除行数, 归档行数)"""
+        from models.database import get_db_connection
+        from models.search import remove_from_index
+
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        deleted = 0
+        archived = 0
+
+        try:
+            where, params = self._where(table, policy, cursor)
+            if where is None:
+                return 0, 0
+
+            while not self._stop_event.is_set():
+                cursor.execute(f"SELECT * FROM {table} WHERE {where} ORDER BY id LIMIT ?",
+                               params + [Config.RETENTION_BATCH_SIZE])
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+
+                if policy.get("archive"):
+                    self._archive(table, rows)
+                    archived += len(rows)
+
+                remove_from_index(cursor, table, rows)
+                ids = [row['id'] for row in rows]
+                cursor.execute(f"DELETE FROM {table} WHERE id IN ({','.join('?' * len(ids))})", ids)
+                conn.commit()
+                deleted += len(ids)
+
+                if len(rows) < Config.RETENTION_BATCH_SIZE:
+                    break
+                # 批次之间让出写锁
+                time.sleep(Config.RETENTION_BATCH_PAUSE)
+        finally:
+            conn.close()
+
+        if deleted:
+            logger.info(f"数据清理: {table} 删除 {deleted} 行，归档 {archived} 行")
+        return deleted, archived
+
+    def incremental_vacuum(self):
+        """分步执行增量vacuum，返回释放的页数
+
+        只有auto_vacuum为INCREMENTAL的数据库才能增量回收；已有数据库需执行一次VACUUM才能切换。
+        """
+        from models.database import get_db_connection
+
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        freed = 0
+
+        try:
+            cursor.execute("PRAGMA auto_vacuum")
+            if cursor.fetchone()[0] != 2:
+                cursor.execute("PRAGMA freelist_count")
+                free_pages = cursor.fetchone()[0]
+                if free_pages:
+                    logger.info(f"数据库有 {free_pages} 个空闲页，但未启用增量vacuum，"
+                                f"可在维护窗口执行 PRAGMA auto_vacuum = INCREMENTAL; VACUUM;")
+                return 0
+
+            while not self._stop_event.is_set():
+                cursor.execute("PRAGMA freelist_count")
+                free_pages = cursor.fetchone()[0]
+                if not free_pages:
+                    break
+                step = min(free_pages, Config.RETENTION_VACUUM_PAGES)
+                cursor.execute(f"PRAGMA incremental_vacuum({step})")
+                cursor.fetchall()
+                freed += step
+                time.sleep(Config.RETENTION_BATCH_PAUSE)
+        finally:
+            conn.close()
+
+        if freed:
+            logger.info(f"增量vacuum释放 {freed} 页")
+        return freed
+
+    def run_once(self):
+        """按所有表的策略执行一次清理，返回每张表的结果"""
+        with self._run_lock:
+            started_at = time.perf_counter()
+            results = {}
+
+            for table in _TABLE_ORDER:
+                policy = self.policies.get(table)
+                if not policy:
+                    continue
+                try:
+                    deleted, archived = self.purge_table(table, policy)
+                    results[table] = {"deleted": deleted, "archived": archived}
+                except Exception as e:
+                    logger.error(f"清理 {table} 出错: {e}")
+                    results[table] = {"error": str(e)}
+
+            try:
+                freed_pages = self.incremental_vacuum()
+            except Exception as e:
+                logger.error(f"增量vacuum出错: {e}")
+                freed_pages = 0
+
+            self._last_run = {
+                "finished_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                "duration": time.perf_counter() - started_at,
+                "tables": results,
+                "freed_pages": freed_pages,
+            }
+            return results
+
+    def get_last_run(self):
+        """获取最近一次清理的结果"""
+        return self._last_run
+
+    def start_scheduler(self, interval=None):
+        """启动定时清理线程，间隔为0时不启动"""
+        interval = Config.RETENTION_INTERVAL if interval is None else interval
+        if not interval:
+            logger.info("未启用定时数据清理")
+            return
+
+        if self._scheduler and self._scheduler.is_alive():
+            return
+
+        self._stop_event.clear()
+
+        def run():
+            while not self._stop_event.wait(interval):
+                self.run_once()
+
+        self._scheduler = threading.Thread(target=run, name="db-retention", daemon=True)
+        self._scheduler.start()
+        logger.info(f"定时数据清理已启动，间隔 {interval} 秒")
+
+    def stop_scheduler(self):
+        """停止定时清理线程"""
+        self._stop_event.set()
+        if self._scheduler:
+            self._scheduler.join(timeout=5)
+            self._scheduler = None
+
+
+# 全局数据保留服务
+retention_service = RetentionService()
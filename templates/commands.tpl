@@ -1,6 +1,7 @@
 % rebase('layout.tpl', title='命令管理')
 <h2>命令管理</h2>
 <a href="/admin/commands/add" class="btn">添加命令</a>
+% include('list_filter.tpl', placeholder='命令名称、触发指令或描述')
 
 <table>
     <thead>
@@ -28,4 +29,5 @@
         </tr>
         % end
     </tbody>
-</table>
\ No newline at end of file
+</table>
+% include('pagination.tpl')
\ No newline at end of file
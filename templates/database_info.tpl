@@ -8,6 +8,53 @@
     <p><strong>待应用迁移数:</strong> {{len(db_info['pending_migrations'])}}</p>
 </div>
 
+% if defined('backup_stats'):
+<div class="card">
+    <h3>数据库备份</h3>
+    <p><strong>定时备份:</strong>
+        % if backup_stats['interval']:
+        每 {{'%.1f' % (backup_stats['interval'] / 3600)}} 小时，保留 {{backup_stats['keep']}} 份{{'，gzip压缩' if backup_stats['compress'] else ''}}
+        % else:
+        未启用
+        % end
+    </p>
+    <p><strong>本次运行:</strong> 成功 {{backup_stats['count']}} 次，失败 {{backup_stats['failures']}} 次</p>
+    % last = backup_stats['last']
+    % if last:
+    <p><strong>最近一次:</strong> {{last['finished_at']}}，
+        % if last['success']:
+        耗时 {{'%.2f' % last['duration']}} 秒，数据库 {{'%.1f' % (last['db_size'] / 1024 / 1024)}} MB，备份文件 {{'%.1f' % (last['size'] / 1024 / 1024)}} MB
+        % else:
+        <span style="color: red;">失败: {{last['error']}}</span>
+        % end
+    </p>
+    % end
+    % if backup_stats['backups']:
+    <table>
+        <thead>
+            <tr>
+                <th>备份文件</th>
+                <th>大小</th>
+                <th>时间</th>
+            </tr>
+        </thead>
+        <tbody>
+            % for backup in backup_stats['backups']:
+            <tr>
+                <td>{{backup['name']}}</td>
+                <td>{{'%.1f' % (backup['size'] / 1024 / 1024)}} MB</td>
+                <td>{{backup['created_at']}}</td>
+            </tr>
+            % end
+        </tbody>
+    </table>
+    % end
+    <form action="/admin/database/backup" method="post">
+        <button type="submit" class="btn">立即备份</button>
+    </form>
+</div>
+% end
+
 % if db_info['pending_migrations']:
 <div class="card">
     <h3>待应用迁移</h3>
@@ -22,6 +69,45 @@
 </div>
 % end
 
+% if db_info.get('batched_migrations'):
+<div class="card">
+    <h3>分批迁移</h3>
+    <p>数据回填在后台分批执行，执行期间机器人正常服务。</p>
+    <table>
+        <thead>
+            <tr>
+                <th>版本</th>
+                <th>名称</th>
+                <th>状态</th>
+                <th>进度</th>
+                <th>吞吐</th>
+                <th>更新时间</th>
+            </tr>
+        </thead>
+        <tbody>
+            % for batch in db_info['batched_migrations']:
+            <tr>
+                <td>{{batch['version']}}</td>
+                <td>{{batch['name']}}</td>
+                <td>
+                    % if batch['status'] == 'completed':
+                    <span style="color: green;">✓ 已完成</span>
+                    % elif batch['status'] == 'failed':
+                    <span style="color: red;">失败（重启后继续）</span>
+                    % else:
+                    <span style="color: orange;">执行中</span>
+                    % end
+                </td>
+                <td>{{batch['progress']}} / {{batch['total']}} ({{'%.1f' % batch['percent']}}%)</td>
+                <td>{{'%.0f 行/秒' % batch['rows_per_second'] if batch['rows_per_second'] else '-'}}</td>
+                <td>{{batch['updated_at'] or '-'}}</td>
+            </tr>
+            % end
+        </tbody>
+    </table>
+</div>
+% end
+
 <div class="card">
     <h3>迁移历史</h3>
     <table>
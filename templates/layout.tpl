@@ -17,6 +17,8 @@
             <a href="/admin/users" class="btn">用户管理</a>
             <a href="/admin/database" class="btn">数据库信息</a>
             <a href="/admin/logs" class="btn">日志查看</a>
+            <a href="/admin/search" class="btn">全文搜索</a>
+            <a href="/admin/traces" class="btn">请求追踪</a>
             <a href="/admin/logout" class="btn btn-danger">退出登录</a>
         </nav>
         <hr>
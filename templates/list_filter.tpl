@@ -0,0 +1,4 @@
+<form method="get" class="list-filter">
+    <input type="text" name="q" value="{{query}}" placeholder="{{placeholder}}">
+    <button type="submit" class="btn btn-primary">筛选</button>
+</form>
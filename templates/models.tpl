@@ -1,6 +1,7 @@
 % rebase('layout.tpl', title='模型管理')
 <h2>模型管理</h2>
 <a href="/admin/models/add" class="btn">添加模型</a>
+% include('list_filter.tpl', placeholder='模型名称或描述')
 
 <table>
     <thead>
@@ -28,4 +29,5 @@
         </tr>
         % end
     </tbody>
-</table>
\ No newline at end of file
+</table>
+% include('pagination.tpl')
\ No newline at end of file
@@ -0,0 +1,10 @@
+% if first_url or next_url:
+<div class="pagination">
+    % if first_url:
+    <a href="{{first_url}}">第一页</a>
+    % end
+    % if next_url:
+    <a href="{{next_url}}">下一页</a>
+    % end
+</div>
+% end
@@ -0,0 +1,84 @@
+% rebase('layout.tpl', title='全文搜索')
+<h2>全文搜索</h2>
+
+<form action="/admin/search" method="get">
+    <div>
+        <label for="q">搜索内容（多个词用空格分隔，每个词至少3个字符）:</label>
+        <input type="text" id="q" name="q" value="{{query}}" required>
+    </div>
+
+    <div>
+        <label for="scope">搜索范围:</label>
+        <select id="scope" name="scope">
+            <option value="messages" {{'selected' if scope == 'messages' else ''}}>会话消息</option>
+            <option value="webhook_logs" {{'selected' if scope == 'webhook_logs' else ''}}>Webhook调用日志</option>
+        </select>
+    </div>
+
+    <div>
+        <button type="submit" class="btn btn-primary">搜索</button>
+    </div>
+</form>
+
+% if error:
+<div class="alert alert-error">{{error}}</div>
+% end
+
+% if query and not error:
+<p><small>耗时 {{'%.1f' % elapsed_ms}}ms</small></p>
+<table>
+    <thead>
+        <tr>
+            <th>ID</th>
+            <th>时间</th>
+            % if scope == 'messages':
+            <th>用户</th>
+            <th>会话</th>
+            <th>来源</th>
+            % else:
+            <th>Webhook</th>
+            <th>状态</th>
+            % end
+            <th>摘要</th>
+        </tr>
+    </thead>
+    <tbody>
+        % for result in results:
+        <tr>
+            <td>{{result['id']}}</td>
+            <td>{{result['created_at']}}</td>
+            % if scope == 'messages':
+            <td>{{result['user_id']}}</td>
+            <td>{{result['session_id']}}</td>
+            <td>{{'用户' if result['is_user'] else '机器人'}}</td>
+            % else:
+            <td><a href="/admin/webhook-logs/{{result['webhook_id']}}">{{result['webhook_name'] or result['webhook_id']}}</a></td>
+            <td>{{result['status']}}</td>
+            % end
+            <td>
+                <div class="search-snippet">{{result['snippet']['before']}}<mark>{{result['snippet']['match']}}</mark>{{result['snippet']['after']}}</div>
+            </td>
+        </tr>
+        % end
+        % if not results:
+        <tr>
+            <td colspan="6" style="text-align: center;">没有找到匹配的记录</td>
+        </tr>
+        % end
+    </tbody>
+</table>
+
+% if next_before:
+<div class="pagination">
+    <a href="/admin/search?q={{query_param}}&scope={{scope}}&before={{next_before}}">下一页</a>
+</div>
+% end
+% end
+
+<style>
+.search-snippet {
+    max-width: 600px;
+    white-space: pre-wrap;
+    font-size: 13px;
+}
+</style>
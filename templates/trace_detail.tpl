@@ -0,0 +1,62 @@
+% rebase('layout.tpl', title='请求追踪详情')
+<h2>{{trace['name']}} {{trace['trace_id']}}</h2>
+<a href="/admin/traces" class="btn">返回列表</a>
+<a href="/admin/api/traces?format=otlp&trace_id={{trace['trace_id']}}" class="btn">导出OTLP JSON</a>
+
+<p>开始时间: {{trace['started_at']}}　总耗时: {{'%.0f' % trace['duration_ms']}}ms
+% for key, value in trace['attributes'].items():
+　{{key}}: {{value}}
+% end
+</p>
+% if trace['dropped_spans']:
+<div class="alert alert-warning">阶段数超过上限，另有 {{trace['dropped_spans']}} 个阶段未记录</div>
+% end
+
+<table>
+    <thead>
+        <tr>
+            <th>阶段</th>
+            <th>开始(ms)</th>
+            <th>耗时(ms)</th>
+            <th style="width: 40%;">时间线</th>
+            <th>属性</th>
+        </tr>
+    </thead>
+    <tbody>
+        % total = max(trace['duration_ms'], 1)
+        % for span in trace['spans']:
+        <tr>
+            <td style="padding-left: {{8 + span['depth'] * 16}}px;">{{span['name']}}</td>
+            <td>{{'%.1f' % span['offset_ms']}}</td>
+            <td>{{'%.1f' % span['duration_ms'] if span['duration_ms'] is not None else '进行中'}}</td>
+            <td>
+                <div class="trace-track">
+                    <div class="trace-bar {{'trace-bar-error' if span['error'] else ''}}"
+                         style="margin-left: {{'%.2f' % min(span['offset_ms'] / total * 100, 100)}}%; width: {{'%.2f' % max(min((span['duration_ms'] or 0) / total * 100, 100), 0.3)}}%;"></div>
+                </div>
+            </td>
+            <td>
+                <small>{{', '.join(f'{key}={value}' for key, value in span['attributes'].items())}}</small>
+                % if span['error']:
+                <div class="alert-error"><small>{{span['error']}}</small></div>
+                % end
+            </td>
+        </tr>
+        % end
+    </tbody>
+</table>
+
+<style>
+.trace-track {
+    position: relative;
+    height: 12px;
+    background-color: #f5f5f5;
+}
+.trace-bar {
+    height: 12px;
+    background-color: #4a90d9;
+}
+.trace-bar-error {
+    background-color: #d9534f;
+}
+</style>
@@ -0,0 +1,50 @@
+% rebase('layout.tpl', title='请求追踪')
+<h2>请求追踪</h2>
+<p><small>内存中保留最近的trace，进程重启后清空。导出：<a href="/admin/api/traces?format=otlp">OTLP JSON</a></small></p>
+
+<form action="/admin/traces" method="get">
+    <div>
+        <label for="sort">排序:</label>
+        <select id="sort" name="sort">
+            <option value="slowest" {{'selected' if sort == 'slowest' else ''}}>耗时从长到短</option>
+            <option value="recent" {{'selected' if sort == 'recent' else ''}}>最新的在前</option>
+        </select>
+        <label for="name">类型:</label>
+        <select id="name" name="name">
+            <option value="" {{'selected' if not name else ''}}>全部</option>
+            <option value="飞书事件" {{'selected' if name == '飞书事件' else ''}}>飞书事件</option>
+            <option value="Webhook调用" {{'selected' if name == 'Webhook调用' else ''}}>Webhook调用</option>
+        </select>
+        <button type="submit" class="btn btn-primary">筛选</button>
+    </div>
+</form>
+
+<table>
+    <thead>
+        <tr>
+            <th>时间</th>
+            <th>类型</th>
+            <th>用户/Webhook</th>
+            <th>耗时(ms)</th>
+            <th>阶段数</th>
+            <th>状态</th>
+        </tr>
+    </thead>
+    <tbody>
+        % for trace in traces:
+        <tr>
+            <td><a href="/admin/traces/{{trace['trace_id']}}">{{trace['started_at']}}</a></td>
+            <td>{{trace['name']}}</td>
+            <td>{{trace['attributes'].get('user_id') or trace['attributes'].get('webhook') or ''}}</td>
+            <td>{{'%.0f' % trace['duration_ms']}}</td>
+            <td>{{trace['span_count']}}</td>
+            <td>{{trace['error'] or '正常'}}</td>
+        </tr>
+        % end
+        % if not traces:
+        <tr>
+            <td colspan="6" style="text-align: center;">暂无trace</td>
+        </tr>
+        % end
+    </tbody>
+</table>
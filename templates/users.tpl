@@ -1,6 +1,16 @@
 % rebase('layout.tpl', title='用户管理')
 <h2>用户管理</h2>
 
+<form method="get" class="list-filter">
+    <input type="text" name="q" value="{{query}}" placeholder="用户ID或用户名">
+    <select name="sort">
+        <option value="created_at" {{'selected' if sort == 'created_at' else ''}}>按创建时间</option>
+        <option value="user_id" {{'selected' if sort == 'user_id' else ''}}>按用户ID</option>
+    </select>
+    <label><input type="checkbox" name="admin_only" value="1" {{'checked' if admin_only else ''}}> 只看管理员</label>
+    <button type="submit" class="btn btn-primary">筛选</button>
+</form>
+
 <table>
     <thead>
         <tr>
@@ -30,4 +40,5 @@
         </tr>
         % end
     </tbody>
-</table>
\ No newline at end of file
+</table>
+% include('pagination.tpl')
\ No newline at end of file
@@ -0,0 +1,24 @@
+% rebase('layout.tpl', title='Webhook调用日志详情')
+<h2>「{{webhook['name']}}」调用日志 #{{log['id']}}</h2>
+<a href="/admin/webhook-logs/{{webhook['id']}}" class="btn">返回日志列表</a>
+
+<p>时间: {{log['created_at']}}　状态: {{log['status']}}</p>
+
+<h3>请求数据</h3>
+<div class="log-content">{{log['request_data']}}</div>
+
+<h3>响应</h3>
+<div class="log-content">{{log['response']}}</div>
+
+<style>
+.log-content {
+    max-height: 500px;
+    overflow: auto;
+    white-space: pre-wrap;
+    font-family: monospace;
+    font-size: 12px;
+    background-color: #f5f5f5;
+    padding: 10px;
+    border-radius: 3px;
+}
+</style>
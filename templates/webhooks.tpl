@@ -2,6 +2,7 @@
 <h2>Webhook管理</h2>
 <p>Webhook允许外部系统调用机器人并将消息推送给订阅者。</p>
 <a href="/admin/webhooks/add" class="btn">添加Webhook</a>
+% include('list_filter.tpl', placeholder='Webhook名称或描述')
 
 <table>
     <thead>
@@ -24,9 +25,8 @@
             <td>{{webhook['description'] or '-'}}</td>
             <td>{{webhook['model_name']}}</td>
             <td>
-                % subscription_count = len(get_webhook_subscriptions(webhook['id']))
                 <a href="/admin/webhooks/subscriptions/{{webhook['id']}}">
-                    {{subscription_count}} 个订阅
+                    {{webhook['subscription_count']}} 个订阅
                 </a>
             </td>
             <td>{{("直接推送" if webhook['bypass_ai'] else "AI处理")}}</td>
@@ -41,4 +41,5 @@
         </tr>
         % end
     </tbody>
-</table>
\ No newline at end of file
+</table>
+% include('pagination.tpl')
\ No newline at end of file
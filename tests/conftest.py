@@ -45,6 +45,11 @@ def test_db(test_config):
 
     yield Config.DB_PATH
 
+    # 等待后台分批迁移结束，避免其在清理后访问数据库
+    import models.migration
+    if models.migration._batched_thread is not None:
+        models.migration._batched_thread.join(timeout=10)
+
     # 清理数据库
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -63,6 +68,13 @@ def test_db(test_config):
         except sqlite3.OperationalError:
             pass  # 表可能不存在
 
+    # 无内容的全文索引表不支持DELETE
+    for fts_table in ['messages_fts', 'webhook_logs_fts']:
+        try:
+            cursor.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('delete-all')")
+        except sqlite3.OperationalError:
+            pass
+
     conn.commit()
     conn.close()
 
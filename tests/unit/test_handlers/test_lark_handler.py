@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import sqlite3
+import threading
+from unittest.mock import patch
+from config import Config
+from models.database import UnitOfWork, get_db_connection
+from handlers.lark_handler import process_message, create_reply_function
+
+
+def test_acknowledgement_overlaps_dify_call():
+    """测试处理中提示与Dify调用并行，且先于最终回复送达"""
+    sent = []
+    ack_started = threading.Event()
+
+    def slow_reply(content):
+        if content.startswith("正在思考中"):
+            ack_started.set()
+            time.sleep(0.3)
+        sent.append(content)
+
+    def fake_dify(*args, **kwargs):
+        # Dify调用开始时提示仍在发送中
+        assert ack_started.wait(1)
+        assert sent == []
+        return "answer"
+
+    with patch('models.session.get_or_create_session', return_value=(1, None)), \
+            patch('models.session.get_session_model', return_value={'id': 1}), \
+            patch('models.session.add_message'), \
+            patch('services.dify_service.process_dify_message', side_effect=fake_dify):
+        assert process_message("user_ack", "hello", slow_reply) is True
+
+    assert sent == ["正在思考中，请稍候...", "answer"]
+
+
+def test_reply_does_not_hold_write_lock(test_db):
+    """测试发送回复时已提交本事件的写入，其他连接可以同时写入"""
+    written = []
+
+    def write_answer(*args, **kwargs):
+        # 与process_dify_stream结束时写入回答相同，写入发生在工作单元的共享连接上
+        conn = get_db_connection()
+        conn.execute("INSERT INTO users (user_id) VALUES ('uow_answer')")
+        conn.commit()
+        conn.close()
+        return "answer"
+
+    def send_message(open_id=None, chat_id=None, content=None):
+        if content != "answer":
+            return
+        # 发送回复期间，其他线程（其他用户的事件、Webhook等）通过独立连接写入
+        other = sqlite3.connect(Config.DB_PATH, timeout=0.2)
+        try:
+            other.execute("INSERT INTO users (user_id) VALUES ('uow_other')")
+            other.commit()
+            written.append(content)
+        finally:
+            other.close()
+
+    with patch('models.session.get_or_create_session', return_value=(1, None)), \
+            patch('models.session.get_session_model', return_value={'id': 1}), \
+            patch('models.session.add_message'), \
+            patch('services.dify_service.process_dify_message', side_effect=write_answer), \
+            patch('handlers.lark_handler.send_message', side_effect=send_message):
+        with UnitOfWork("test"):
+            reply_func = create_reply_function("user_lock", "p2p", "chat_lock", [])
+            assert process_message("user_lock", "hello", reply_func) is True
+
+    assert written == ["answer"]
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import pytest
+from models.database import UnitOfWork, commit_unit_of_work, get_db_connection
+from models.user import add_user, get_user
+from models.session import get_or_create_session, add_message
+
+
+def _count(table):
+    conn = get_db_connection()
+    count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_unit_of_work_shares_connection(test_db):
+    """测试工作单元内共用连接，写入在提交前对其他连接不可见"""
+    with UnitOfWork("test") as unit:
+        if not get_user("uow_user"):
+            add_user("uow_user")
+        session_id, _ = get_or_create_session("uow_user")
+        add_message(session_id, "uow_user", "hello")
+
+        # 同一工作单元内可以读到未提交的写入
+        assert get_user("uow_user") is not None
+        assert unit.commits == 0
+
+        commit_unit_of_work()
+        assert unit.commits == 1
+
+    assert unit.statements > 0
+    assert _count("messages") == 1
+
+
+def test_unit_of_work_rolls_back_on_error(test_db):
+    """测试工作单元内出现异常时回滚未提交的写入"""
+    with pytest.raises(RuntimeError):
+        with UnitOfWork("test"):
+            add_user("rollback_user")
+            raise RuntimeError("boom")
+
+    assert get_user("rollback_user") is None
+
+
+def test_shared_connection_rollback_keeps_other_writes(test_db):
+    """测试共享连接的rollback只回滚调用方的写入，不影响同一工作单元中其他函数待提交的写入"""
+    with UnitOfWork("test"):
+        add_user("kept_user")
+
+        conn = get_db_connection()
+        conn.execute("INSERT INTO users (user_id) VALUES ('rolled_back_user')")
+        conn.rollback()
+        conn.close()
+
+    assert get_user("kept_user") is not None
+    assert get_user("rolled_back_user") is None
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+import sqlite3
+import pytest
+from unittest.mock import patch
+from models.migration import DatabaseMigration, init_database_with_migration
+
+
+@pytest.fixture
+def fresh_db(tmp_path):
+    import config
+    import models.database
+
+    db_path = str(tmp_path / "startup.db")
+    # test_config会reload config模块，两处的Config可能不是同一个类
+    with patch.object(config.Config, 'DB_PATH', db_path), \
+            patch.object(models.database.Config, 'DB_PATH', db_path):
+        yield db_path
+
+        # 等待后台分批迁移结束，避免影响下一个测试的数据库
+        import models.migration
+        if models.migration._batched_thread is not None:
+            models.migration._batched_thread.join(timeout=10)
+
+
+def test_startup_backs_up_only_when_migrating(fresh_db):
+    """测试没有待应用迁移时启动不备份、只检查一次完整性"""
+    # 新数据库：执行全部迁移，没有可备份的内容
+    assert init_database_with_migration() is True
+    assert not glob.glob(f"{fresh_db}.backup_*")
+
+    with patch.object(DatabaseMigration, 'validate_database_integrity', return_value=True) as check:
+        assert init_database_with_migration() is True
+    assert check.call_count == 1
+    assert not glob.glob(f"{fresh_db}.backup_*")
+
+    # 有待应用迁移时使用在线备份
+    conn = sqlite3.connect(fresh_db)
+    conn.execute("DELETE FROM db_migrations WHERE version = '1.5.0'")
+    conn.commit()
+    conn.close()
+
+    assert init_database_with_migration() is True
+    backups = glob.glob(f"{fresh_db}.backup_*")
+    assert len(backups) == 1
+    assert os.path.getsize(backups[0]) > 0
+
+
+def test_integrity_check_modes(fresh_db):
+    """测试完整性检查模式"""
+    migration = DatabaseMigration()
+    assert migration.validate_database_integrity("quick") is True
+    assert migration.validate_database_integrity("full") is True
+    assert migration.validate_database_integrity("off") is True
+
+
+class BackfillMigration(DatabaseMigration):
+    """带一个分批回填迁移的测试迁移类"""
+
+    def get_available_migrations(self):
+        return super().get_available_migrations() + [
+            ("9.0.0", {"name": "回填消息长度", "func": self.migrate_9_0_0,
+                       "total": self.total_9_0_0, "batch": self.batch_9_0_0}),
+        ]
+
+    def migrate_9_0_0(self, cursor):
+        if not self.column_exists(cursor, "messages", "content_length"):
+            cursor.execute("ALTER TABLE messages ADD COLUMN content_length INTEGER")
+
+    def total_9_0_0(self, cursor):
+        cursor.execute("SELECT COUNT(*) FROM messages")
+        return cursor.fetchone()[0]
+
+    def batch_9_0_0(self, cursor, last_id, batch_size):
+        cursor.execute("SELECT id FROM messages WHERE id > ? ORDER BY id LIMIT ?", (last_id or 0, batch_size))
+        ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            return last_id, 0
+        cursor.execute("UPDATE messages SET content_length = LENGTH(content) WHERE id BETWEEN ? AND ?",
+                       (ids[0], ids[-1]))
+        return ids[-1], len(ids)
+
+
+def batched_row(migration, version):
+    """获取指定版本的分批迁移记录"""
+    return next(row for row in migration.get_batched_migrations() if row['version'] == version)
+
+
+def test_batched_migration_resumes(fresh_db):
+    """测试分批迁移在后台执行，中断后从记录的位置继续"""
+    with patch('models.migration.start_batched_migrations'):
+        assert init_database_with_migration() is True
+    conn = sqlite3.connect(fresh_db)
+    conn.executemany("INSERT INTO messages (session_id, user_id, content) VALUES (1, 'u', ?)",
+                     [("x" * i,) for i in range(1, 26)])
+    conn.commit()
+    conn.close()
+
+    migration = BackfillMigration()
+    with patch('models.migration.start_batched_migrations'), \
+            patch('config.Config.MIGRATION_BATCH_SIZE', 10), \
+            patch('config.Config.MIGRATION_BATCH_PAUSE', 0):
+        assert migration.run_migrations() is True
+        row = batched_row(migration, "9.0.0")
+        assert row['status'] == 'running' and row['total'] == 25
+
+        # 第二批失败，已完成的批次保留
+        calls = []
+        original = migration.batch_9_0_0
+
+        def flaky(cursor, last_id, batch_size):
+            calls.append(last_id)
+            if len(calls) == 2:
+                raise RuntimeError("interrupted")
+            return original(cursor, last_id, batch_size)
+
+        assert migration.run_batched_migration("9.0.0", flaky) is False
+        row = batched_row(migration, "9.0.0")
+        assert row['status'] == 'failed' and row['progress'] == 10
+
+        migration.run_batched_migrations()
+
+    row = batched_row(migration, "9.0.0")
+    assert row['status'] == 'completed' and row['progress'] == 25
+
+    conn = sqlite3.connect(fresh_db)
+    assert conn.execute("SELECT COUNT(*) FROM messages WHERE content_length = LENGTH(content)").fetchone()[0] == 25
+    conn.close()
+
+
+def test_compress_existing_rows(fresh_db):
+    """测试1.6.x迁移分批压缩已有的大文本，显示时可以还原"""
+    from utils.compression import decompress_text, is_compressed
+
+    with patch('models.migration.start_batched_migrations'):
+        assert init_database_with_migration() is True
+
+    large = "告警详情 " * 500
+    conn = sqlite3.connect(fresh_db)
+    conn.executemany("INSERT INTO messages (session_id, user_id, content) VALUES (1, 'u', ?)",
+                     [(large,), ("short",), (None,)])
+    conn.execute("INSERT INTO webhook_logs (webhook_id, request_data, response, status) VALUES (1, ?, 'ok', 200)",
+                 (large,))
+    # 模拟已有数据的数据库升级：迁移刚应用，回填尚未开始
+    conn.execute("UPDATE db_migrations SET status = 'running', progress = 0, total = 1, last_key = NULL "
+                 "WHERE version IN ('1.6.0', '1.6.1')")
+    conn.commit()
+    conn.close()
+
+    migration = DatabaseMigration()
+    with patch('config.Config.MIGRATION_BATCH_SIZE', 2), \
+            patch('config.Config.MIGRATION_BATCH_PAUSE', 0), \
+            patch('config.Config.COMPRESSION_MIN_SIZE', 1024):
+        migration.run_batched_migrations()
+
+    assert batched_row(migration, "1.6.0")['status'] == 'completed'
+    assert batched_row(migration, "1.6.1")['status'] == 'completed'
+
+    conn = sqlite3.connect(fresh_db)
+    contents = [row[0] for row in conn.execute("SELECT content FROM messages ORDER BY id")]
+    request_data, response = conn.execute("SELECT request_data, response FROM webhook_logs").fetchone()
+    conn.close()
+
+    assert is_compressed(contents[0]) and len(contents[0]) < len(large.encode('utf-8'))
+    assert decompress_text(contents[0]) == large
+    assert contents[1:] == ["short", None]
+    assert decompress_text(request_data) == large and response == "ok"
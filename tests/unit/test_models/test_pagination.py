@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from models.user import add_user, list_users, set_user_admin
+from models.model import add_model, list_models
+from models.webhook import create_webhook, log_webhook_call, list_webhook_logs, get_webhook_log
+from models.pagination import decode_cursor
+
+
+def test_list_users_keyset_paging(test_db):
+    """测试用户列表按游标翻页，结果不重复不遗漏"""
+    for i in range(7):
+        add_user(f"page_user_{i}", f"用户{i}")
+    set_user_admin("page_user_3", 1)
+
+    seen = []
+    after = None
+    while True:
+        page = list_users(after=after, limit=3, sort="user_id")
+        seen.extend(user['user_id'] for user in page['items'])
+        after = page['next_cursor']
+        if not after:
+            break
+    assert seen == sorted(f"page_user_{i}" for i in range(7))
+
+    assert [user['user_id'] for user in list_users(admin_only=True)['items']] == ["page_user_3"]
+    assert [user['user_id'] for user in list_users(query="用户5")['items']] == ["page_user_5"]
+    # 无效游标从第一页开始
+    assert decode_cursor("not-a-cursor") is None
+    assert len(list_users(after="not-a-cursor", limit=2)['items']) == 2
+
+
+def test_list_projections(test_db):
+    """测试列表只返回摘要字段，日志内容按需读取"""
+    add_model("page-model", "desc", "http://dify", "chatbot", "secret-key")
+    [model] = list_models(query="page-model")['items']
+    assert "api_key" not in model
+
+    webhook_id = create_webhook("page-hook", "", None, "")[0]
+    for status in (200, 500, 200):
+        log_webhook_call(webhook_id, {"status": status}, "ok", status)
+
+    page = list_webhook_logs(webhook_id, limit=2)
+    assert len(page['items']) == 2 and page['next_cursor']
+    assert "request_data" not in page['items'][0]
+    assert [log['status'] for log in list_webhook_logs(webhook_id, status=500)['items']] == [500]
+
+    log = get_webhook_log(page['items'][0]['id'])
+    assert log['response'] == "ok"
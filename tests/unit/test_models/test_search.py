@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import pytest
+from models.database import get_db_connection
+from models.session import add_message, get_or_create_session
+from models.search import search_messages, search_webhook_logs, remove_from_index
+from models.webhook import create_webhook, log_webhook_call
+
+
+def test_search_messages_with_paging(test_db):
+    """测试消息写入时建立索引，搜索结果按id从新到旧分页并带摘要"""
+    session_id, _ = get_or_create_session("search_user")
+    ids = [add_message(session_id, "search_user", f"第{i}次告警：数据库连接超时，请检查") for i in range(5)]
+    add_message(session_id, "search_user", "无关内容")
+
+    first = search_messages("连接超时", limit=3)
+    assert [row['id'] for row in first['results']] == ids[:1:-1]
+    assert first['results'][0]['snippet']['match'] == "连接超时"
+    assert first['next_before'] == ids[2]
+
+    second = search_messages("连接超时", before_id=first['next_before'], limit=3)
+    assert [row['id'] for row in second['results']] == ids[1::-1]
+    assert second['next_before'] is None
+
+    assert search_messages("连接超时", user_id="other_user")['results'] == []
+
+    with pytest.raises(ValueError):
+        search_messages("告警")
+
+
+@pytest.mark.parametrize("limit", [0, -1, -2])
+def test_search_limit_is_at_least_one(test_db, limit):
+    """测试limit为0或负数时按每页一条返回，而不是报错或不限条数"""
+    session_id, _ = get_or_create_session("search_user")
+    ids = [add_message(session_id, "search_user", f"第{i}次告警：磁盘空间不足") for i in range(3)]
+
+    found = search_messages("磁盘空间", limit=limit)
+    assert [row['id'] for row in found['results']] == ids[-1:]
+    assert found['next_before'] == ids[-1]
+
+
+def test_search_compressed_webhook_logs(test_db):
+    """测试压缩存储的Webhook日志可以被搜索，删除后从索引中移除"""
+    webhook_id = create_webhook("search-hook", "", None, "")[0]
+    log_webhook_call(webhook_id, {"alert": "disk full on host-42", "detail": "x" * 4000}, "ok", 200)
+
+    found = search_webhook_logs("host-42")
+    [result] = found['results']
+    assert result['webhook_name'] == "search-hook"
+    assert result['snippet']['match'] == "host-42"
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM webhook_logs WHERE id = ?", (result['id'],))
+    rows = cursor.fetchall()
+    assert remove_from_index(cursor, "webhook_logs", rows) == 1
+    cursor.execute("DELETE FROM webhook_logs WHERE id = ?", (result['id'],))
+    conn.commit()
+    conn.close()
+
+    assert search_webhook_logs("host-42")['results'] == []
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import pytest
+from unittest.mock import patch
+from models.database import get_db_connection
+from models.model import add_model
+from models.command import add_command
+from models.session import get_or_create_session, set_config, _session_filter
+
+
+@pytest.mark.parametrize("returning", [True, False])
+def test_get_or_create_session(test_db, returning):
+    """测试会话复用和新会话的模型回退，RETURNING和旧版本SQLite的实现结果一致"""
+    model_id = add_model("session-model", "", "http://dify", "chatbot", "key")
+    default_model_id = add_model("default-model", "", "http://dify", "chatbot", "key")
+    _, command_id = add_command("cmd", "", "\\session-cmd", model_id)
+    set_config("default_model", str(default_model_id))
+
+    with patch('models.session.SUPPORTS_RETURNING', returning):
+        session_id, conversation_id = get_or_create_session("session_user")
+        assert conversation_id is None
+        assert get_or_create_session("session_user") == (session_id, None)
+
+        command_session_id, _ = get_or_create_session("session_user", command_id=command_id)
+        assert command_session_id != session_id
+        assert get_or_create_session("session_user", command_id=command_id)[0] == command_session_id
+
+        model_session_id, _ = get_or_create_session("session_user", model_id=model_id)
+        assert model_session_id not in (session_id, command_session_id)
+
+    conn = get_db_connection()
+    rows = {row['id']: row['model_id'] for row in conn.execute("SELECT id, model_id FROM sessions")}
+    conn.close()
+    assert rows == {session_id: default_model_id, command_session_id: model_id, model_session_id: model_id}
+
+
+def test_session_lookup_uses_covering_index(test_db):
+    """测试各种会话查找条件都只读取索引"""
+    conn = get_db_connection()
+    for model_id, command_id in [(1, 2), (1, None), (None, 2), (None, None)]:
+        where, params = _session_filter("u", model_id, command_id)
+        plan = " ".join(row[3] for row in conn.execute(
+            f"EXPLAIN QUERY PLAN SELECT id FROM sessions WHERE {where} AND is_active = 1 "
+            f"AND last_active_at > ? ORDER BY last_active_at DESC LIMIT 1", params + ["2000-01-01"]))
+        assert "COVERING INDEX" in plan and "TEMP B-TREE" not in plan, plan
+    conn.close()
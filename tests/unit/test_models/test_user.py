@@ -2,7 +2,11 @@
 # -*- coding: utf-8 -*-
 
 import pytest
-from models.user import add_user, get_user, check_admin, set_user_admin, get_all_users
+from unittest.mock import patch
+from models.user import (
+    add_user, get_user, check_admin, set_user_admin, get_all_users, ensure_user, flush_pending_users,
+    invalidate_user_cache
+)
 
 
 def test_add_user(test_db, sample_user):
@@ -63,4 +67,34 @@ def test_get_all_users(test_db):
     assert len(users) == 3
 
     # 验证管理员排在前面
-    assert users[0]['is_admin'] == 1
\ No newline at end of file
+    assert users[0]['is_admin'] == 1
+
+
+def test_ensure_user_batches_inserts(test_db):
+    """测试新用户批量写入，已知用户不访问数据库"""
+    invalidate_user_cache()
+    ensure_user('batch_user_1')
+    ensure_user('batch_user_2')
+
+    # 查询前会先写入待写入的用户
+    assert get_user('batch_user_1') is not None
+    assert get_user('batch_user_2') is not None
+    assert flush_pending_users() == 0
+
+    with patch('models.user.get_db_connection') as connection:
+        ensure_user('batch_user_1')
+        connection.assert_not_called()
+
+
+def test_check_admin_cache_invalidated(test_db):
+    """测试管理员标记缓存在set_user_admin后失效"""
+    invalidate_user_cache()
+    add_user('cached_admin', 'Cached', 0)
+    assert check_admin('cached_admin') is False
+
+    with patch('models.user.get_db_connection') as connection:
+        assert check_admin('cached_admin') is False
+        connection.assert_not_called()
+
+    set_user_admin('cached_admin', 1)
+    assert check_admin('cached_admin') is True
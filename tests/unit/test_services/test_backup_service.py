@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import gzip
+import sqlite3
+from datetime import datetime
+from unittest.mock import patch
+from services.backup_service import BackupService
+
+
+def test_backup_retention_and_restore(test_db, tmp_path):
+    """测试在线备份、压缩和保留份数"""
+    service = BackupService(backup_dir=str(tmp_path), keep=2, compress=True)
+
+    paths = []
+    for i in range(3):
+        path = service.create_backup()
+        assert path and path.endswith(".db.gz")
+        # 改为不同日期的文件名，检查按时间保留
+        renamed = tmp_path / f"{service._backup_prefix()}2000010{i}_000000.db.gz"
+        (tmp_path / path.split('/')[-1]).rename(renamed)
+        paths.append(renamed)
+
+    service.apply_retention()
+    names = [backup['name'] for backup in service.list_backups()]
+    assert names == [paths[2].name, paths[1].name]
+
+    # 解压后是完整可用的数据库
+    restored = tmp_path / "restored.db"
+    restored.write_bytes(gzip.decompress(paths[2].read_bytes()))
+    conn = sqlite3.connect(str(restored))
+    assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    assert conn.execute("SELECT COUNT(*) FROM db_migrations").fetchone()[0] > 0
+    conn.close()
+
+    stats = service.get_stats()
+    assert stats['count'] == 3
+    assert stats['last']['success'] and stats['last']['size'] > 0
+
+
+def test_backups_in_same_second_do_not_overwrite(test_db, tmp_path):
+    """测试同一秒内的多次备份（如手动与定时备份）写入不同文件"""
+    service = BackupService(backup_dir=str(tmp_path), keep=10, compress=False)
+
+    with patch('services.backup_service.datetime') as clock:
+        clock.now.return_value = datetime(2024, 1, 1, 12, 0, 0)
+        first = service.create_backup()
+        second = service.create_backup()
+
+    assert first and second and first != second
+    assert len(service.list_backups()) == 2
+
+
+def test_stepwise_backup_reads_snapshot_without_blocking_writers(test_db, tmp_path):
+    """测试WAL模式下分步备份复制同一个快照，两步之间的写入不会被阻塞，也不会使备份重新开始"""
+    import models.migration
+    from models.database import backup_database, enable_wal
+
+    # 等待后台分批迁移结束，测试中只有writer一个写入者
+    if models.migration._batched_thread is not None:
+        models.migration._batched_thread.join(timeout=10)
+    assert enable_wal() == "wal"
+    writer = sqlite3.connect(test_db, timeout=0.1)
+    remaining_pages = []
+
+    def write_between_steps(status, remaining, total):
+        remaining_pages.append(remaining)
+        writer.execute("INSERT INTO configs (key, value) VALUES ('backup_probe', '1') "
+                       "ON CONFLICT(key) DO UPDATE SET value = value + 1")
+        writer.commit()
+
+    try:
+        dest = backup_database(str(tmp_path / "stepwise.db"), pages=1, progress=write_between_steps, max_restarts=0)
+    finally:
+        writer.close()
+
+    assert len(remaining_pages) > 1
+    assert remaining_pages == sorted(remaining_pages, reverse=True)
+    copy = sqlite3.connect(dest)
+    try:
+        assert copy.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+        assert copy.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+        assert copy.execute("SELECT COUNT(*) FROM configs WHERE key = 'backup_probe'").fetchone()[0] == 0
+    finally:
+        copy.close()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import pytest
+from unittest.mock import patch
+from services.cache_service import ImageCacheService
+
+
+def fake_download(image_key, file_path, max_size=None):
+    with open(file_path, 'wb') as f:
+        f.write(b"fake image")
+    return 10
+
+
+def test_prefetch_uploads_to_session_model(tmp_path):
+    """测试收到图片后预取并上传到会话模型"""
+    cache = ImageCacheService(cache_dir=str(tmp_path))
+    cache.save_user_image_key("user_1", "img_key_1")
+
+    with patch('services.lark_service.download_image_to_file', side_effect=fake_download), \
+            patch('models.session.get_or_create_session', return_value=(1, None)), \
+            patch('models.session.get_session_model', return_value={'id': 7}), \
+            patch('services.dify_service.upload_image_to_dify', return_value={'id': 'file_abc'}) as upload:
+        cache.start_prefetch("user_1", "img_key_1").result(timeout=5)
+
+    result = cache.get_prefetch_result("user_1", "img_key_1", timeout=5)
+    assert result['upload_file_id'] == 'file_abc'
+    assert result['model_id'] == 7
+    assert os.path.exists(result['image_path'])
+    upload.assert_called_once()
+
+    # 其他图片key不会命中
+    assert cache.get_prefetch_result("user_1", "img_key_2") is None
+
+    # 清除缓存时一并删除预取文件
+    cache.clear_user_image("user_1")
+    assert not os.path.exists(result['image_path'])
+    assert cache.get_prefetch_result("user_1", "img_key_1") is None
+
+
+def test_entries_survive_memory_eviction_and_restart(tmp_path):
+    """测试内存LRU淘汰或进程重启后可从磁盘存储恢复"""
+    cache = ImageCacheService(cache_dir=str(tmp_path), memory_entries=1)
+    cache.save_user_image_key("user_1", "key_1")
+    cache.save_user_image_key("user_2", "key_2")
+
+    # user_1 已被挤出内存，但仍可从磁盘加载
+    assert "user_1" not in cache._entries
+    assert cache.get_user_image_key("user_1") == "key_1"
+
+    restarted = ImageCacheService(cache_dir=str(tmp_path))
+    assert restarted.get_user_image_key("user_2") == "key_2"
+
+
+def test_user_without_image_skips_disk(tmp_path):
+    """测试没有缓存图片的用户查询时不读取磁盘"""
+    cache = ImageCacheService(cache_dir=str(tmp_path), memory_entries=1)
+    cache.save_user_image_key("user_1", "key_1")
+    cache.save_user_image_key("user_2", "key_2")
+
+    with patch.object(cache, '_load_entry', wraps=cache._load_entry) as load:
+        assert cache.get_user_image_key("user_text_only") is None
+        load.assert_not_called()
+        # 被挤出内存的条目仍按索引从磁盘加载
+        assert cache.get_user_image_key("user_1") == "key_1"
+        load.assert_called_once()
+
+    cache.clear_user_image("user_1")
+    assert cache._user_hash("user_1") not in cache._disk_users
+
+
+def test_disk_limit_and_expiry(tmp_path):
+    """测试磁盘容量淘汰和过期清理"""
+    cache = ImageCacheService(cache_dir=str(tmp_path), disk_max_size=25)
+
+    first = cache.save_user_image("user_1", b"x" * 10)
+    os.utime(first, (time.time() - 10, time.time() - 10))
+    cache.save_user_image("user_2", b"x" * 10)
+    cache.save_user_image("user_3", b"x" * 10)
+
+    # 超过25字节上限，最旧的图片被淘汰
+    assert not os.path.exists(first)
+    assert cache.get_user_image("user_1") is None
+    assert cache.get_user_image("user_3") is not None
+
+    with patch('services.cache_service.time.time', return_value=time.time() + 3600):
+        assert cache.cleanup_expired_cache() == 2
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.jpg')]
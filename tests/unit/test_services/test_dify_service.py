@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import socket
+import threading
+import http.client
+import pytest
+from unittest.mock import patch
+from config import Config
+from services.dify_service import (
+    encode_multipart_formdata, encode_multipart_formdata_stream, upload_file_to_dify, get_upload_dedup_stats,
+    register_generation, attach_stream, unregister_generation, cancel_generation, process_dify_stream,
+    process_dify_message, get_stream_watchdog_stats
+)
+
+
+def test_multipart_stream_matches_bytes(tmp_path):
+    """测试流式multipart请求体与一次性编码结果一致"""
+    image_path = tmp_path / "test.png"
+    image_path.write_bytes(b"\x89PNG" + b"x" * 200000)
+
+    files = {'file': str(image_path)}
+    fields = {'user': 'test_user'}
+
+    expected, expected_type = encode_multipart_formdata(files, fields, boundary="testboundary")
+    body, content_type, content_length = encode_multipart_formdata_stream(files, fields, boundary="testboundary")
+
+    chunks = []
+    while True:
+        chunk = body.read(8192)
+        if not chunk:
+            break
+        assert len(chunk) <= 8192
+        chunks.append(chunk)
+    body.close()
+
+    assert b"".join(chunks) == expected
+    assert content_length == len(expected)
+    assert content_type == expected_type
+
+
+def test_upload_dedup_by_content(tmp_path):
+    """测试相同内容的图片只上传一次"""
+    model = {'dify_url': 'https://dify.example.com/v1', 'api_key': 'dedup_key'}
+    first = tmp_path / "a.png"
+    second = tmp_path / "b.png"
+    first.write_bytes(b"same image content")
+    second.write_bytes(b"same image content")
+
+    before = get_upload_dedup_stats()
+    with patch('services.dify_service.dify_request', return_value={'id': 'file_1'}) as request:
+        assert upload_file_to_dify(model, str(first), "user_a")['id'] == 'file_1'
+        assert upload_file_to_dify(model, str(second), "user_b")['id'] == 'file_1'
+        assert request.call_count == 1
+
+        # 不同模型需要重新上传
+        other_model = dict(model, api_key='other_key')
+        upload_file_to_dify(other_model, str(first), "user_a")
+        assert request.call_count == 2
+
+    after = get_upload_dedup_stats()
+    assert after['hits'] == before['hits'] + 1
+    assert after['misses'] == before['misses'] + 2
+
+
+def test_cancel_generation_aborts_stream():
+    """测试取消生成时停止Dify任务并中断阻塞中的流读取"""
+    server, client = socket.socketpair()
+    event = b'data: {"event": "message", "task_id": "task_1", "conversation_id": "conv_1", "answer": "partial"}\n\n'
+    server.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n"
+                   + f"{len(event):x}\r\n".encode() + event + b"\r\n")
+
+    stream = http.client.HTTPResponse(client)
+    stream.begin()
+    model = {'dify_url': 'https://dify.example.com/v1', 'api_key': 'key'}
+    generation = register_generation("user_cancel")
+    assert attach_stream(generation, model, 1, stream)
+
+    with patch('services.dify_service.add_message') as add_message, \
+            patch('services.dify_service.update_session_conversation'), \
+            patch('services.dify_service.stop_dify_response') as stop:
+        chunks = process_dify_stream(stream, 1, "user_cancel", generation)
+        assert next(chunks) == "partial"
+        assert generation['task_id'] == "task_1"
+
+        threading.Timer(0.2, cancel_generation, args=("user_cancel", "测试")).start()
+        assert list(chunks) == []
+
+    assert generation['cancelled'].is_set()
+    stop.assert_called_once_with(model, "task_1", "user_cancel")
+    assert add_message.call_args[0][2] == "partial\n\n（已取消）"
+    assert cancel_generation("user_cancel") is False
+    server.close()
+
+
+def test_older_message_does_not_cancel_newer_generation():
+    """测试等待Dify响应期间收到新消息时，旧消息的流不再关联，也不会取消新消息的生成"""
+    model = {'id': 1, 'name': 'order-model', 'dify_type': 'chatbot'}
+    older = register_generation("user_order")
+    newer = None
+
+    class Stream:
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    stream = Stream()
+
+    def slow_dify(*args, **kwargs):
+        # Dify返回响应头之前用户又发来一条消息
+        nonlocal newer
+        newer = register_generation("user_order")
+        return stream
+
+    with patch('services.dify_service.ask_dify_chatbot', side_effect=slow_dify), \
+            patch('services.dify_service.process_dify_stream') as process_stream:
+        assert process_dify_message(model, "旧消息", None, "user_order", 1, generation=older) is None
+
+    process_stream.assert_not_called()
+    assert stream.closed
+    assert older['cancelled'].is_set() and older['seq'] < newer['seq']
+    assert not newer['cancelled'].is_set()
+
+    # 旧消息处理结束时不会移除新消息的登记
+    unregister_generation(older)
+    assert cancel_generation("user_order") is True
+    assert newer['cancelled'].is_set()
+
+
+def test_stream_watchdog_delivers_partial_answer():
+    """测试只有ping没有新内容时看门狗中断流并返回部分回答"""
+    server, client = socket.socketpair()
+    events = [b'data: {"event": "message", "answer": "partial"}\n\n', b'data: {"event": "ping"}\n\n']
+    server.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n"
+                   + b"".join(f"{len(event):x}\r\n".encode() + event + b"\r\n" for event in events))
+
+    stream = http.client.HTTPResponse(client)
+    stream.begin()
+    model = {'id': 1, 'name': 'watchdog-model'}
+
+    with patch('services.dify_service.add_message') as add_message, \
+            patch.object(Config, 'DIFY_STREAM_IDLE_TIMEOUT', 0.2):
+        chunks = list(process_dify_stream(stream, 1, "user_watchdog", model=model))
+
+    assert chunks[0] == "partial"
+    assert "响应超时" in chunks[-1]
+    assert add_message.call_args[0][2].startswith("partial")
+    assert get_stream_watchdog_stats()['watchdog-model']['idle'] == 1
+    server.close()
+
+
+class _TrickleStream:
+    """每次read1只返回几个字节，模拟事件和分隔符被拆分到多个数据块"""
+
+    def __init__(self, data, size):
+        self.data = data
+        self.size = size
+
+    def read1(self, n):
+        chunk, self.data = self.data[:self.size], self.data[self.size:]
+        return chunk
+
+    read = read1
+
+    def close(self):
+        pass
+
+
+@pytest.mark.parametrize("size", [1, 3, 64 * 1024])
+def test_process_dify_stream_split_events(size):
+    """测试事件和分隔符跨越数据块时仍能完整解析"""
+    large = "x" * 5000
+    data = (b'data: {"event": "message", "answer": "\xe4\xbd\xa0\xe5\xa5\xbd"}\n\n'
+            b'data: {"event": "node_finished", "data": {"text": "' + large.encode() + b'"}}\n\n'
+            b'data: {"event": "message", "answer": " world"}\n\n'
+            b'data: {"event": "message_end", "conversation_id": "conv-1"}\n\n')
+
+    with patch('services.dify_service.add_message') as add_message, \
+            patch('services.dify_service.update_session_conversation') as update_conversation:
+        chunks = list(process_dify_stream(_TrickleStream(data, size), 1, "user_split"))
+
+    assert chunks == ["你好", " world"]
+    assert add_message.call_args[0][2] == "你好 world"
+    update_conversation.assert_called_once_with(1, "conv-1")
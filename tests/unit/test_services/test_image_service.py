@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import pytest
+from services.image_service import preprocess_image, get_image_settings, get_image_preprocess_stats
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def test_get_image_settings_model_override():
+    """测试模型参数覆盖默认预处理配置"""
+    model = {'parameters': json.dumps({"image_preprocess": {"max_dimension": 512, "format": "JPEG"}})}
+    settings = get_image_settings(model)
+    assert settings['max_dimension'] == 512
+    assert settings['format'] == 'jpeg'
+
+
+def test_preprocess_downscales_large_image(tmp_path):
+    """测试大图被缩小并重新编码"""
+    image_path = str(tmp_path / "large.png")
+    Image.effect_noise((1600, 1200), 50).convert("RGB").save(image_path)
+
+    before = get_image_preprocess_stats()
+    model = {'parameters': json.dumps({"image_preprocess": {"enabled": True, "max_dimension": 800}})}
+    output_path = preprocess_image(model, image_path)
+
+    assert output_path != image_path
+    assert output_path.endswith(".webp")
+    with Image.open(output_path) as processed:
+        assert max(processed.size) == 800
+    assert os.path.getsize(output_path) < os.path.getsize(image_path)
+
+    after = get_image_preprocess_stats()
+    assert after['processed'] == before['processed'] + 1
+    assert after['bytes_saved'] > before['bytes_saved']
+
+
+def test_preprocess_disabled(tmp_path):
+    """测试关闭预处理时返回原图"""
+    image_path = str(tmp_path / "small.png")
+    Image.new("RGB", (10, 10)).save(image_path)
+    model = {'parameters': {"image_preprocess": {"enabled": False}}}
+    assert preprocess_image(model, image_path) == image_path
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+import pytest
+from unittest.mock import patch
+from models.database import get_db_connection
+from services.retention_service import RetentionService
+
+
+def _insert_rows(days_ago, count, session_id=1):
+    conn = get_db_connection()
+    conn.execute("INSERT OR IGNORE INTO sessions (id, user_id, last_active_at) VALUES (?, 'u', datetime('now', ?))",
+                 (session_id, f"-{days_ago} days"))
+    conn.executemany(
+        "INSERT INTO messages (session_id, user_id, content, created_at) VALUES (?, 'u', ?, datetime('now', ?))",
+        [(session_id, f"message {i}", f"-{days_ago} days") for i in range(count)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def _count(table):
+    conn = get_db_connection()
+    count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_purge_archives_then_deletes_in_batches(test_db, tmp_path):
+    """测试按年龄归档并分批删除，会话在消息清理后删除"""
+    _insert_rows(days_ago=400, count=7, session_id=1)
+    _insert_rows(days_ago=1, count=3, session_id=2)
+
+    policies = {
+        "messages": {"max_age_days": 365, "archive": True},
+        "sessions": {"max_age_days": 365},
+    }
+    service = RetentionService(policies=policies, archive_dir=str(tmp_path))
+
+    with patch('services.retention_service.Config.RETENTION_BATCH_SIZE', 3), \
+            patch('services.retention_service.Config.RETENTION_BATCH_PAUSE', 0):
+        results = service.run_once()
+
+    assert results["messages"] == {"deleted": 7, "archived": 7}
+    assert results["sessions"]["deleted"] == 1
+    assert _count("messages") == 3
+    assert _count("sessions") == 1
+
+    [archive] = list(tmp_path.glob("messages_*.ndjson.gz"))
+    rows = [json.loads(line) for line in gzip.open(archive, 'rt', encoding='utf-8')]
+    assert len(rows) == 7
+    assert rows[0]["content"] == "message 0"
+
+
+def test_purge_by_row_cap(test_db, tmp_path):
+    """测试超过行数上限时删除最旧的行"""
+    _insert_rows(days_ago=1, count=10)
+
+    service = RetentionService(policies={"messages": {"max_rows": 4}}, archive_dir=str(tmp_path))
+    deleted, archived = service.purge_table("messages", service.policies["messages"])
+
+    assert (deleted, archived) == (6, 0)
+    conn = get_db_connection()
+    contents = [row[0] for row in conn.execute("SELECT content FROM messages ORDER BY id")]
+    conn.close()
+    assert contents == [f"message {i}" for i in range(6, 10)]
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import zlib
+from unittest.mock import patch
+from utils.compression import compress_text, decompress_text, is_compressed, ZLIB_PREFIX
+
+
+def test_compress_round_trip():
+    """测试超过阈值的文本压缩后可以还原"""
+    text = '{"alert": "CPU使用率过高", "value": 95}\n' * 100
+    with patch('utils.compression.Config.COMPRESSION_MIN_SIZE', 1024), \
+            patch('utils.compression.Config.COMPRESSION_ALGORITHM', 'zlib'):
+        compressed = compress_text(text)
+
+    assert isinstance(compressed, bytes) and compressed.startswith(ZLIB_PREFIX)
+    assert len(compressed) < len(text.encode('utf-8')) / 5
+    assert decompress_text(compressed) == text
+
+
+def test_small_or_plain_values_unchanged():
+    """测试小文本、非文本和未压缩的值原样返回"""
+    with patch('utils.compression.Config.COMPRESSION_MIN_SIZE', 1024):
+        assert compress_text("你好") == "你好"
+        assert compress_text(None) is None
+
+    with patch('utils.compression.Config.COMPRESSION_ENABLED', False):
+        assert compress_text("x" * 4096) == "x" * 4096
+
+    assert decompress_text("plain text") == "plain text"
+    assert decompress_text(None) is None
+    assert not is_compressed(b"raw bytes")
+    assert is_compressed(ZLIB_PREFIX + zlib.compress(b"x"))
@@ -4,7 +4,7 @@
 import pytest
 from utils.helpers import (
     ensure_utf8, is_markdown, is_bot_mentioned, remove_mentions_improved,
-    format_data_for_ai, create_admin_token, validate_admin_token
+    format_data_for_ai, create_admin_token, validate_admin_token, invalidate_user_admin_tokens
 )
 from config import Config
 
@@ -42,8 +42,17 @@ def test_is_markdown():
     assert is_markdown("- 列表项") is True
     assert is_markdown("1. 有序列表") is True
 
+    # 图片、链接、引用、水平线、多级标题
+    assert is_markdown("![图](http://a/b.png)") is True
+    assert is_markdown("参考[文档](http://a)") is True
+    assert is_markdown("> 引用") is True
+    assert is_markdown("上文\n---\n下文") is True
+    assert is_markdown("###### 六级标题") is True
+
     # 普通文本
     assert is_markdown("普通文本") is False
+    assert is_markdown("#话题 不是标题") is False
+    assert is_markdown("价格 3.5 元，2-3 天") is False
 
 
 def test_is_bot_mentioned():
@@ -72,6 +81,7 @@ def test_remove_mentions_improved():
     assert remove_mentions_improved("你好 @TestBot", mentions) == "你好"
     assert remove_mentions_improved("@TestBot", mentions) == ""
     assert remove_mentions_improved("@TestBot  你好  世界", mentions) == "你好 世界"
+    assert remove_mentions_improved("@_user_1 你好 @TestBot 世界", mentions) == "你好 世界"
 
 
 def test_format_data_for_ai():
@@ -116,4 +126,46 @@ def test_admin_token_lifecycle(test_db):
 
     # 验证空token
     valid, _ = validate_admin_token(None)
-    assert valid is False
\ No newline at end of file
+    assert valid is False
+
+
+def test_admin_token_cache(test_db):
+    """测试token验证缓存和失效"""
+    from unittest.mock import patch
+    from models.user import add_user
+
+    user_id = "admin_cache_test"
+    add_user(user_id, "Admin Cache", 1)
+    token = create_admin_token(user_id)
+    assert validate_admin_token(token) == (True, user_id)
+
+    # 缓存有效期内不访问数据库
+    with patch('models.database.get_db_connection') as connection:
+        assert validate_admin_token(token) == (True, user_id)
+        connection.assert_not_called()
+
+    # 失效后立即生效
+    assert invalidate_user_admin_tokens(user_id) is True
+    assert validate_admin_token(token) == (False, None)
+
+
+def test_admin_token_activity_throttle(test_db, monkeypatch):
+    """测试缓存过期重新查询数据库时，活动时间仍然最多每ADMIN_TOKEN_ACTIVITY_INTERVAL秒写入一次"""
+    from unittest.mock import patch
+    from models.user import add_user
+
+    user_id = "admin_throttle_test"
+    add_user(user_id, "Admin Throttle", 1)
+    token = create_admin_token(user_id)
+
+    # 缓存立即过期，每次验证都查询数据库
+    monkeypatch.setattr(Config, "ADMIN_TOKEN_CACHE_TTL", 0)
+    monkeypatch.setattr(Config, "ADMIN_TOKEN_ACTIVITY_INTERVAL", 3600)
+    with patch('utils.helpers._persist_token_activity') as persist:
+        for _ in range(3):
+            assert validate_admin_token(token) == (True, user_id)
+        assert persist.call_count == 1
+
+        monkeypatch.setattr(Config, "ADMIN_TOKEN_ACTIVITY_INTERVAL", 0)
+        assert validate_admin_token(token) == (True, user_id)
+        assert persist.call_count == 2
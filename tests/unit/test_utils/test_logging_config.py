@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import queue
+import logging
+import logging.handlers
+from config import Config
+from utils import tracing
+from utils.metrics import LOG_DROPPED
+from utils.logging_config import SamplingFilter, AsyncQueueHandler, JsonFormatter, create_file_handler
+
+
+def make_record(name, message, *args, level=logging.INFO):
+    return logging.LogRecord(name, level, __file__, 1, message, args, None)
+
+
+def test_sampling_filter_by_logger_name():
+    """测试按logger名称前缀采样，WARNING及以上和未配置的logger全部保留"""
+    sampler = SamplingFilter({"services.dify_service.stream": 0.1, "services.lark_service.send": 0})
+    sampled = LOG_DROPPED.value("sampled")
+
+    kept = [sampler.filter(make_record("services.dify_service.stream", "Node started")) for _ in range(20)]
+    assert kept.count(True) == 2
+    assert sampler.filter(make_record("services.dify_service.stream", "x", level=logging.WARNING))
+    assert not sampler.filter(make_record("services.lark_service.send", "消息发送成功"))
+    assert sampler.filter(make_record("services.dify_service", "Message stream ended"))
+    assert LOG_DROPPED.value("sampled") == sampled + 19
+
+
+def test_queue_handler_truncates_and_drops_when_full(monkeypatch):
+    """测试消息在调用线程中截断并附加trace_id，队列满时丢弃而不阻塞"""
+    monkeypatch.setattr(Config, "LOG_MAX_MESSAGE_LENGTH", 10)
+    log_queue = queue.Queue(maxsize=1)
+    handler = AsyncQueueHandler(log_queue)
+    full = LOG_DROPPED.value("queue_full")
+
+    with tracing.start_trace("飞书事件"):
+        trace_id = tracing.current_trace_id()
+        handler.handle(make_record("handlers.lark_handler", "收到请求: %s", "x" * 100))
+    handler.handle(make_record("handlers.lark_handler", "第二条"))
+
+    record = log_queue.get_nowait()
+    assert record.getMessage() == "收到请求: xxxx...（已截断，共106字符）"
+    assert record.trace_id == trace_id
+    assert LOG_DROPPED.value("queue_full") == full + 1
+
+    line = json.loads(JsonFormatter().format(record))
+    assert line["message"] == record.getMessage()
+    assert line["trace_id"] == trace_id and line["level"] == "INFO"
+
+
+def test_file_handler_rotation_mode(monkeypatch, tmp_path):
+    """测试LOG_ROTATE_WHEN为空时按大小轮转，否则按时间轮转"""
+    monkeypatch.setattr(Config, "LOG_ROTATE_WHEN", "")
+    handler = create_file_handler(str(tmp_path / "logs" / "bot.log"))
+    assert isinstance(handler, logging.handlers.RotatingFileHandler)
+    handler.close()
+
+    monkeypatch.setattr(Config, "LOG_ROTATE_WHEN", "midnight")
+    handler = create_file_handler(str(tmp_path / "bot.log"))
+    assert isinstance(handler, logging.handlers.TimedRotatingFileHandler)
+    handler.close()
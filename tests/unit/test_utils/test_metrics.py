@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+from utils.metrics import Registry, DB_DURATION, register_executor, instrument_db_functions, registry
+
+
+def test_counter_and_histogram_render():
+    """测试计数器和直方图按Prometheus文本格式输出，直方图的桶为累计值"""
+    metrics = Registry()
+    events = metrics.counter("test_events_total", "事件数", ("schema", "result"))
+    latency = metrics.histogram("test_latency_seconds", "耗时", ("api",), buckets=(0.1, 1))
+
+    events.inc("2.0", "ok")
+    events.inc("2.0", "ok")
+    events.inc("1.0", "error")
+    for value in (0.05, 0.5, 5):
+        latency.observe(value, "send_message")
+
+    text = metrics.render()
+    assert '# TYPE test_events_total counter' in text
+    assert 'test_events_total{schema="2.0",result="ok"} 2' in text
+    assert 'test_events_total{schema="1.0",result="error"} 1' in text
+    assert 'test_latency_seconds_bucket{api="send_message",le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{api="send_message",le="1"} 2' in text
+    assert 'test_latency_seconds_bucket{api="send_message",le="+Inf"} 3' in text
+    assert 'test_latency_seconds_count{api="send_message"} 3' in text
+    assert latency.snapshot("send_message") == (3, 5.55)
+    assert metrics.counter("test_events_total", "事件数", ("schema", "result")) is events
+
+
+def test_gauge_collects_executor_at_scrape_time():
+    """测试线程池的排队任务数和最大线程数在抓取时计算，标签特殊字符被转义"""
+    metrics = Registry()
+    depth = metrics.gauge("test_queue_depth", "排队任务数", ("queue",))
+    depth.register(lambda: {('say "hi"',): 3})
+    depth.register(lambda: 1 / 0)  # 出错的来源被跳过
+    assert 'test_queue_depth{queue="say \\"hi\\""} 3' in metrics.render()
+
+    executor = ThreadPoolExecutor(max_workers=2)
+    register_executor("test_pool", executor)
+    try:
+        text = registry.render()
+        assert 'lark_bot_pool_max_threads{pool="test_pool"} 2' in text
+        assert 'lark_bot_queue_depth{queue="test_pool"} 0' in text
+    finally:
+        executor.shutdown()
+
+
+def test_instrument_db_functions():
+    """测试只包装模块中定义的公开普通函数"""
+    namespace = {'__name__': 'models.fake'}
+    exec("def get_item(item_id):\n    return item_id * 2\n"
+         "def _helper():\n    return 1\n"
+         "def iter_items():\n    yield 1\n", namespace)
+    namespace['imported'] = len
+    originals = dict(namespace)
+
+    instrument_db_functions(namespace)
+
+    assert namespace['get_item'] is not originals['get_item']
+    assert namespace['get_item'].__name__ == "get_item"
+    for name in ('_helper', 'iter_items', 'imported'):
+        assert namespace[name] is originals[name]
+
+    count, _ = DB_DURATION.snapshot("fake.get_item")
+    assert namespace['get_item'](21) == 42
+    assert DB_DURATION.snapshot("fake.get_item")[0] == count + 1
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils import tracing
+
+
+def test_spans_nest_and_follow_bound_tasks():
+    """测试span的父子关系，以及bind后提交到线程池的任务归属于同一个trace"""
+    tracing.clear_traces()
+
+    def send(content):
+        with tracing.span("feishu.send_message", size=len(content)):
+            return tracing.current_trace_id()
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with tracing.start_trace("飞书事件", schema="2.0"):
+            tracing.set_trace_attribute("user_id", "ou_1")
+            trace_id = tracing.current_trace_id()
+            with tracing.span("dify.chat") as chat:
+                chat.set_attribute("model", "gpt")
+                tracing.record_span("dify.first_content", time.perf_counter())
+                worker_trace_id = executor.submit(tracing.bind(send), "处理中").result()
+
+        # trace结束后没有当前trace，span不做记录
+        assert tracing.current_trace_id() is None
+        assert executor.submit(send, "x").result() is None
+
+    assert worker_trace_id == trace_id
+    trace = tracing.get_trace(trace_id).to_dict()
+    spans = {span["name"]: span for span in trace["spans"]}
+    assert trace["attributes"] == {"schema": "2.0", "user_id": "ou_1"}
+    assert spans["飞书事件"]["depth"] == 0
+    assert spans["dify.chat"]["attributes"] == {"model": "gpt"}
+    assert spans["dify.first_content"]["parent_id"] == spans["dify.chat"]["span_id"]
+    assert spans["feishu.send_message"]["parent_id"] == spans["dify.chat"]["span_id"]
+    assert spans["feishu.send_message"]["depth"] == 2
+
+
+def test_errors_sorting_and_otlp_export():
+    """测试异常记录到span，列表按耗时排序，以及OTLP JSON结构"""
+    tracing.clear_traces()
+
+    with tracing.start_trace("Webhook调用"):
+        pass
+    try:
+        with tracing.start_trace("飞书事件"):
+            time.sleep(0.01)
+            raise ValueError("boom")
+    except ValueError:
+        pass
+
+    slowest, fastest = tracing.get_traces(sort="slowest")
+    assert slowest.name == "飞书事件" and slowest.error == "ValueError: boom"
+    assert [trace.name for trace in tracing.get_traces(sort="recent")] == ["飞书事件", "Webhook调用"]
+    assert [trace.name for trace in tracing.get_traces(name="Webhook调用")] == ["Webhook调用"]
+
+    exported = tracing.to_otlp([slowest])
+    spans = exported["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert len(spans) == 1
+    assert spans[0]["traceId"] == slowest.trace_id and len(spans[0]["spanId"]) == 16
+    assert spans[0]["status"] == {"code": 2, "message": "ValueError: boom"}
+    assert int(spans[0]["endTimeUnixNano"]) - int(spans[0]["startTimeUnixNano"]) >= 10_000_000
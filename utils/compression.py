@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import zlib
+import logging
+
+from config import Config
+
+try:
+    import zstandard
+except ImportError:  # zstandard为可选依赖，未安装时使用zlib
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# 压缩后的值以BLOB存储，开头为格式标记；普通文本以TEXT存储，两者不会混淆
+ZLIB_PREFIX = b"\x00z1"
+ZSTD_PREFIX = b"\x00zs"
+
+
+def is_compressed(value):
+    """判断数据库中的值是否为压缩格式"""
+    return isinstance(value, bytes) and value[:3] in (ZLIB_PREFIX, ZSTD_PREFIX)
+
+
+def compress_text(text, min_size=None):
+    """超过阈值的文本压缩为带格式标记的bytes，其余原样返回
+
+    压缩后没有变小时也原样返回。
+    """
+    if not isinstance(text, str) or not Config.COMPRESSION_ENABLED:
+        return text
+
+    min_size = Config.COMPRESSION_MIN_SIZE if min_size is None else min_size
+    data = text.encode('utf-8')
+    if len(data) < min_size:
+        return text
+
+    if Config.COMPRESSION_ALGORITHM == "zstd" and zstandard is not None:
+        compressed = ZSTD_PREFIX + zstandard.ZstdCompressor(level=Config.COMPRESSION_LEVEL).compress(data)
+    else:
+        compressed = ZLIB_PREFIX + zlib.compress(data, Config.COMPRESSION_LEVEL)
+
+    if len(compressed) >= len(data):
+        return text
+    return compressed
+
+
+def decompress_text(value):
+    """还原compress_text压缩的值，未压缩的值原样返回"""
+    if not is_compressed(value):
+        return value
+
+    prefix, payload = value[:3], value[3:]
+    if prefix == ZSTD_PREFIX:
+        if zstandard is None:
+            raise RuntimeError("数据使用zstd压缩，但未安装zstandard")
+        data = zstandard.ZstdDecompressor().decompress(payload)
+    else:
+        data = zlib.decompress(payload)
+    return data.decode('utf-8')
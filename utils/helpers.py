@@ -8,14 +8,38 @@ import socket
 import time
 import secrets
 import logging
+import threading
 import urllib.request
 import urllib.parse
 from datetime import datetime, timedelta
 
 from config import Config
+from utils.tracing import record_span
 
 logger = logging.getLogger(__name__)
 
+# 管理员token验证缓存: token -> {user_id, expired_at, cached_until, persisted_at}
+_admin_token_cache = {}
+_admin_token_lock = threading.Lock()
+# 每次从缓存中移除token时加一，查询数据库期间token被失效时，查询结果不再放回缓存
+_admin_token_generation = 0
+
+
+# Markdown特征，按顺序逐个匹配，任一命中即认为是Markdown
+# 每个正则以固定字符开头，便于正则引擎快速跳过普通文本；代码块和图片分别被行内代码和链接覆盖，无需单独匹配
+_MARKDOWN_PATTERNS = [re.compile(pattern, re.MULTILINE) for pattern in (
+    r'#\s+\S+',  # 标题（#{1,6}后跟空白时，最后一个#一定满足）
+    r'\*\*.*?\*\*',  # 粗体
+    r'`.*?`',  # 行内代码、代码块
+    r'\[.*?\]\(.*?\)',  # 链接、图片
+    r'\*[^*]+\*',  # 斜体（更严格的匹配）
+    r'^(?:\s*(?:[*+-]|\d+\.|>)\s+|-{3,}$)',  # 无序列表、有序列表、引用、水平线，按行首合并为一次扫描
+)]
+
+_MENTION_RE = re.compile(r'@\S+')
+_USER_PLACEHOLDER_RE = re.compile(r'@_user_\d+')
+_WHITESPACE_RE = re.compile(r'\s+')
+
 
 def ensure_utf8(text):
     """确保文本是UTF-8编码的字符串"""
@@ -47,7 +71,7 @@ def clean_command_args(args_text):
         return ""
 
     # 移除@开头的所有内容（包括@_user_数字格式）
-    cleaned = re.sub(r'@\S+', '', args_text).strip()
+    cleaned = _MENTION_RE.sub('', args_text).strip()
 
     # 如果清理后为空，则取第一个单词
     if not cleaned:
@@ -67,25 +91,7 @@ def clean_command_args(args_text):
 
 def is_markdown(text):
     """简单判断文本是否包含Markdown格式"""
-    markdown_patterns = [
-        r'#{1,6}\s+\S+',  # 标题
-        r'\*\*.*?\*\*',  # 粗体
-        r'\*[^*]+\*',  # 斜体（更严格的匹配）
-        r'`.*?`',  # 行内代码
-        r'```[\s\S]*?```',  # 代码块
-        r'!\[.*?\]\(.*?\)',  # 图片：![alt](url)
-        r'\[.*?\]\(.*?\)',  # 链接：[text](url)
-        r'^\s*[*+-]\s+',  # 无序列表
-        r'^\s*\d+\.\s+',  # 有序列表
-        r'^\s*>\s+',  # 引用
-        r'^-{3,}$',  # 水平线
-    ]
-
-    for pattern in markdown_patterns:
-        if re.search(pattern, text, re.MULTILINE):
-            return True
-
-    return False
+    return any(pattern.search(text) for pattern in _MARKDOWN_PATTERNS)
 
 
 def is_bot_mentioned(mentions):
@@ -113,20 +119,13 @@ def remove_mentions_improved(text, mentions):
     for mention in mentions:
         mention_name = mention.get("name", "")
         if mention_name:
-            # 更全面的@移除模式
-            patterns = [
-                f"@{mention_name}",
-                f"@{mention_name} ",
-                f" @{mention_name}",
-                f" @{mention_name} "
-            ]
-            for pattern in patterns:
-                cleaned_text = cleaned_text.replace(pattern, "")
+            # 前后的空格在最后统一清理
+            cleaned_text = cleaned_text.replace(f"@{mention_name}", "")
 
     # 移除@_user_数字格式
-    cleaned_text = re.sub(r'@_user_\d+', '', cleaned_text)
+    cleaned_text = _USER_PLACEHOLDER_RE.sub('', cleaned_text)
     # 清理多余的空格
-    cleaned_text = re.sub(r'\s+', ' ', cleaned_text).strip()
+    cleaned_text = _WHITESPACE_RE.sub(' ', cleaned_text).strip()
     return cleaned_text
 
 
@@ -197,6 +196,42 @@ def format_data_for_ai(data):
     return json.dumps(data, ensure_ascii=False, indent=2)
 
 
+class StageTimer:
+    """记录一次处理中各阶段的耗时"""
+
+    def __init__(self, name):
+        self.name = name
+        self.started_at = self.last_at = time.perf_counter()
+        self.stages = []
+
+    def mark(self, stage):
+        """记录从上一个阶段结束到现在的耗时，处于trace中时同时记录为span"""
+        now = time.perf_counter()
+        self.stages.append((stage, now - self.last_at))
+        record_span(f"{self.name}.{stage}", self.last_at, now)
+        self.last_at = now
+
+    def total(self):
+        return self.last_at - self.started_at
+
+    def log(self):
+        parts = ", ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in self.stages)
+        logger.info(f"{self.name}耗时: {parts}, 总计={self.total() * 1000:.0f}ms")
+
+
+def _forget_admin_tokens(token=None, user_id=None):
+    """从token缓存中移除指定token或指定用户的全部token"""
+    global _admin_token_generation
+
+    with _admin_token_lock:
+        _admin_token_generation += 1
+        if token is not None:
+            _admin_token_cache.pop(token, None)
+        if user_id is not None:
+            for cached_token in [t for t, entry in _admin_token_cache.items() if entry['user_id'] == user_id]:
+                del _admin_token_cache[cached_token]
+
+
 def create_admin_token(user_id):
     """创建管理员token"""
     from models.database import get_db_connection
@@ -219,14 +254,58 @@ def create_admin_token(user_id):
     conn.commit()
     conn.close()
 
+    _forget_admin_tokens(user_id=user_id)
     return token
 
 
+def _persist_token_activity(token, expired_at):
+    """写入token的最后活动时间和新的过期时间"""
+    from models.database import get_db_connection
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE admin_tokens SET last_active_at = CURRENT_TIMESTAMP, expired_at = ? WHERE token = ?",
+        (expired_at, token)
+    )
+    conn.commit()
+    conn.close()
+
+
 def validate_admin_token(token):
-    """验证管理员token是否有效"""
+    """验证管理员token是否有效
+
+    验证结果在内存中缓存ADMIN_TOKEN_CACHE_TTL秒，期间不查询数据库；
+    滑动过期时间在内存中更新，每个token最多每ADMIN_TOKEN_ACTIVITY_INTERVAL秒写入一次数据库。
+    """
     if not token:
         return False, None
 
+    now = datetime.now()
+    expire_delta = timedelta(minutes=Config.ADMIN_TOKEN_EXPIRE_MINUTES)
+
+    persisted_at = None
+    with _admin_token_lock:
+        generation = _admin_token_generation
+        entry = _admin_token_cache.get(token)
+        if entry and time.monotonic() < entry['cached_until'] and entry['expired_at'] > now:
+            entry['expired_at'] = now + expire_delta
+            persist = time.monotonic() - entry['persisted_at'] >= Config.ADMIN_TOKEN_ACTIVITY_INTERVAL
+            if persist:
+                entry['persisted_at'] = time.monotonic()
+            user_id = entry['user_id']
+            expired_at = entry['expired_at']
+        else:
+            # 缓存过期后重新查询数据库，上次写入活动时间的时刻沿用到新的缓存项
+            if entry:
+                persisted_at = entry['persisted_at']
+            entry = None
+
+    if entry:
+        if persist:
+            _persist_token_activity(token, expired_at)
+        return True, user_id
+
     from models.database import get_db_connection
 
     conn = get_db_connection()
@@ -240,37 +319,36 @@ def validate_admin_token(token):
     """, (token,))
 
     result = cursor.fetchone()
+    conn.close()
 
-    if not result:
-        conn.close()
-        return False, None
-
-    if not result['is_admin']:
-        conn.close()
+    if not result or not result['is_admin']:
+        _forget_admin_tokens(token=token)
         return False, None
 
-    # 更新最后活动时间和过期时间
-    cursor.execute(
-        "UPDATE admin_tokens SET last_active_at = CURRENT_TIMESTAMP WHERE token = ?",
-        (token,)
-    )
-
-    new_expired_at = datetime.now() + timedelta(minutes=Config.ADMIN_TOKEN_EXPIRE_MINUTES)
-    cursor.execute(
-        "UPDATE admin_tokens SET expired_at = ? WHERE token = ?",
-        (new_expired_at, token)
-    )
-
-    conn.commit()
+    # 更新最后活动时间和过期时间，同样最多每ADMIN_TOKEN_ACTIVITY_INTERVAL秒写入一次
     user_id = result['user_id']
-    conn.close()
+    expired_at = now + expire_delta
+    if persisted_at is None or time.monotonic() - persisted_at >= Config.ADMIN_TOKEN_ACTIVITY_INTERVAL:
+        _persist_token_activity(token, expired_at)
+        persisted_at = time.monotonic()
+
+    with _admin_token_lock:
+        if _admin_token_generation == generation:
+            _admin_token_cache[token] = {
+                'user_id': user_id,
+                'expired_at': expired_at,
+                'cached_until': time.monotonic() + Config.ADMIN_TOKEN_CACHE_TTL,
+                'persisted_at': persisted_at,
+            }
 
     return True, user_id
 
 
 def invalidate_admin_token(token):
     """使管理员token失效"""
-    from models.database import get_db_connection
+    from models.database import get_db_connection, commit_unit_of_work
+
+    _forget_admin_tokens(token=token)
 
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -278,6 +356,29 @@ def invalidate_admin_token(token):
     conn.commit()
     affected = conn.total_changes
     conn.close()
+
+    # 提交后再次移除，丢弃在提交前读到旧数据的验证结果
+    commit_unit_of_work()
+    _forget_admin_tokens(token=token)
+    return affected > 0
+
+
+def invalidate_user_admin_tokens(user_id):
+    """使用户的所有管理员token失效，返回是否有token被失效"""
+    from models.database import get_db_connection, commit_unit_of_work
+
+    _forget_admin_tokens(user_id=user_id)
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE admin_tokens SET is_valid = 0 WHERE user_id = ?", (user_id,))
+    conn.commit()
+    affected = conn.total_changes
+    conn.close()
+
+    # 提交后再次移除，丢弃在提交前读到旧数据的验证结果
+    commit_unit_of_work()
+    _forget_admin_tokens(user_id=user_id)
     return affected > 0
 
 
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+日志配置：异步写入、轮转、JSON格式、长消息截断和高频日志采样
+
+请求线程只把日志放入内存队列，由QueueListener的后台线程写入文件和控制台，磁盘I/O不在请求路径上。
+队列满时丢弃新日志（计入 lark_bot_log_records_dropped_total），不会阻塞请求。
+
+高频日志使用独立的子logger（如 services.dify_service.stream），按 Config.LOG_SAMPLE_RATES 采样，
+记录日志时请使用 logger.info("...: %s", data) 的形式，被采样丢弃的日志不会格式化大对象。
+"""
+
+import os
+import json
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+from datetime import datetime
+
+from config import Config
+from utils import tracing
+from utils.metrics import LOG_DROPPED, QUEUE_DEPTH
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def truncate_message(message, limit=None):
+    """超过limit个字符时截断，并注明原始长度"""
+    limit = limit or Config.LOG_MAX_MESSAGE_LENGTH
+    if len(message) <= limit:
+        return message
+    return f"{message[:limit]}...（已截断，共{len(message)}字符）"
+
+
+class SamplingFilter(logging.Filter):
+    """按logger名称对高频日志采样，比例为rate时每 1/rate 条保留一条，WARNING及以上级别全部保留"""
+
+    def __init__(self, rates):
+        super().__init__()
+        # 名称长的优先匹配，子logger可以单独设置比例
+        self.rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _rate(self, name):
+        for prefix, rate in self.rates:
+            if name == prefix or name.startswith(prefix + "."):
+                return prefix, rate
+        return None, 1
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        prefix, rate = self._rate(record.name)
+        if rate >= 1:
+            return True
+        if rate > 0:
+            interval = max(1, round(1 / rate))
+            with self._lock:
+                count = self._counters.get(prefix, 0)
+                self._counters[prefix] = count + 1
+            if count % interval == 0:
+                return True
+        LOG_DROPPED.inc("sampled")
+        return False
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """在调用线程中格式化消息（截断、附加trace_id），写入由后台线程完成"""
+
+    def prepare(self, record):
+        message = truncate_message(record.getMessage())
+        # 复制一份，避免修改其他handler（如测试中的caplog）看到的record
+        record = logging.makeLogRecord(record.__dict__)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = message
+        record.message = message
+        record.args = None
+        record.exc_info = None
+        record.trace_id = tracing.current_trace_id()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc("queue_full")
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行JSON"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        trace_id = getattr(record, 'trace_id', None)
+        if trace_id:
+            entry["trace_id"] = trace_id
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def create_file_handler(path=None):
+    """按 LOG_ROTATE_WHEN 创建按时间或按大小轮转的文件handler"""
+    path = path or Config.LOG_FILE
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    if Config.LOG_ROTATE_WHEN:
+        return logging.handlers.TimedRotatingFileHandler(
+            path, when=Config.LOG_ROTATE_WHEN, backupCount=Config.LOG_BACKUP_COUNT, encoding='utf-8')
+    return logging.handlers.RotatingFileHandler(
+        path, maxBytes=Config.LOG_MAX_BYTES, backupCount=Config.LOG_BACKUP_COUNT, encoding='utf-8')
+
+
+def setup_logging():
+    """配置根logger，重复调用时直接返回已启动的QueueListener"""
+    global _listener
+
+    with _setup_lock:
+        if _listener is not None:
+            return _listener
+
+        formatter = JsonFormatter() if Config.LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+        handlers = [create_file_handler(), logging.StreamHandler()]
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        log_queue = queue.Queue(maxsize=Config.LOG_QUEUE_SIZE)
+        queue_handler = AsyncQueueHandler(log_queue)
+        queue_handler.addFilter(SamplingFilter(Config.LOG_SAMPLE_RATES))
+
+        root = logging.getLogger()
+        root.setLevel(Config.LOG_LEVEL)
+        root.addHandler(queue_handler)
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        # 退出时写完队列中剩余的日志
+        atexit.register(_listener.stop)
+
+        QUEUE_DEPTH.register(lambda: {("log",): log_queue.qsize()})
+        return _listener
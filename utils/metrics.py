@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+进程内指标：计数器、直方图和采集时计算的仪表，按Prometheus文本格式输出
+
+记录一次指标只做一次字典查找和加锁累加（直方图多一次二分查找），可以在生产环境常开；
+队列长度、线程池占用等仪表只在/metrics被抓取时才计算。
+"""
+
+import time
+import bisect
+import inspect
+import logging
+import threading
+from functools import wraps
+
+from utils import tracing
+
+logger = logging.getLogger(__name__)
+
+# 外部接口耗时的分桶（秒），覆盖从毫秒级到流式响应总时长上限
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# 数据库访问耗时的分桶（秒）
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """带标签的指标，标签值按定义时的标签名顺序传入"""
+
+    type = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.label_names}，实际为 {labels}")
+        return tuple(str(value) for value in labels)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type}"]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    type = "counter"
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = self.header()
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """固定分桶的直方图，内部按桶分别计数，输出时再累加为Prometheus的累计桶"""
+
+    type = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [各桶计数（最后一个为+Inf）, 总和, 次数]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, *labels):
+        """上下文管理器，记录with块的耗时"""
+        return _Timer(self, labels)
+
+    def snapshot(self, *labels):
+        """返回 (次数, 总和)，没有记录时为 (0, 0.0)"""
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return (state[2], state[1]) if state else (0, 0.0)
+
+    def render(self):
+        with self._lock:
+            values = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+        lines = self.header()
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, key, f'le="{_format_value(float(bound))}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class _Timer:
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.histogram.observe(time.perf_counter() - self.started_at, *self.labels)
+        return False
+
+
+class Gauge(_Metric):
+    """采集时计算的仪表
+
+    callback返回一个数值（无标签），或 {标签值元组: 数值}。
+    同一个仪表可以注册多个来源（如多个线程池），结果合并输出。
+    """
+
+    type = "gauge"
+
+    def __init__(self, name, description, labels=()):
+        super().__init__(name, description, labels)
+        self._callbacks = []
+
+    def register(self, callback):
+        with self._lock:
+            self._callbacks.append(callback)
+
+    def unregister(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def collect(self):
+        """返回 {标签值元组: 数值}，单个来源出错时跳过"""
+        with self._lock:
+            callbacks = list(self._callbacks)
+        values = {}
+        for callback in callbacks:
+            try:
+                result = callback()
+            except Exception as e:
+                logger.warning(f"采集指标 {self.name} 失败: {e}")
+                continue
+            if isinstance(result, dict):
+                values.update({self._key(key if isinstance(key, tuple) else (key,)): value
+                               for key, value in result.items()})
+            elif result is not None:
+                values[()] = result
+        return values
+
+    def render(self):
+        lines = self.header()
+        for key, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    """指标注册表，同名指标只创建一次"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, description, labels, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, description, labels, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"指标 {name} 已注册为 {metric.type}")
+            return metric
+
+    def counter(self, name, description, labels=()):
+        return self._get_or_create(Counter, name, description, labels)
+
+    def histogram(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        return self._get_or_create(Histogram, name, description, labels, buckets=buckets)
+
+    def gauge(self, name, description, labels=()):
+        return self._get_or_create(Gauge, name, description, labels)
+
+    def render(self):
+        """输出Prometheus文本格式（0.0.4）"""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# ==================== 全链路指标 ====================
+
+# 飞书事件
+EVENTS = registry.counter("lark_bot_events_total", "收到的飞书事件数", ("schema", "result"))
+EVENT_DURATION = registry.histogram("lark_bot_event_duration_seconds", "飞书事件处理耗时（直到返回响应）",
+                                    ("schema",))
+DUPLICATE_EVENTS = registry.counter("lark_bot_duplicate_events_total", "去重跳过的飞书事件数")
+
+# Dify
+DIFY_FIRST_BYTE = registry.histogram("lark_bot_dify_first_byte_seconds", "从发起请求到收到首个内容的耗时",
+                                     ("model", "dify_type"))
+DIFY_DURATION = registry.histogram("lark_bot_dify_duration_seconds", "Dify对话请求的总耗时",
+                                   ("model", "dify_type", "mode"))
+DIFY_REQUESTS = registry.counter("lark_bot_dify_requests_total", "Dify对话请求数",
+                                 ("model", "dify_type", "mode", "result"))
+DIFY_INFLIGHT = registry.gauge("lark_bot_dify_inflight_generations", "进行中的流式生成数")
+
+# 飞书开放平台
+FEISHU_REQUEST_DURATION = registry.histogram("lark_bot_feishu_request_seconds", "调用飞书接口的耗时", ("api",))
+FEISHU_SEND = registry.counter("lark_bot_feishu_send_total", "发送飞书消息的结果，code为飞书返回的错误码",
+                               ("code",))
+
+# Webhook
+WEBHOOK_CALLS = registry.counter("lark_bot_webhook_calls_total", "Webhook调用数", ("webhook", "status"))
+WEBHOOK_DURATION = registry.histogram("lark_bot_webhook_duration_seconds", "Webhook调用处理耗时", ("webhook",))
+
+# 数据库
+DB_DURATION = registry.histogram("lark_bot_db_function_seconds", "models中数据访问函数的耗时",
+                                 ("function",), buckets=DB_BUCKETS)
+
+# 队列与线程池
+QUEUE_DEPTH = registry.gauge("lark_bot_queue_depth", "等待处理的任务数", ("queue",))
+POOL_ACTIVE = registry.gauge("lark_bot_pool_active_threads", "线程池中正在执行任务的线程数", ("pool",))
+POOL_MAX = registry.gauge("lark_bot_pool_max_threads", "线程池的最大线程数", ("pool",))
+
+# 日志
+LOG_DROPPED = registry.counter("lark_bot_log_records_dropped_total",
+                               "未写入的日志数，reason为sampled（采样丢弃）或queue_full（队列已满）", ("reason",))
+
+
+def register_executor(name, executor):
+    """登记ThreadPoolExecutor，采集时输出其排队任务数、忙碌线程数和最大线程数
+
+    ThreadPoolExecutor没有公开这些数据，这里读取其内部属性，不存在时跳过。
+    """
+    def queue_depth():
+        return {(name,): executor._work_queue.qsize()}
+
+    def active():
+        idle = getattr(executor, '_idle_semaphore', None)
+        threads = len(executor._threads)
+        return {(name,): max(0, threads - idle._value) if idle is not None else threads}
+
+    QUEUE_DEPTH.register(queue_depth)
+    POOL_ACTIVE.register(active)
+    POOL_MAX.register(lambda: {(name,): executor._max_workers})
+
+
+def register_waitress(server, name="http"):
+    """登记waitress服务器的请求队列长度和工作线程占用"""
+    dispatcher = server.task_dispatcher
+    QUEUE_DEPTH.register(lambda: {(name,): len(dispatcher.queue)})
+    POOL_ACTIVE.register(lambda: {(name,): dispatcher.active_count})
+    POOL_MAX.register(lambda: {(name,): len(dispatcher.threads)})
+
+
+def instrument_db_functions(namespace, names=None):
+    """为模块中的公开函数记录耗时，在models模块末尾以 instrument_db_functions(globals()) 调用
+
+    只包装在该模块中定义的普通函数（不包括导入的函数和生成器），names指定时只包装其中列出的函数。
+    在模块末尾替换，其他模块 from models.xxx import yyy 时拿到的就是包装后的函数。
+    """
+    module = namespace['__name__']
+    prefix = module.rsplit('.', 1)[-1]
+    for attr, func in list(namespace.items()):
+        if attr.startswith('_') or (names is not None and attr not in names):
+            continue
+        if not inspect.isfunction(func) or func.__module__ != module or inspect.isgeneratorfunction(func):
+            continue
+        namespace[attr] = _timed_db_function(func, f"{prefix}.{attr}")
+
+
+def _timed_db_function(func, label):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            DB_DURATION.observe(time.perf_counter() - started_at, label)
+            tracing.record_span(f"db.{label}", started_at)
+    return wrapper
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+轻量级请求追踪
+
+每个收到的飞书事件、Webhook调用对应一个trace，处理过程中的各阶段记录为span（名称、父span、起止时间、属性）。
+当前trace和span保存在线程局部变量中；提交到线程池的任务用bind()包装后，其中的span归属于提交时的trace。
+结束的trace保存在内存环形缓冲区中，供 /admin/traces 查看，也可以导出为OTLP JSON。
+
+没有进行中的trace时，span()和record_span()不做任何记录，可以放心放在公共函数中。
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from functools import wraps
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# 当前线程的trace和span: _local.trace, _local.span_id
+_local = threading.local()
+
+# 最近结束的trace
+_recent = deque(maxlen=Config.TRACE_BUFFER_SIZE)
+_recent_lock = threading.Lock()
+
+
+def _new_id(size):
+    return os.urandom(size).hex()
+
+
+class Span:
+    """trace中的一个阶段，时间使用perf_counter，导出时换算为绝对时间"""
+
+    __slots__ = ('span_id', 'parent_id', 'name', 'start', 'end', 'attributes', 'error')
+
+    def __init__(self, name, parent_id, start, attributes=None):
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start = start
+        self.end = None
+        self.attributes = dict(attributes or {})
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+
+class Trace:
+    """一次事件处理的全部span，第一个span为根span"""
+
+    def __init__(self, name, attributes=None):
+        self.trace_id = _new_id(16)
+        self.started_at = time.time()
+        self._perf_start = time.perf_counter()
+        self.root = Span(name, None, self._perf_start, attributes)
+        self.spans = [self.root]
+        self.dropped_spans = 0
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self.root.name
+
+    @property
+    def duration(self):
+        """根span的耗时（秒），未结束时为到目前为止的耗时"""
+        return (self.root.end or time.perf_counter()) - self.root.start
+
+    @property
+    def error(self):
+        return self.root.error
+
+    def add_span(self, span):
+        """添加span，超过上限时丢弃并计数（如长时间流式响应中大量的数据库访问）"""
+        with self._lock:
+            if len(self.spans) >= Config.TRACE_MAX_SPANS:
+                self.dropped_spans += 1
+                return False
+            self.spans.append(span)
+            return True
+
+    def offset_ms(self, moment):
+        return (moment - self._perf_start) * 1000
+
+    def unix_nano(self, moment):
+        return int((self.started_at + moment - self._perf_start) * 1e9)
+
+    def to_dict(self):
+        """供模板和JSON接口使用的结构，span按开始时间排序并带有层级"""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+
+        depths = {None: -1}
+        rows = []
+        for span in spans:
+            depth = depths.get(span.parent_id, 0) + 1
+            depths[span.span_id] = depth
+            rows.append({
+                "span_id": span.span_id,
+                "parent_id": span.parent_id,
+                "name": span.name,
+                "depth": depth,
+                "offset_ms": self.offset_ms(span.start),
+                "duration_ms": (span.end - span.start) * 1000 if span.end is not None else None,
+                "attributes": dict(span.attributes),
+                "error": span.error,
+            })
+
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": datetime.fromtimestamp(self.started_at).strftime('%Y-%m-%d %H:%M:%S'),
+            "duration_ms": self.duration * 1000,
+            "finished": self.root.end is not None,
+            "attributes": dict(self.root.attributes),
+            "error": self.error,
+            "span_count": len(rows),
+            "dropped_spans": self.dropped_spans,
+            "spans": rows,
+        }
+
+
+class _NoopSpan:
+    """没有进行中的trace时使用"""
+
+    def set_attribute(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class _SpanScope:
+    """span的上下文管理器，进入时成为当前span，退出时恢复父span"""
+
+    def __init__(self, trace, span):
+        self.trace = trace
+        self.span = span
+
+    def set_attribute(self, key, value):
+        self.span.set_attribute(key, value)
+
+    def __enter__(self):
+        _local.span_id = self.span.span_id
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.span.end = time.perf_counter()
+        if exc_type is not None:
+            self.span.error = f"{exc_type.__name__}: {exc_value}"
+        _local.span_id = self.span.parent_id
+        return False
+
+
+class _TraceScope(_SpanScope):
+    """trace的上下文管理器，退出时把trace放入最近trace缓冲区"""
+
+    def __enter__(self):
+        self._previous = (getattr(_local, 'trace', None), getattr(_local, 'span_id', None))
+        _local.trace = self.trace
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        super().__exit__(exc_type, exc_value, tb)
+        _local.trace, _local.span_id = self._previous
+        with _recent_lock:
+            _recent.append(self.trace)
+        return False
+
+
+def start_trace(name, **attributes):
+    """开始一个trace，在with块中使用
+
+    已经处于trace中时（如事件处理中调用了另一个入口函数）只创建一个子span。
+    """
+    if not Config.TRACING_ENABLED:
+        return _NOOP
+    if getattr(_local, 'trace', None) is not None:
+        return span(name, **attributes)
+    trace = Trace(name, attributes)
+    return _TraceScope(trace, trace.root)
+
+
+def span(name, **attributes):
+    """在当前trace中开始一个span，在with块中使用，没有进行中的trace时不做记录"""
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return _NOOP
+    new_span = Span(name, getattr(_local, 'span_id', None), time.perf_counter(), attributes)
+    if not trace.add_span(new_span):
+        return _NOOP
+    return _SpanScope(trace, new_span)
+
+
+def record_span(name, started_at, ended_at=None, **attributes):
+    """记录已经结束的阶段，started_at/ended_at为perf_counter时间，父span为当前span"""
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return
+    recorded = Span(name, getattr(_local, 'span_id', None), started_at, attributes)
+    recorded.end = time.perf_counter() if ended_at is None else ended_at
+    trace.add_span(recorded)
+
+
+def set_attribute(key, value):
+    """设置当前span的属性"""
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return
+    span_id = getattr(_local, 'span_id', None)
+    with trace._lock:
+        for item in reversed(trace.spans):
+            if item.span_id == span_id:
+                item.set_attribute(key, value)
+                return
+
+
+def set_trace_attribute(key, value):
+    """设置当前trace根span的属性（如用户ID），在列表页中显示"""
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.root.set_attribute(key, value)
+
+
+def current_trace_id():
+    trace = getattr(_local, 'trace', None)
+    return trace.trace_id if trace is not None else None
+
+
+def traced(name):
+    """装饰器，函数的执行记录为一个span"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_request(name):
+    """装饰器，每次调用开始一个新的trace，用于请求入口"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with start_trace(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind(func):
+    """包装提交到其他线程执行的函数，使其中的span归属于当前trace和span"""
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return func
+    parent_id = getattr(_local, 'span_id', None)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = (getattr(_local, 'trace', None), getattr(_local, 'span_id', None))
+        _local.trace, _local.span_id = trace, parent_id
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.trace, _local.span_id = previous
+    return wrapper
+
+
+# ==================== 查询与导出 ====================
+
+def get_traces(sort="slowest", limit=100, name=None):
+    """获取最近的trace，sort为slowest（耗时从长到短）或recent（最新的在前）"""
+    with _recent_lock:
+        traces = list(_recent)
+    if name:
+        traces = [trace for trace in traces if trace.name == name]
+    if sort == "slowest":
+        traces.sort(key=lambda trace: trace.duration, reverse=True)
+    else:
+        traces.reverse()
+    return traces[:limit]
+
+
+def get_trace(trace_id):
+    with _recent_lock:
+        for trace in _recent:
+            if trace.trace_id == trace_id:
+                return trace
+    return None
+
+
+def clear_traces():
+    with _recent_lock:
+        _recent.clear()
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes):
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+def to_otlp(traces, service_name="lark-dify-bot"):
+    """导出为OTLP/HTTP JSON格式（ExportTraceServiceRequest），可直接POST到采集器的 /v1/traces"""
+    spans = []
+    for trace in traces:
+        with trace._lock:
+            trace_spans = list(trace.spans)
+        for item in trace_spans:
+            end = item.end if item.end is not None else time.perf_counter()
+            otlp_span = {
+                "traceId": trace.trace_id,
+                "spanId": item.span_id,
+                "name": item.name,
+                # 根span为服务端接收请求，其余为内部阶段
+                "kind": 2 if item is trace.root else 1,
+                "startTimeUnixNano": str(trace.unix_nano(item.start)),
+                "endTimeUnixNano": str(trace.unix_nano(end)),
+                "attributes": _otlp_attributes(item.attributes),
+                "status": {"code": 2, "message": item.error} if item.error else {"code": 1},
+            }
+            if item.parent_id:
+                otlp_span["parentSpanId"] = item.parent_id
+            spans.append(otlp_span)
+
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": service_name})},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}],
+        }]
+    }